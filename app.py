@@ -6,16 +6,18 @@ from datetime import datetime
 
 import streamlit as st
 from streamlit_pdf_viewer import pdf_viewer
-from src import AzureInvoiceParser, LlamaInvoiceParser
-from src.translation import MarkdownTranslator
+from src.clients import get_azure_parser, get_invoice_parser, get_translator, start_warm_up
 from src.cache_manager import (
     initialize_session_cache, 
     clear_session_cache,
-    get_file_hash,
-    get_cached_or_compute_markdown,
-    get_cached_or_compute_translation,
-    get_cached_or_compute_extraction
+    stream_markdown_and_translation,
+    get_cached_or_compute_extraction,
+    plan_extraction,
+    check_duplicate,
+    register_processed_invoice,
+    legacy_file_hash_warning
 )
+from src.routing import needs_translation
 from src.data_processors import (
     convert_to_csv_data,
     create_summary_tables,
@@ -24,6 +26,9 @@ from src.data_processors import (
     convert_dataframe_to_csv_string,
     create_comprehensive_csv_data
 )
+from src.bbox_store import bounding_boxes_to_json
+from src.hashing import InvoiceFile
+from src.metrics import start_metrics_server
 from src.file_utils import (
     extract_original_filename,
     create_filename_with_task,
@@ -41,10 +46,68 @@ st.set_page_config(
 # Initialize session state for caching
 initialize_session_cache()
 
-# Initialize parsers and translator
-azure_parser = AzureInvoiceParser()
-llama_parser = LlamaInvoiceParser()
-translator = MarkdownTranslator()
+# Shared parsers and translator, created once per process and reused across reruns and sessions
+azure_parser = get_azure_parser()
+# Llama extraction; markdown parsing fails over between PARSE_BACKENDS when several are configured
+llama_parser = get_invoice_parser()
+translator = get_translator()
+start_warm_up()
+# Stage latencies, cache hits and token usage on a local /metrics endpoint when METRICS_PORT is set
+start_metrics_server()
+
+# Invoices cached under the old MD5 file hashes are reparsed until cache_admin migrate-hashes is run
+legacy_warning = legacy_file_hash_warning()
+if legacy_warning:
+    st.warning(legacy_warning)
+
+def show_markdown_pages(pages):
+    """Show parsed pages (index -> document) in one tab per page"""
+    tabs = st.tabs([f"Page {i+1}" for i in sorted(pages)])
+    
+    # Display each page in its respective tab
+    for i, tab in zip(sorted(pages), tabs):
+        with tab:
+            # Create scrollable container for wide content
+            content = pages[i].text.replace('</div>', '&lt;/div&gt;')
+            st.markdown(
+                f"""
+                <div style="overflow-x: auto; max-width: 100%; border: 1px solid #e0e0e0; padding: 10px; border-radius: 5px; background-color: #fafafa;">
+                {content}
+                
+                """,
+                unsafe_allow_html=True
+            )
+
+def show_translated_pages(pages, translations):
+    """Show translated pages (index -> result) in one tab per parsed page"""
+    if not pages:
+        st.caption("Waiting for the first parsed pages...")
+        return
+    translation_tabs = st.tabs([f"Page {i+1}" for i in sorted(pages)])
+    
+    # Display each page
+    for i, tab in zip(sorted(pages), translation_tabs):
+        with tab:
+            if i not in translations:
+                st.caption("Translating...")
+                continue
+            result = translations[i]
+            # Create scrollable container for wide content
+            content = result['translated_text'].replace('</div>', '&lt;/div&gt;')
+            # Remove markdown code block wrapper if present
+            if content.startswith('```markdown\n'):
+                content = content[12:]  # Remove ```markdown\n
+            if content.endswith('\n```'):
+                content = content[:-4]  # Remove \n```
+            elif content.endswith('```'):
+                content = content[:-3]  # Remove ```
+            st.markdown(
+                f"""
+                <div style="overflow-x: auto; max-width: 100%; border: 1px solid #e0e0e0; padding: 10px; border-radius: 5px; background-color: #fafafa;">
+                {content}
+                """,
+                unsafe_allow_html=True
+            )
 
 st.title("AI-Powered Invoice Parser & Translator")
 
@@ -87,9 +150,10 @@ if uploaded_file is not None:
         st.error(f"File validation failed: {validation_message}")
         st.stop()
     
-    # Calculate file hash for caching
-    file_content = uploaded_file.read()
-    file_hash = get_file_hash(file_content)
+    # Read the upload once and hash it for caching; the same bytes are used below
+    invoice_file = InvoiceFile.from_upload(uploaded_file)
+    file_content = invoice_file.content
+    file_hash = invoice_file.file_hash
     
     # Update session state file hash
     if st.session_state.current_file_hash != file_hash:
@@ -101,123 +165,133 @@ if uploaded_file is not None:
     st.info(f"File: {file_info['filename']} ({file_info['size_mb']:.1f} MB)")
     
     with st.expander("View Invoice"):
-        pdf_viewer(uploaded_file.getvalue())
+        pdf_viewer(file_content)
 
     # Initialize variables
     markdown_data_llama = None
     bounding_box_data = None
     translation_data = None
     extracted_data_llama = None
+    extraction_plan = None
 
-    # Create two columns for results
+    # Create two columns for results, filled in page by page as results arrive
     col1, col2 = st.columns(2, border=True)
-            
+    
     with col1:
         st.header("Document Parsing")
-        try:
-            # Get markdown data and bounding box data (cached or computed)
-            markdown_data_llama, bounding_box_data, was_cached = get_cached_or_compute_markdown(
-                file_content, file_hash, llama_parser
-            )
-            
-            if markdown_data_llama:
-                # Create tabs for each page
-                tabs = st.tabs([f"Page {i+1}" for i in range(len(markdown_data_llama))])
-                
-                # Display each page in its respective tab
-                for i, tab in enumerate(tabs):
-                    with tab:
-                        # Create scrollable container for wide content
-                        content = markdown_data_llama[i].text.replace('</div>', '&lt;/div&gt;')
-                        st.markdown(
-                            f"""
-                            <div style="overflow-x: auto; max-width: 100%; border: 1px solid #e0e0e0; padding: 10px; border-radius: 5px; background-color: #fafafa;">
-                            {content}
-                            
-                            """,
-                            unsafe_allow_html=True
-                        )
-                
-                # Format markdown content
-                combined_markdown = format_markdown_content(markdown_data_llama)
-                original_name = extract_original_filename(uploaded_file)
-                filename = create_filename_with_task(original_name, "parsing", "md")
-                
-                st.download_button(
-                    label="Download Markdown",
-                    data=combined_markdown,
-                    file_name=filename,
-                    mime="text/markdown",
-                    help="Download parsed markdown content"
-                )
-            else:
-                st.warning("No markdown data could be generated from the invoice.")
-                
-        except Exception as e:
-            st.error(str(e))
-
+        markdown_area = st.empty()
+    
     with col2:
         st.header("Translation to English")
+        translation_area = st.empty()
+    
+    streamed_pages = {}
+    streamed_translations = {}
+    stream_error = None
+    translation_was_cached = True
+    try:
+        # Pages are shown as each parse job finishes and as each page is translated
+        for event in stream_markdown_and_translation(file_content, file_hash, llama_parser, translator):
+            if event['stage'] == 'markdown':
+                streamed_pages.update(event['pages'])
+                with markdown_area.container():
+                    show_markdown_pages(streamed_pages)
+                with translation_area.container():
+                    show_translated_pages(streamed_pages, streamed_translations)
+            elif event['stage'] == 'translation':
+                streamed_translations.update(event['pages'])
+                with translation_area.container():
+                    show_translated_pages(streamed_pages, streamed_translations)
+            elif event['stage'] == 'markdown_complete':
+                markdown_data_llama = event['markdown_data']
+                bounding_box_data = event['bounding_box_data']
+                if st.session_state.extracted_data is None:
+                    # A near duplicate is only suspected until the extraction confirms it
+                    st.session_state.duplicate = check_duplicate(file_hash, markdown_data_llama, uploaded_file.name)
+                    # Pick the extraction route; extraction starts now unless it needs the translation
+                    extraction_plan = plan_extraction(
+                        file_content, file_hash, markdown_data_llama, translator, llama_parser,
+                        detected=event['detected'], bounding_box_data=bounding_box_data
+                    )
+            else:
+                translation_data = event['translation_data']
+                translation_was_cached = event['cached']['translation']
+    except Exception as e:
+        stream_error = e
+    
+    with markdown_area.container():
         if markdown_data_llama:
-            try:
-                # Get translation data (cached or computed)
-                translation_data, was_cached = get_cached_or_compute_translation(
-                    markdown_data_llama, file_hash, translator
-                )
-                
-                if not was_cached:
-                    st.info(f"Source Language: {translation_data['source_language']}")
-
-                # Create tabs for translated content
-                translation_tabs = st.tabs([f"Page {i+1}" for i in range(len(markdown_data_llama))])
-                
-                # Display each page
-                for i, tab in enumerate(translation_tabs):
-                    with tab:
-                        result = translation_data['results'][i]
-                        # Create scrollable container for wide content
-                        content = result['translated_text'].replace('</div>', '&lt;/div&gt;')
-                        # Remove markdown code block wrapper if present
-                        if content.startswith('```markdown\n'):
-                            content = content[12:]  # Remove ```markdown\n
-                        if content.endswith('\n```'):
-                            content = content[:-4]  # Remove \n```
-                        elif content.endswith('```'):
-                            content = content[:-3]  # Remove ```
-                        st.markdown(
-                            f"""
-                            <div style="overflow-x: auto; max-width: 100%; border: 1px solid #e0e0e0; padding: 10px; border-radius: 5px; background-color: #fafafa;">
-                            {content}
-                            """,
-                            unsafe_allow_html=True
-                        )
-                
-                # Format translation content
-                translation_markdown = format_translation_markdown(translation_data)
-                original_name = extract_original_filename(uploaded_file)
-                filename = create_filename_with_task(original_name, "translation", "md")
-                
-                st.download_button(
-                    label="Download Translation",
-                    data=translation_markdown,
-                    file_name=filename,
-                    mime="text/markdown",
-                    help="Download translated content as markdown"
-                )
-
-            except Exception as e:
-                st.error(f"Translation error: {str(e)}")
+            show_markdown_pages(dict(enumerate(markdown_data_llama)))
+            
+            # Format markdown content
+            combined_markdown = format_markdown_content(markdown_data_llama)
+            original_name = extract_original_filename(uploaded_file)
+            filename = create_filename_with_task(original_name, "parsing", "md")
+            
+            st.download_button(
+                label="Download Markdown",
+                data=combined_markdown,
+                file_name=filename,
+                mime="text/markdown",
+                help="Download parsed markdown content"
+            )
+        elif stream_error:
+            st.error(str(stream_error))
+        else:
+            st.warning("No markdown data could be generated from the invoice.")
+    
+    with translation_area.container():
+        if translation_data:
+            if not translation_was_cached:
+                st.info(f"Source Language: {translation_data['source_language']}")
+            
+            show_translated_pages(dict(enumerate(markdown_data_llama)), dict(enumerate(translation_data['results'])))
+            
+            # Format translation content
+            translation_markdown = format_translation_markdown(translation_data)
+            original_name = extract_original_filename(uploaded_file)
+            filename = create_filename_with_task(original_name, "translation", "md")
+            
+            st.download_button(
+                label="Download Translation",
+                data=translation_markdown,
+                file_name=filename,
+                mime="text/markdown",
+                help="Download translated content as markdown"
+            )
+        elif markdown_data_llama and stream_error:
+            st.error(f"Translation error: {str(stream_error)}")
         else:
             st.warning("No markdown content available for translation.")
 
     with st.container(border=True):
         st.header("Structured Data Extraction")
         try:
-            if translation_data:
-                # Get extraction data (cached or computed)
+            if translation_data or (extraction_plan and not needs_translation(extraction_plan['route'])):
+                # Get extraction data (cached, already running in the background, or computed)
                 extracted_data_llama, was_cached = get_cached_or_compute_extraction(
-                    translation_data['combined_text'], file_hash, llama_parser
+                    translation_data['combined_text'] if translation_data else None,
+                    file_hash, llama_parser, extraction_plan
                 )
+                if extraction_plan is not None and extracted_data_llama:
+                    st.session_state.duplicate = register_processed_invoice(
+                        file_hash, markdown_data_llama, extracted_data_llama, uploaded_file.name,
+                        st.session_state.duplicate
+                    )
+                
+                duplicate = st.session_state.duplicate
+                if duplicate:
+                    processed_at = datetime.fromtimestamp(duplicate['processed_at']).strftime('%Y-%m-%d %H:%M')
+                    kinds = {
+                        "exact": "the same file as",
+                        "near": "a rescan or re-export of",
+                        "suspected": "almost identical in wording and numbers to",
+                        "semantic": "the same vendor, invoice ID and total as"
+                    }
+                    st.warning(
+                        f"Possible duplicate: this invoice is {kinds[duplicate['kind']]} "
+                        f"{duplicate['file_name'] or duplicate['file_hash']}, processed on {processed_at}."
+                    )
                     
                 if extracted_data_llama:
                     # Create tabs for JSON, Table, and Bounding Box views
@@ -241,8 +315,15 @@ if uploaded_file is not None:
                     
                     with bbox_tab:
                         st.subheader("Parsed Data with Bounding Boxes")
-                        if bounding_box_data:
-                            st.json(bounding_box_data)
+                        if bounding_box_data and len(bounding_box_data) > 0:
+                            # Only the selected page is decompressed
+                            page_index = st.selectbox(
+                                "Page",
+                                range(len(bounding_box_data)),
+                                format_func=lambda i: f"Page {i+1}",
+                                key="bbox_page"
+                            )
+                            st.json(bounding_box_data.page(page_index))
                         else:
                             st.warning("No bounding box data available.")
                     
@@ -267,19 +348,18 @@ if uploaded_file is not None:
                     with col_csv:
                         # Comprehensive CSV download with filename, extracted JSON, and bounding JSON
                         original_name = extract_original_filename(uploaded_file)
-                        csv_df = create_comprehensive_csv_data(
-                            original_name, 
-                            extracted_data_llama, 
-                            bounding_box_data,
-                            markdown_data_llama,
-                            translation_data
-                        )
-                        csv_string = convert_dataframe_to_csv_string(csv_df)
                         filename = create_filename_with_task(original_name, "comprehensive", "csv")
                         
+                        # Built only when the button is clicked, since it embeds the full bounding box JSON
                         st.download_button(
                             label="Download CSV",
-                            data=csv_string,
+                            data=lambda: convert_dataframe_to_csv_string(create_comprehensive_csv_data(
+                                original_name, 
+                                extracted_data_llama, 
+                                bounding_box_data,
+                                markdown_data_llama,
+                                translation_data
+                            )),
                             file_name=filename,
                             mime="text/csv",
                             help="Download comprehensive CSV with all extracted data"
@@ -288,13 +368,13 @@ if uploaded_file is not None:
                     with col_bbox:
                         # Bounding box JSON download
                         if bounding_box_data:
-                            bbox_json_str = json.dumps(bounding_box_data, indent=2)
                             original_name = extract_original_filename(uploaded_file)
                             filename = create_filename_with_task(original_name, "bounding_boxes", "json")
                             
+                            # Serialized only when the button is clicked
                             st.download_button(
                                 label="Download Bounding Boxes",
-                                data=bbox_json_str,
+                                data=lambda: bounding_boxes_to_json(bounding_box_data, indent=2),
                                 file_name=filename,
                                 mime="application/json",
                                 help="Download bounding box data as JSON file"
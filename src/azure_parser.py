@@ -1,12 +1,114 @@
 import ast
+import asyncio
 import os
+import re
+from html.parser import HTMLParser
 from io import BytesIO
 import json
 
 from azure.ai.documentintelligence import DocumentIntelligenceClient
-from azure.ai.documentintelligence.models import AnalyzeDocumentRequest
+from azure.ai.documentintelligence.models import AnalyzeDocumentRequest, DocumentContentFormat
 from azure.core.credentials import AzureKeyCredential
 from dotenv import load_dotenv
+from llama_index.core import Document
+from .bbox_store import LazyBoundingBoxes
+from .metrics import timed
+from .scheduler import get_scheduler
+
+HTML_TABLE = re.compile(r"<table\b.*?</table>", re.DOTALL | re.IGNORECASE)
+
+# Azure reports PDF geometry in inches and images in pixels; LlamaParse uses PDF points and pixels
+POINTS_PER_UNIT = {"inch": 72.0, "pixel": 1.0}
+
+class HTMLTableParser(HTMLParser):
+    """Collect the caption and rows of an HTML table; each cell is {'text', 'colspan', 'rowspan'}"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.caption = []
+        self.rows = []
+        self._cell = None
+        self._in_caption = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "tr":
+            self.rows.append([])
+        elif tag in ("td", "th"):
+            attrs = dict(attrs)
+            self._cell = {
+                "text": [],
+                "colspan": max(1, int(attrs.get("colspan") or 1)),
+                "rowspan": max(1, int(attrs.get("rowspan") or 1))
+            }
+        elif tag == "caption":
+            self._in_caption = True
+        elif tag == "br" and self._cell is not None:
+            self._cell["text"].append(" ")
+
+    def handle_endtag(self, tag):
+        if tag in ("td", "th") and self._cell is not None:
+            if not self.rows:
+                self.rows.append([])
+            self.rows[-1].append(self._cell)
+            self._cell = None
+        elif tag == "caption":
+            self._in_caption = False
+
+    def handle_data(self, data):
+        if self._cell is not None:
+            self._cell["text"].append(data)
+        elif self._in_caption:
+            self.caption.append(data)
+
+def table_cell_text(parts):
+    """One-line cell text that cannot break the pipe table"""
+    return " ".join("".join(parts).split()).replace("|", "\\|")
+
+def html_table_to_markdown(html):
+    """
+    Convert one HTML table to a pipe table. Cells spanning several columns
+    or rows keep their text in the first position and leave the rest empty.
+    """
+    parser = HTMLTableParser()
+    parser.feed(html)
+    grid = []
+    spanned = {}  # column -> rows still covered by a cell from a row above
+    for row in parser.rows:
+        cells = []
+        queue = list(row)
+        while queue or any(column >= len(cells) for column in spanned):
+            column = len(cells)
+            if column in spanned:
+                cells.append("")
+                spanned[column] -= 1
+                if not spanned[column]:
+                    del spanned[column]
+                continue
+            if not queue:
+                cells.append("")
+                continue
+            cell = queue.pop(0)
+            for offset in range(cell["colspan"]):
+                cells.append(table_cell_text(cell["text"]) if offset == 0 else "")
+                if cell["rowspan"] > 1:
+                    spanned[column + offset] = cell["rowspan"] - 1
+        grid.append(cells)
+    grid = [cells for cells in grid if cells]
+    if not grid:
+        return ""
+
+    width = max(len(cells) for cells in grid)
+    lines = [table_cell_text(parser.caption), ""] if "".join(parser.caption).strip() else []
+    for index, cells in enumerate(grid):
+        cells = cells + [""] * (width - len(cells))
+        lines.append("| " + " | ".join(cells) + " |")
+        if index == 0:
+            lines.append("|" + "|".join(["---"] * width) + "|")
+    return "\n".join(lines)
+
+def html_tables_to_markdown(text):
+    """Replace the HTML tables of Azure markdown output with pipe tables, as LlamaParse renders them"""
+    return HTML_TABLE.sub(lambda match: html_table_to_markdown(match.group(0)), text)
 
 class AzureInvoiceParser:
     def __init__(self):
@@ -17,18 +119,29 @@ class AzureInvoiceParser:
             endpoint=self.azure_endpoint,
             credential=AzureKeyCredential(self.azure_key)
         )
+        self.scheduler = get_scheduler()
+
+    def analyze(self, model_id, file_content, **options):
+        """
+        Run an analysis and wait for its result, through the request scheduler
+        """
+        def run():
+            poller = self.client.begin_analyze_document(
+                model_id,
+                AnalyzeDocumentRequest(bytes_source=file_content),
+                **options
+            )
+            return poller.result()
+        return self.scheduler.call("azure", run)
 
+    @timed("extract_from_pdf", backend="azure")
     def parse_invoice(self, file_content):
         """
         Parse an invoice using Azure Document Intelligence
         """
         try:
             # Analyze the document
-            poller = self.client.begin_analyze_document(
-                "prebuilt-invoice",
-                AnalyzeDocumentRequest(bytes_source=file_content),
-            )
-            result = poller.result()
+            result = self.analyze("prebuilt-invoice", file_content)
             
             if not result.documents:
                 return None
@@ -61,44 +174,62 @@ class AzureInvoiceParser:
         except Exception as e:
             raise Exception(f"Error processing with Azure Document Intelligence: {str(e)}")
 
+    @timed("pdf_to_markdown", backend="azure")
     def pdf_to_markdown(self, file_content):
         """
-        Convert PDF to Markdown using Azure Document Intelligence
+        Convert PDF to Markdown using Azure Document Intelligence, returning
+        (markdown_documents, bounding_boxes) per page like LlamaInvoiceParser
         """
         try:
-            # Analyze the document
-            poller = self.client.begin_analyze_document(
-                "prebuilt-layout",
-                AnalyzeDocumentRequest(bytes_source=file_content),
-                #content_type="application/pdf",
-                #output_format="markdown",
+            # The layout model renders the whole document as markdown, tables included
+            result = self.analyze(
+                "prebuilt-layout", file_content, output_content_format=DocumentContentFormat.MARKDOWN
             )
-            result = poller.result()
             
-            if not result.documents:
-                return None
+            markdown_documents = []
+            pages = []
+            for page in result.pages or []:
+                # Each page owns one or more spans of the document content
+                page_text = "".join(
+                    result.content[span.offset:span.offset + span.length] for span in page.spans or []
+                )
+                page_text = html_tables_to_markdown(page_text.replace("<!-- PageBreak -->", "")).strip()
+                markdown_documents.append(Document(text=page_text, metadata={"page": page.page_number}))
                 
-            # Extract text content and convert to markdown
-            markdown_content = ""
-            for page in result.documents:
-                for paragraph in page.paragraphs:
-                    # Add paragraph content
-                    markdown_content += paragraph.content + "\n\n"
-                    
-                    # Add tables if present
-                    for table in paragraph.tables:
-                        # Create markdown table header
-                        header_row = "| " + " | ".join(cell.content for cell in table.header_cells) + " |"
-                        separator = "| " + " | ".join("---" for _ in table.header_cells) + " |"
-                        markdown_content += header_row + "\n" + separator + "\n"
-                        
-                        # Add table rows
-                        for row in table.rows:
-                            row_content = "| " + " | ".join(cell.content for cell in row.cells) + " |"
-                            markdown_content += row_content + "\n"
-                        markdown_content += "\n"
+                # Line boxes in the LlamaParse page layout: x, y, w, h in PDF points, or pixels for images
+                scale = POINTS_PER_UNIT.get(page.unit, 1.0)
+                items = []
+                for line in page.lines or []:
+                    xs = [x * scale for x in line.polygon[0::2]]
+                    ys = [y * scale for y in line.polygon[1::2]]
+                    items.append({
+                        "type": "text",
+                        "value": line.content,
+                        "md": line.content,
+                        "bBox": {"x": min(xs), "y": min(ys), "w": max(xs) - min(xs), "h": max(ys) - min(ys)}
+                    })
+                pages.append({
+                    "page": page.page_number,
+                    "md": page_text,
+                    "width": page.width * scale,
+                    "height": page.height * scale,
+                    "items": items
+                })
             
-            return markdown_content
+            bounding_boxes = LazyBoundingBoxes.from_dict({"pages": pages, "provider": "azure"})
+            return markdown_documents, bounding_boxes
             
         except Exception as e:
-            raise Exception(f"Error converting PDF to Markdown: {str(e)}") 
\ No newline at end of file
+            raise Exception(f"Error converting PDF to Markdown: {str(e)}") 
+
+    async def aparse_invoice(self, file_content):
+        """
+        Async variant of parse_invoice, run in a worker thread
+        """
+        return await asyncio.to_thread(self.parse_invoice, file_content)
+
+    async def apdf_to_markdown(self, file_content):
+        """
+        Async variant of pdf_to_markdown, run in a worker thread
+        """
+        return await asyncio.to_thread(self.pdf_to_markdown, file_content)
@@ -0,0 +1,191 @@
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+# Markdown parsing backends in order of preference; later ones take over when earlier ones fail
+PARSE_BACKENDS = [name.strip() for name in os.getenv("PARSE_BACKENDS", "llama").split(",") if name.strip()]
+
+# Give up on a backend after this many seconds and move on to the next one (0 waits indefinitely)
+PARSE_TIMEOUT_SECONDS = float(os.getenv("PARSE_TIMEOUT_SECONDS", "0"))
+
+# Send a second, hedged request when the first is slower than this: a number of seconds, "p95" for the
+# backend's observed 95th percentile latency, or empty to disable hedging
+HEDGE_AFTER_SECONDS = os.getenv("HEDGE_AFTER_SECONDS", "").strip().lower()
+HEDGE_MIN_SAMPLES = 20
+
+_backend_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("PARSE_BACKEND_WORKERS", "16")), thread_name_prefix="parse-backend"
+)
+
+class LatencyTracker:
+    """Recent successful call latencies per backend"""
+
+    def __init__(self, window=200):
+        self.window = window
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, seconds):
+        with self._lock:
+            self._samples.setdefault(name, deque(maxlen=self.window)).append(seconds)
+
+    def count(self, name):
+        with self._lock:
+            return len(self._samples.get(name, ()))
+
+    def percentile(self, name, fraction):
+        """Nearest-rank percentile of the recent latencies, or None without samples"""
+        with self._lock:
+            ordered = sorted(self._samples.get(name, ()))
+        if not ordered:
+            return None
+        return ordered[min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))]
+
+class FailoverParser:
+    """
+    Markdown parsing across several backends with the same pdf_to_markdown
+    interface. A backend that fails or exceeds the timeout hands the
+    document to the next one, and with hedging enabled a slow request gets
+    a second one sent to the next backend; whichever answers first wins.
+    Everything else (extraction, agent lookup, warm-up) is delegated to the
+    extraction parser.
+    """
+
+    def __init__(self, backends, extractor, timeout=PARSE_TIMEOUT_SECONDS, hedge_after=HEDGE_AFTER_SECONDS):
+        self.backends = list(backends)
+        self.extractor = extractor
+        self.timeout = timeout or None
+        self.hedge_after = hedge_after
+        self.latencies = LatencyTracker()
+        self._stats = {name: {"calls": 0, "wins": 0, "failures": 0, "timeouts": 0, "hedges": 0}
+                       for name, _ in self.backends}
+        self._stats_lock = threading.Lock()
+
+    def __getattr__(self, name):
+        # Only called for attributes not found on the instance
+        return getattr(self.__dict__["extractor"], name)
+
+    def _count(self, name, counter):
+        with self._stats_lock:
+            self._stats[name][counter] += 1
+
+    def hedge_delay(self, name):
+        """Seconds to wait for backend name before hedging, or None when hedging is off"""
+        if not self.hedge_after:
+            return None
+        if self.hedge_after == "p95":
+            if self.latencies.count(name) < HEDGE_MIN_SAMPLES:
+                return None
+            return self.latencies.percentile(name, 0.95)
+        return float(self.hedge_after)
+
+    def _parse(self, name, parser, file_content):
+        start = time.perf_counter()
+        result = parser.pdf_to_markdown(file_content)
+        self.latencies.record(name, time.perf_counter() - start)
+        return result
+
+    def pdf_to_markdown(self, file_content):
+        """Return (markdown_documents, bounding_boxes) from the first backend that answers"""
+        waiting = list(self.backends)
+        pending = {}
+        errors = []
+        hedged = False
+
+        def launch(hedge=False):
+            name, parser = waiting.pop(0) if waiting else self.backends[0]
+            self._count(name, "hedges" if hedge else "calls")
+            future = _backend_executor.submit(self._parse, name, parser, file_content)
+            pending[future] = (name, time.monotonic())
+
+        launch()
+        while pending:
+            now = time.monotonic()
+            deadlines = []
+            if self.timeout:
+                deadlines += [started + self.timeout for _, started in pending.values()]
+            hedge_at = None
+            if not hedged and not errors and len(pending) == 1:
+                name, started = next(iter(pending.values()))
+                delay = self.hedge_delay(name)
+                if delay is not None:
+                    hedge_at = started + delay
+                    deadlines.append(hedge_at)
+            done, _ = wait(pending, timeout=max(0.0, min(deadlines) - now) if deadlines else None,
+                           return_when=FIRST_COMPLETED)
+
+            for future in done:
+                name, _ = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    self._count(name, "failures")
+                    errors.append(f"{name}: {str(e)}")
+                    continue
+                self._count(name, "wins")
+                return result
+
+            now = time.monotonic()
+            if self.timeout:
+                for future, (name, started) in list(pending.items()):
+                    if now - started >= self.timeout:
+                        # The request keeps running in its thread; its answer is ignored
+                        pending.pop(future)
+                        self._count(name, "timeouts")
+                        errors.append(f"{name}: no answer after {self.timeout:.0f}s")
+            if waiting and not pending:
+                launch()
+            elif not done and hedge_at is not None and now >= hedge_at and pending:
+                hedged = True
+                launch(hedge=True)
+
+        raise Exception(f"Error converting PDF to Markdown: every backend failed ({'; '.join(errors)})")
+
+    def iter_pdf_to_markdown(self, file_content, *args, **kwargs):
+        """
+        Stream pages from the first backend; when it fails before yielding
+        anything, the remaining backends parse the whole document
+        """
+        name, parser = self.backends[0]
+        if not hasattr(parser, "iter_pdf_to_markdown"):
+            yield self.pdf_to_markdown(file_content)
+            return
+
+        self._count(name, "calls")
+        yielded = False
+        try:
+            for part in parser.iter_pdf_to_markdown(file_content, *args, **kwargs):
+                yielded = True
+                yield part
+        except Exception:
+            self._count(name, "failures")
+            if yielded or len(self.backends) == 1:
+                raise
+            fallback = FailoverParser(self.backends[1:], self.extractor, self.timeout, None)
+            fallback.latencies = self.latencies
+            result = fallback.pdf_to_markdown(file_content)
+            with self._stats_lock:
+                for backend_name, counters in fallback.stats().items():
+                    for counter in ("calls", "wins", "failures", "timeouts"):
+                        self._stats[backend_name][counter] += counters[counter]
+            yield result
+            return
+        self._count(name, "wins")
+
+    async def apdf_to_markdown(self, file_content):
+        """
+        Async variant of pdf_to_markdown, run in a worker thread
+        """
+        return await asyncio.to_thread(self.pdf_to_markdown, file_content)
+
+    def stats(self):
+        """Per-backend calls, wins, failures, timeouts, hedges and recent latency percentiles"""
+        with self._stats_lock:
+            stats = {name: dict(counters) for name, counters in self._stats.items()}
+        for name in stats:
+            stats[name]["p50_seconds"] = self.latencies.percentile(name, 0.50)
+            stats[name]["p95_seconds"] = self.latencies.percentile(name, 0.95)
+        return stats
@@ -0,0 +1,336 @@
+import argparse
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+from .cache_manager import (
+    TRANSLATION_MAX_WORKERS,
+    load_from_cache,
+    save_to_cache,
+    compute_translation,
+    plan_extraction,
+    compute_extraction,
+    enforce_cache_limits,
+    check_duplicate,
+    register_processed_invoice,
+    legacy_file_hash_warning
+)
+from .file_utils import ensure_directory_exists, get_safe_filename
+from .hashing import InvoiceFile
+from .clients import get_invoice_parser, get_translator
+from .batching import TranslationBatcher
+from .metrics import get_metrics, start_metrics_server
+from .scheduler import get_scheduler
+
+STAGES = ["markdown", "translation", "extraction"]
+
+def discover_invoices(input_dir, pattern="*.pdf"):
+    """List invoice files in a directory, sorted by name"""
+    return sorted(path for path in Path(input_dir).glob(pattern) if path.is_file())
+
+def run_markdown_stage(file_content, file_hash, llama_parser):
+    """Load markdown and bounding boxes from disk cache or parse the PDF"""
+    cached_markdown = load_from_cache(file_hash, "markdown")
+    cached_bounding_box = load_from_cache(file_hash, "bounding_box")
+    if cached_markdown is not None and cached_bounding_box is not None:
+        return cached_markdown, cached_bounding_box, True
+
+    markdown_data, bounding_box_data = llama_parser.pdf_to_markdown(file_content)
+    save_to_cache(file_hash, "markdown", markdown_data)
+    save_to_cache(file_hash, "bounding_box", bounding_box_data)
+    return markdown_data, bounding_box_data, False
+
+def run_cached_stage(file_hash, cache_type, compute):
+    """Load a stage result from disk cache or compute and store it"""
+    cached_data = load_from_cache(file_hash, cache_type)
+    if cached_data is not None:
+        return cached_data, True
+
+    data = compute()
+    save_to_cache(file_hash, cache_type, data)
+    return data, False
+
+def new_result_record(path):
+    """Create an empty result record for one invoice"""
+    return {
+        "filename": path.name,
+        "path": str(path),
+        "file_hash": None,
+        "status": "ok",
+        "error": None,
+        "page_count": None,
+        "source_language": None,
+        "llm_calls": None,
+        "page_cache": None,
+        "translation_memory": None,
+        "extraction_route": None,
+        "extraction_wait": None,
+        "duplicate": None,
+        "extracted_data": None,
+        "timings": {},
+        "cached": {},
+    }
+
+def process_invoice(path, llama_parser, translator, page_workers=TRANSLATION_MAX_WORKERS, per_page_language=False):
+    """Run parse -> translate -> extract for one invoice and return its result record"""
+    record = new_result_record(path)
+    try:
+        # Read and hashed once; the same bytes go to every stage
+        invoice_file = InvoiceFile.from_path(path)
+        file_content = invoice_file.content
+        file_hash = invoice_file.file_hash
+        record["file_hash"] = file_hash
+
+        start = time.perf_counter()
+        markdown_data, bounding_box_data, was_cached = run_markdown_stage(file_content, file_hash, llama_parser)
+        record["timings"]["markdown"] = time.perf_counter() - start
+        record["cached"]["markdown"] = was_cached
+        if not markdown_data:
+            raise Exception("No markdown data could be generated from the invoice")
+        record["page_count"] = len(markdown_data)
+
+        # A near duplicate is only suspected until the extraction confirms it
+        record["duplicate"] = check_duplicate(file_hash, markdown_data, path.name)
+
+        # Extraction may start here and run alongside translation, depending on the route
+        plan = plan_extraction(
+            file_content, file_hash, markdown_data, translator, llama_parser, per_page_language,
+            bounding_box_data=bounding_box_data
+        )
+        record["extraction_route"] = plan['route']
+
+        start = time.perf_counter()
+        translation_data, was_cached = run_cached_stage(
+            file_hash, "translation",
+            lambda: compute_translation(markdown_data, translator, page_workers, per_page_language, plan['detected'])
+        )
+        record["timings"]["translation"] = time.perf_counter() - start
+        record["cached"]["translation"] = was_cached
+        record["source_language"] = translation_data['source_language']
+        record["llm_calls"] = translation_data.get('llm_calls')
+        record["page_cache"] = translation_data.get('page_cache')
+        record["translation_memory"] = translation_data.get('translation_memory')
+
+        start = time.perf_counter()
+        if plan['cached_data'] is not None:
+            extracted_data, was_cached = plan['cached_data'], True
+        else:
+            extracted_data, was_cached = run_cached_stage(
+                file_hash, "extraction", lambda: compute_extraction(translation_data['combined_text'], llama_parser, plan)
+            )
+        # Only the extraction itself; waiting for one that ran alongside translation is reported apart
+        record["timings"]["extraction"] = plan['seconds'] if plan['seconds'] is not None else time.perf_counter() - start
+        record["extraction_wait"] = plan['wait_seconds']
+        record["cached"]["extraction"] = was_cached
+        record["extracted_data"] = extracted_data
+
+        record["duplicate"] = register_processed_invoice(
+            file_hash, markdown_data, extracted_data, path.name, record["duplicate"]
+        )
+
+    except Exception as e:
+        record["status"] = "error"
+        record["error"] = str(e)
+
+    return record
+
+def write_record(record, output_dir):
+    """Write one result record as JSON into the output directory"""
+    output_path = Path(output_dir) / f"{get_safe_filename(Path(record['filename']).stem)}.json"
+    with open(output_path, 'w', encoding='utf-8') as f:
+        json.dump(record, f, indent=2, ensure_ascii=False, default=str)
+    return output_path
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))
+    return ordered[index]
+
+def summarize_run(records, elapsed_seconds, workers):
+    """Build throughput and per-stage latency summary for a batch run"""
+    succeeded = [r for r in records if r["status"] == "ok"]
+    translated = [r for r in records if r["page_cache"] and not r["cached"].get("translation")]
+    page_cache_hits = sum(r["page_cache"]["hits"] for r in translated)
+    page_cache_lookups = page_cache_hits + sum(r["page_cache"]["misses"] for r in translated)
+    segment_hits = sum(r["translation_memory"]["hits"] for r in translated if r["translation_memory"])
+    segment_lookups = segment_hits + sum(r["translation_memory"]["misses"] for r in translated if r["translation_memory"])
+    summary = {
+        "invoices": len(records),
+        "succeeded": len(succeeded),
+        "failed": len(records) - len(succeeded),
+        "workers": workers,
+        "elapsed_seconds": elapsed_seconds,
+        "invoices_per_minute": (len(succeeded) / elapsed_seconds * 60) if elapsed_seconds > 0 else 0.0,
+        "translation_llm_calls": sum(
+            r["llm_calls"]["total"] for r in records if r["llm_calls"] and not r["cached"].get("translation")
+        ),
+        "page_cache_hits": page_cache_hits,
+        "page_cache_lookups": page_cache_lookups,
+        "page_cache_hit_rate": (page_cache_hits / page_cache_lookups) if page_cache_lookups else 0.0,
+        "segment_hits": segment_hits,
+        "segment_lookups": segment_lookups,
+        "segment_hit_rate": (segment_hits / segment_lookups) if segment_lookups else 0.0,
+        "extraction_routes": {},
+        "duplicates": {},
+        "stages": {},
+    }
+    for record in records:
+        if record["extraction_route"]:
+            routes = summary["extraction_routes"]
+            routes[record["extraction_route"]] = routes.get(record["extraction_route"], 0) + 1
+        if record.get("duplicate"):
+            duplicates = summary["duplicates"]
+            duplicates[record["duplicate"]["kind"]] = duplicates.get(record["duplicate"]["kind"], 0) + 1
+    for stage in STAGES:
+        computed = [r["timings"][stage] for r in records if stage in r["timings"] and not r["cached"].get(stage)]
+        cached_count = sum(1 for r in records if r["cached"].get(stage))
+        summary["stages"][stage] = {
+            "computed": len(computed),
+            "cached": cached_count,
+            "mean_seconds": (sum(computed) / len(computed)) if computed else 0.0,
+            "p50_seconds": percentile(computed, 0.50),
+            "p95_seconds": percentile(computed, 0.95),
+            "max_seconds": max(computed) if computed else 0.0,
+        }
+    return summary
+
+def format_summary(summary):
+    """Format a batch summary as a human-readable report"""
+    lines = [
+        f"Processed {summary['invoices']} invoice(s) with {summary['workers']} worker(s) "
+        f"in {summary['elapsed_seconds']:.1f}s",
+        f"Succeeded: {summary['succeeded']}  Failed: {summary['failed']}",
+        f"Throughput: {summary['invoices_per_minute']:.2f} invoices/min",
+        f"Translation LLM calls: {summary['translation_llm_calls']}",
+        f"Page translation cache: {summary['page_cache_hits']}/{summary['page_cache_lookups']} hits "
+        f"({summary['page_cache_hit_rate']:.0%})",
+        f"Translation memory: {summary['segment_hits']}/{summary['segment_lookups']} segment hits "
+        f"({summary['segment_hit_rate']:.0%})",
+    ]
+    if summary["extraction_routes"]:
+        routes = ", ".join(f"{route} {count}" for route, count in sorted(summary["extraction_routes"].items()))
+        lines.append(f"Extraction routes: {routes}")
+    if summary["duplicates"]:
+        duplicates = ", ".join(f"{kind} {count}" for kind, count in sorted(summary["duplicates"].items()))
+        lines.append(f"Duplicates of processed invoices: {duplicates}")
+    for name, stats in summary.get("parse_backends", {}).items():
+        latency = f", p95 {stats['p95_seconds']:.1f}s" if stats["p95_seconds"] is not None else ""
+        lines.append(
+            f"Parse backend {name}: {stats['calls']} calls, {stats['hedges']} hedges, {stats['wins']} answered, "
+            f"{stats['failures']} failed, {stats['timeouts']} timed out{latency}"
+        )
+    if "translation_batches" in summary:
+        batches = summary["translation_batches"]
+        lines.append(
+            f"Translation batching: {batches['batched_requests']} of {batches['requests']} requests combined "
+            f"into {batches['batches']} batches, {batches['fallbacks']} batch(es) resent page by page"
+        )
+    for key, stats in sorted(summary.get("requests", {}).items()):
+        lines.append(
+            f"Requests to {key}: {stats['calls']} sent, {stats['retries']} retried "
+            f"({stats['rate_limited']} rate limited), {stats['failures']} failed, "
+            f"{stats['waited_seconds']:.1f}s queued"
+        )
+    lines += [
+        "",
+        f"{'Stage':<12} {'computed':>8} {'cached':>7} {'mean':>8} {'p50':>8} {'p95':>8} {'max':>8}",
+    ]
+    for stage, stats in summary["stages"].items():
+        lines.append(
+            f"{stage:<12} {stats['computed']:>8} {stats['cached']:>7} "
+            f"{stats['mean_seconds']:>7.2f}s {stats['p50_seconds']:>7.2f}s "
+            f"{stats['p95_seconds']:>7.2f}s {stats['max_seconds']:>7.2f}s"
+        )
+    return "\n".join(lines)
+
+def report_progress(record, done, total):
+    """Print a one-line progress report for a finished invoice"""
+    total_time = sum(record["timings"].values())
+    status = record["status"] if record["status"] == "ok" else f"error: {record['error']}"
+    print(f"[{done}/{total}] {record['filename']}: {status} ({total_time:.1f}s)")
+
+def run_batch(input_dir, output_dir="batch_results", workers=4, pattern="*.pdf", engine="threads",
+              page_workers=TRANSLATION_MAX_WORKERS, per_page_language=False, batch_translation=False,
+              llama_parser=None, translator=None):
+    """
+    Process every invoice in a directory with a bounded worker pool. The
+    shared clients are used unless llama_parser or translator are given.
+    """
+    paths = discover_invoices(input_dir, pattern)
+    ensure_directory_exists(output_dir)
+
+    llama_parser = llama_parser or get_invoice_parser()
+    translator = translator or get_translator()
+    start_metrics_server()
+    legacy_warning = legacy_file_hash_warning()
+    if legacy_warning:
+        print(f"Warning: {legacy_warning}")
+    if batch_translation and translator.batcher is None:
+        # Short pages of concurrently processed invoices share translation requests
+        translator.batcher = TranslationBatcher(translator.send_segments, translator.send_segment_sections)
+
+    records = []
+
+    def on_record(record):
+        write_record(record, output_dir)
+        records.append(record)
+        report_progress(record, len(records), len(paths))
+
+    start = time.perf_counter()
+    if engine == "async":
+        from .pipeline import AsyncInvoicePipeline
+        pipeline = AsyncInvoicePipeline(
+            llama_parser, translator, parse_concurrency=workers, extract_concurrency=workers,
+            page_workers=page_workers, per_page_language=per_page_language
+        )
+        asyncio.run(pipeline.run(paths, on_record=on_record))
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(process_invoice, path, llama_parser, translator, page_workers, per_page_language) for path in paths]
+            for future in as_completed(futures):
+                on_record(future.result())
+    elapsed = time.perf_counter() - start
+    enforce_cache_limits()
+
+    summary = summarize_run(records, elapsed, workers)
+    summary["engine"] = engine
+    summary["requests"] = get_scheduler().stats()
+    if translator.batcher is not None:
+        summary["translation_batches"] = translator.batcher.stats()
+    if hasattr(llama_parser, "backends"):
+        summary["parse_backends"] = llama_parser.stats()
+    with open(Path(output_dir) / "batch_summary.json", 'w', encoding='utf-8') as f:
+        json.dump(summary, f, indent=2)
+    get_metrics().dump_json(Path(output_dir) / "metrics.json")
+    return summary
+
+def main(argv=None):
+    """Command line entry point for headless batch processing"""
+    parser = argparse.ArgumentParser(description="Parse, translate and extract a directory of invoices")
+    parser.add_argument("input_dir", help="Directory containing invoice PDFs")
+    parser.add_argument("--output-dir", default="batch_results", help="Directory for per-invoice JSON records")
+    parser.add_argument("--workers", type=int, default=4, help="Number of invoices processed concurrently")
+    parser.add_argument("--pattern", default="*.pdf", help="Glob pattern for invoice files")
+    parser.add_argument("--engine", choices=["threads", "async"], default="threads",
+                        help="Run invoices in a thread pool or through the asyncio pipeline")
+    parser.add_argument("--page-workers", type=int, default=TRANSLATION_MAX_WORKERS,
+                        help="Pages translated concurrently within one invoice")
+    parser.add_argument("--per-page-language", action="store_true",
+                        help="Detect every page on its own instead of screening pages against the invoice language")
+    parser.add_argument("--batch-translation", action="store_true",
+                        help="Combine short pages of different invoices into shared translation requests")
+    args = parser.parse_args(argv)
+
+    summary = run_batch(args.input_dir, args.output_dir, args.workers, args.pattern, args.engine,
+                        args.page_workers, args.per_page_language, args.batch_translation)
+    print()
+    print(format_summary(summary))
+    return 0 if summary["failed"] == 0 else 1
+
+if __name__ == "__main__":
+    raise SystemExit(main())
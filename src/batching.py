@@ -0,0 +1,125 @@
+import os
+import threading
+from concurrent.futures import Future
+
+from .scheduler import estimate_tokens
+
+# Combine concurrent segment translation requests of several pages and invoices into one
+TRANSLATION_BATCHING = os.getenv("TRANSLATION_BATCHING", "false").lower() == "true"
+# Estimated prompt tokens per combined request; larger pages are sent on their own
+TRANSLATION_BATCH_TOKENS = int(os.getenv("TRANSLATION_BATCH_TOKENS", "1500"))
+# How long the first request of a batch waits for others to join, when other requests are in flight
+TRANSLATION_BATCH_WAIT_MS = float(os.getenv("TRANSLATION_BATCH_WAIT_MS", "50"))
+
+# Result for a member whose section markers were not preserved; it retries on its own
+SEND_INDIVIDUALLY = object()
+
+class TranslationBatcher:
+    """
+    Packs segment lists from concurrent callers into combined requests. The
+    first caller for a language waits up to max_wait_ms for others to join,
+    or until the token budget is used up; a caller with no other request in
+    flight is sent at once. A combined request gives every caller its own
+    section of <<<section.n>>> markers, and each section's markers are
+    checked on their own. A caller whose section did not survive sends its
+    own request.
+    """
+
+    def __init__(self, send, send_sections, max_tokens=TRANSLATION_BATCH_TOKENS,
+                 max_wait_ms=TRANSLATION_BATCH_WAIT_MS):
+        # send(segments, source_language) returns the translations or None;
+        # send_sections(sections, source_language) returns one of those per section
+        self.send = send
+        self.send_sections = send_sections
+        self.max_tokens = max_tokens
+        self.max_wait = max_wait_ms / 1000
+        self._pending = {}
+        self._active = 0
+        self._lock = threading.Lock()
+        self._stats = {"requests": 0, "batches": 0, "batched_requests": 0, "fallbacks": 0, "unbatched": 0}
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._stats[name] += amount
+
+    def _close(self, source_language, batch):
+        """Stop a batch from accepting members; callers hold the lock"""
+        if self._pending.get(source_language) is batch:
+            del self._pending[source_language]
+        batch["full"].set()
+
+    def translate(self, segments, source_language):
+        """
+        Translate segments, possibly together with other callers' segments.
+        Returns (translations, llm_calls); a combined request is counted once,
+        by the caller that sent it.
+        """
+        tokens = estimate_tokens(*segments)
+        if tokens > self.max_tokens:
+            self._count("unbatched")
+            return self.send(segments, source_language), 1
+
+        future = Future()
+        with self._lock:
+            self._stats["requests"] += 1
+            self._active += 1
+            batch = self._pending.get(source_language)
+            if batch is not None and batch["tokens"] + tokens > self.max_tokens:
+                self._close(source_language, batch)
+                batch = None
+            leader = batch is None
+            if leader:
+                batch = {"members": [], "tokens": 0, "full": threading.Event()}
+                self._pending[source_language] = batch
+            batch["members"].append((segments, future))
+            batch["tokens"] += tokens
+            # Nobody else could join the batch: do not hold the request back
+            alone = self._active == 1
+
+        try:
+            llm_calls = 0
+            if leader:
+                if not alone:
+                    batch["full"].wait(self.max_wait)
+                with self._lock:
+                    self._close(source_language, batch)
+                self._send_batch(batch["members"], source_language)
+                llm_calls += 1
+
+            result = future.result()
+            if result is SEND_INDIVIDUALLY:
+                return self.send(segments, source_language), llm_calls + 1
+            return result, llm_calls
+        finally:
+            with self._lock:
+                self._active -= 1
+
+    def _send_batch(self, members, source_language):
+        if len(members) == 1:
+            segments, future = members[0]
+            try:
+                future.set_result(self.send(segments, source_language))
+            except Exception as e:
+                future.set_exception(e)
+            return
+
+        self._count("batches")
+        self._count("batched_requests", len(members))
+        try:
+            results = self.send_sections([segments for segments, _ in members], source_language)
+        except Exception as e:
+            for _, future in members:
+                future.set_exception(e)
+            return
+
+        for (_, future), translations in zip(members, results):
+            if translations is None:
+                self._count("fallbacks")
+                future.set_result(SEND_INDIVIDUALLY)
+            else:
+                future.set_result(translations)
+
+    def stats(self):
+        """Requests seen, combined requests sent and how many callers they served"""
+        with self._lock:
+            return dict(self._stats)
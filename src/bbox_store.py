@@ -0,0 +1,229 @@
+import io
+import json
+import os
+import struct
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+MAGIC = b"BBX1"
+COLUMNS_KEY = "__columns__"
+
+# Column-oriented layout for per-element boxes before compression (off by default)
+COLUMNAR_DEFAULT = os.getenv("BOUNDING_BOX_COLUMNAR", "false").lower() == "true"
+
+def compress(data, codec):
+    """Compress bytes with the given codec"""
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=10).compress(data)
+    return zlib.compress(data, 6)
+
+def decompress(data, codec):
+    """Decompress bytes written by compress"""
+    if codec == "zstd":
+        if zstandard is None:
+            raise Exception("Bounding boxes were stored with zstd; install the zstandard package to read them")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data)
+
+def to_columnar(value):
+    """
+    Convert lists of dicts sharing the same keys (layout items, bounding boxes)
+    into one list per key. Applied recursively; from_columnar reverses it.
+    """
+    if isinstance(value, dict):
+        return {key: to_columnar(item) for key, item in value.items()}
+    if isinstance(value, list):
+        if len(value) > 1 and all(isinstance(item, dict) for item in value):
+            keys = list(value[0])
+            if keys and all(item.keys() == value[0].keys() for item in value):
+                return {COLUMNS_KEY: {key: to_columnar([item[key] for item in value]) for key in keys}}
+        return [to_columnar(item) for item in value]
+    return value
+
+def from_columnar(value):
+    """Rebuild row-oriented lists from the output of to_columnar"""
+    if isinstance(value, dict):
+        if len(value) == 1 and COLUMNS_KEY in value:
+            columns = {key: from_columnar(column) for key, column in value[COLUMNS_KEY].items()}
+            row_count = len(next(iter(columns.values())))
+            return [{key: column[index] for key, column in columns.items()} for index in range(row_count)]
+        return {key: from_columnar(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [from_columnar(item) for item in value]
+    return value
+
+class LazyBoundingBoxes:
+    """
+    Compressed LlamaParse result with bounding boxes. The document-level
+    fields and every page are compressed separately, so a page is only
+    decoded when it is viewed and exports can stream page by page.
+    """
+
+    def __init__(self, header_blob, page_blobs, codec="zlib", columnar=False):
+        self.header_blob = header_blob
+        self.page_blobs = page_blobs
+        self.codec = codec
+        self.columnar = columnar
+
+    @classmethod
+    def default_codec(cls):
+        """Use zstd when it is installed, zlib otherwise"""
+        return "zstd" if zstandard is not None else "zlib"
+
+    @classmethod
+    def _encode(cls, value, codec, columnar):
+        if columnar:
+            value = to_columnar(value)
+        return compress(json.dumps(value, ensure_ascii=False, separators=(',', ':')).encode('utf-8'), codec)
+
+    def _decode(self, blob):
+        value = json.loads(decompress(blob, self.codec))
+        return from_columnar(value) if self.columnar else value
+
+    @classmethod
+    def from_dict(cls, data, codec=None, columnar=COLUMNAR_DEFAULT):
+        """Compress a bounding box dict such as JobResult.model_dump(mode='json')"""
+        codec = codec or cls.default_codec()
+        # "pages" stays in the header as a placeholder so key order survives
+        header = {key: (None if key == "pages" else value) for key, value in data.items()}
+        page_blobs = [cls._encode(page, codec, columnar) for page in data.get("pages") or []]
+        return cls(cls._encode(header, codec, columnar), page_blobs, codec, columnar)
+
+    @classmethod
+    def from_parse_result(cls, result, codec=None, columnar=COLUMNAR_DEFAULT):
+        """Compress a LlamaParse JobResult one page at a time"""
+        codec = codec or cls.default_codec()
+        # "pages" is the first JobResult field; keep its placeholder first
+        header = {"pages": None}
+        header.update(result.model_dump(mode="json", exclude={"pages"}))
+        page_blobs = [cls._encode(page.model_dump(mode="json"), codec, columnar) for page in result.pages]
+        return cls(cls._encode(header, codec, columnar), page_blobs, codec, columnar)
+
+    @classmethod
+    def concat(cls, parts):
+        """Join results of consecutive page-range parse jobs, keeping the first job's header"""
+        first = parts[0]
+        page_blobs = [blob for part in parts for blob in part.page_blobs]
+        if all(part.codec == first.codec and part.columnar == first.columnar for part in parts):
+            return cls(first.header_blob, page_blobs, first.codec, first.columnar)
+        data = first.to_dict()
+        data["pages"] = [page for part in parts for page in part.iter_pages()]
+        return cls.from_dict(data, first.codec, first.columnar)
+
+    def __len__(self):
+        return len(self.page_blobs)
+
+    def __bool__(self):
+        return True
+
+    @property
+    def compressed_size(self):
+        """Total compressed size in bytes"""
+        return len(self.header_blob) + sum(len(blob) for blob in self.page_blobs)
+
+    def header(self):
+        """Decode the document-level fields (job id, file name, metadata)"""
+        header = self._decode(self.header_blob)
+        header.pop("pages", None)
+        return header
+
+    def page(self, index):
+        """Decode a single page"""
+        return self._decode(self.page_blobs[index])
+
+    def iter_pages(self):
+        """Decode pages one at a time"""
+        for blob in self.page_blobs:
+            yield self._decode(blob)
+
+    def to_dict(self):
+        """Materialize the full bounding box dict"""
+        data = self._decode(self.header_blob)
+        data["pages"] = list(self.iter_pages())
+        return data
+
+    def write_json(self, fp, indent=None):
+        """Write the full dict as JSON, decoding one page at a time"""
+        header = self._decode(self.header_blob)
+        pad = " " * indent if indent else ""
+        newline = "\n" if indent else ""
+        key_separator = ": " if indent else ":"
+        fp.write("{")
+        for key_index, (key, value) in enumerate(header.items()):
+            fp.write(("," if key_index else "") + newline + pad + json.dumps(key) + key_separator)
+            if key != "pages":
+                fp.write(self._indent_nested(json.dumps(value, indent=indent, separators=None if indent else (',', ':')), pad))
+                continue
+            fp.write("[")
+            for index, page in enumerate(self.iter_pages()):
+                fp.write(("," if index else "") + newline + pad * 2)
+                fp.write(self._indent_nested(json.dumps(page, indent=indent, separators=None if indent else (',', ':')), pad * 2))
+            fp.write((newline + pad if self.page_blobs else "") + "]")
+        fp.write((newline if header else "") + "}")
+
+    @staticmethod
+    def _indent_nested(text, pad):
+        return text.replace("\n", "\n" + pad) if pad else text
+
+    def to_json(self, indent=None):
+        """Serialize the full dict to a JSON string, decoding one page at a time"""
+        buffer = io.StringIO()
+        self.write_json(buffer, indent)
+        return buffer.getvalue()
+
+    def to_bytes(self):
+        """Serialize to a compact binary frame for the cache store"""
+        codec = self.codec.encode('ascii')
+        parts = [
+            MAGIC,
+            struct.pack(">B", len(codec)), codec,
+            struct.pack(">B", 1 if self.columnar else 0),
+            struct.pack(">I", len(self.header_blob)), self.header_blob,
+            struct.pack(">I", len(self.page_blobs)),
+        ]
+        for blob in self.page_blobs:
+            parts.append(struct.pack(">I", len(blob)))
+            parts.append(blob)
+        return b"".join(parts)
+
+    @classmethod
+    def from_bytes(cls, data):
+        """Read a frame written by to_bytes without decompressing any page"""
+        view = memoryview(data)
+        if bytes(view[:4]) != MAGIC:
+            raise ValueError("Not a compressed bounding box frame")
+        offset = 4
+        codec_length = view[offset]
+        codec = bytes(view[offset + 1:offset + 1 + codec_length]).decode('ascii')
+        offset += 1 + codec_length
+        columnar = bool(view[offset])
+        offset += 1
+
+        def read_blob(offset):
+            (length,) = struct.unpack_from(">I", view, offset)
+            return bytes(view[offset + 4:offset + 4 + length]), offset + 4 + length
+
+        header_blob, offset = read_blob(offset)
+        (page_count,) = struct.unpack_from(">I", view, offset)
+        offset += 4
+        page_blobs = []
+        for _ in range(page_count):
+            blob, offset = read_blob(offset)
+            page_blobs.append(blob)
+        return cls(header_blob, page_blobs, codec, columnar)
+
+def as_lazy_bounding_boxes(data):
+    """Wrap bounding box data from older caches in LazyBoundingBoxes"""
+    if data is None or isinstance(data, LazyBoundingBoxes):
+        return data
+    return LazyBoundingBoxes.from_dict(data)
+
+def bounding_boxes_to_json(data, indent=None):
+    """Serialize bounding box data, plain or lazy, to a JSON string"""
+    if isinstance(data, LazyBoundingBoxes):
+        return data.to_json(indent)
+    return json.dumps(data, indent=indent)
@@ -0,0 +1,618 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import random
+import re
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from pathlib import Path
+from types import SimpleNamespace
+
+# Seconds per simulated provider call; "token" is added per generated token of a chat completion
+DEFAULT_LATENCY = "parse=2.0,azure=3.0,detect=0.3,translate=0.8,extract=2.5,token=0.01"
+DEFAULT_FIXTURES_DIR = "benchmark_fixtures"
+COMPLETIONS_FILE = "completions.json"
+
+# Stage p95 increases below this many seconds are noise, whatever the ratio
+MIN_LATENCY_REGRESSION_SECONDS = 0.05
+
+NUMBER_PATTERN = re.compile(r"\d[\d.,]*\d|\d")
+
+VENDORS = [
+    ("Müller Bürobedarf GmbH", "Hauptstraße 12, 10115 Berlin"),
+    ("Schneider Elektrotechnik AG", "Industriestraße 4, 70565 Stuttgart"),
+    ("Fischer Logistik KG", "Hafenweg 31, 20457 Hamburg"),
+    ("Weber Softwarehaus GmbH", "Leopoldstraße 88, 80802 München"),
+]
+ITEMS = [
+    "Druckerpapier A4, 500 Blatt", "Kugelschreiber blau", "Wartungsvertrag Server (monatlich)", "Versandkosten",
+    "Montage vor Ort", "USB-C Ladekabel 2 m", "Beratungsleistung (Stunden)", "Toner schwarz", "Ordner breit",
+    "Lizenz Buchhaltungssoftware", "Transport Palette", "Schulung Mitarbeiter (Tag)",
+]
+
+def parse_latency(spec):
+    """Parse 'parse=2.0,translate=0.8,...' into {name: seconds}"""
+    latency = {}
+    for entry in spec.split(","):
+        if "=" in entry:
+            name, _, value = entry.partition("=")
+            latency[name.strip()] = float(value)
+    return latency
+
+def format_amount(value):
+    """German number format, e.g. 1.234,56"""
+    return f"{value:,.2f}".replace(",", "_").replace(".", ",").replace("_", ".")
+
+def number_set(text):
+    """Numbers printed in a text, which translation leaves untouched"""
+    return set(NUMBER_PATTERN.findall(text))
+
+def completion_key(model, messages):
+    """Key of a recorded chat completion"""
+    payload = json.dumps([model, messages], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def synthetic_fixture(file_name, file_hash):
+    """
+    Deterministic German invoice standing in for an invoice without a
+    recorded fixture: one to three pages of text, a line-item table,
+    bounding boxes and a matching extraction
+    """
+    rng = random.Random(file_hash)
+    vendor, address = rng.choice(VENDORS)
+    invoice_id = f"RE-{rng.randint(2023, 2025)}-{rng.randint(1, 9999):04d}"
+    invoice_date = f"{rng.randint(1, 28):02d}.{rng.randint(1, 12):02d}.2024"
+    page_count = rng.choice([1, 1, 1, 2, 3])
+
+    items = []
+    pages = []
+    for page_index in range(page_count):
+        lines = []
+        if page_index == 0:
+            lines += [
+                f"# Rechnung {invoice_id}", "",
+                f"**{vendor}**", address, f"USt-IdNr.: DE{rng.randint(100000000, 999999999)}", "",
+                f"Rechnungsdatum: {invoice_date}", "",
+                "Sehr geehrte Damen und Herren, vielen Dank für Ihren Auftrag. Wir berechnen Ihnen folgende Leistungen:",
+                "",
+            ]
+        lines += ["| Pos. | Beschreibung | Menge | Einzelpreis | Gesamt |", "|---|---|---|---|---|"]
+        for _ in range(rng.randint(5, 30)):
+            description = rng.choice(ITEMS)
+            quantity = rng.randint(1, 20)
+            unit_price = rng.randint(100, 50000) / 100
+            items.append((description, quantity, unit_price))
+            lines.append(
+                f"| {len(items)} | {description} | {quantity} | {format_amount(unit_price)} EUR "
+                f"| {format_amount(quantity * unit_price)} EUR |"
+            )
+        if page_index == page_count - 1:
+            net = round(sum(quantity * unit_price for _, quantity, unit_price in items), 2)
+            tax = round(net * 0.19, 2)
+            lines += [
+                "",
+                f"Nettobetrag: {format_amount(net)} EUR",
+                f"MwSt. 19 %: {format_amount(tax)} EUR",
+                f"**Gesamtbetrag: {format_amount(net + tax)} EUR**",
+                "",
+                "Zahlbar innerhalb von 14 Tagen ohne Abzug. IBAN: DE89 3704 0044 0532 0130 00",
+            ]
+        else:
+            lines += ["", f"Übertrag auf Seite {page_index + 2}"]
+        pages.append("\n".join(lines))
+
+    bounding_boxes = {"pages": [], "provider": "synthetic"}
+    for page_index, page in enumerate(pages):
+        page_items = [
+            {"type": "table" if line.startswith("|") else "text", "value": line,
+             "bBox": {"x": 40.0, "y": 40.0 + 14.0 * index, "w": min(530.0, 6.0 * len(line)), "h": 12.0}}
+            for index, line in enumerate(page.split("\n")) if line
+        ]
+        bounding_boxes["pages"].append({"page": page_index + 1, "width": 612, "height": 792, "items": page_items})
+
+    net = round(sum(quantity * unit_price for _, quantity, unit_price in items), 2)
+    tax = round(net * 0.19, 2)
+    extraction = {
+        "Invoice Classification": {"Invoice Category": "Goods", "Invoice Type": "Invoice", "Purchase Order Number": ""},
+        "Merchant Details": {"Name": vendor, "Address Line 1": address.split(",")[0], "Country": "Germany",
+                             "City": address.split()[-1], "Post Code": address.split()[-2].rstrip(",")},
+        "Bill To Details": None,
+        "Invoice Details": {"Invoice ID": invoice_id, "Invoice Date": invoice_date, "Currency": "EUR",
+                            "Payment Terms": "14 days"},
+        "Financial Summary": {"Total Amount": round(net + tax, 2), "Net Amount": net, "Tax Amount": tax,
+                              "Roundoff Amount": 0, "Gross Amount": round(net + tax, 2)},
+        "Items": [
+            {"Description": description, "Quantity": quantity, "Unit Price": unit_price, "Tax Rate": 19,
+             "Net Amount": round(quantity * unit_price, 2)}
+            for description, quantity, unit_price in items
+        ],
+    }
+    return {
+        "file_name": file_name,
+        "file_hash": file_hash,
+        "synthetic": True,
+        "source_language": "de",
+        "pages": pages,
+        "bounding_boxes": bounding_boxes,
+        "extraction": extraction,
+    }
+
+class LatencyModel:
+    """Simulated provider latency with a seeded jitter, so runs are comparable"""
+
+    def __init__(self, seconds, scale=1.0, jitter=0.2, seed=0):
+        self.seconds = seconds
+        self.scale = scale
+        self.jitter = jitter
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def delay(self, name, tokens=0):
+        base = self.seconds.get(name, 0.0) + tokens * self.seconds.get("token", 0.0)
+        with self._lock:
+            factor = self._random.uniform(1 - self.jitter, 1 + self.jitter)
+        return base * self.scale * factor
+
+    def sleep(self, name, tokens=0):
+        delay = self.delay(name, tokens)
+        if delay > 0:
+            time.sleep(delay)
+
+class FixtureLibrary:
+    """
+    Recorded provider results: one JSON file per invoice with its parsed
+    pages, bounding boxes, language and extraction (optionally Azure pages),
+    plus completions.json with chat completions keyed by prompt. Invoices
+    without a fixture get a synthetic one.
+    """
+
+    def __init__(self, fixtures_dir=None):
+        self.fixtures = {}
+        self.completions = {}
+        self._numbers = {}
+        self._lock = threading.Lock()
+        fixtures_dir = Path(fixtures_dir) if fixtures_dir else None
+        if fixtures_dir is not None and fixtures_dir.is_dir():
+            for path in sorted(fixtures_dir.glob("*.json")):
+                with open(path, encoding="utf-8") as f:
+                    data = json.load(f)
+                if path.name == COMPLETIONS_FILE:
+                    self.completions = data
+                else:
+                    self.add(data)
+
+    def add(self, fixture):
+        with self._lock:
+            self.fixtures[fixture["file_hash"]] = fixture
+            self._numbers[fixture["file_hash"]] = number_set("\n".join(fixture["pages"]))
+
+    def for_content(self, file_content):
+        """Fixture of an invoice by its content hash, synthesized on first use when none was recorded"""
+        from .hashing import hash_bytes
+
+        file_hash = hash_bytes(file_content)
+        with self._lock:
+            fixture = self.fixtures.get(file_hash)
+        if fixture is None:
+            fixture = synthetic_fixture(None, file_hash)
+            self.add(fixture)
+        return fixture
+
+    def for_text(self, text):
+        """Fixture whose printed numbers best match a (translated) text"""
+        numbers = number_set(text)
+        with self._lock:
+            candidates = list(self._numbers.items())
+        best_hash, best_score = None, 0.0
+        for file_hash, fixture_numbers in candidates:
+            union = numbers | fixture_numbers
+            score = len(numbers & fixture_numbers) / len(union) if union else 0.0
+            if score > best_score:
+                best_hash, best_score = file_hash, score
+        return self.fixtures.get(best_hash) if best_hash else None
+
+class ReplayParser:
+    """
+    Drop-in for LlamaInvoiceParser (and, with pages_key='azure_pages', for
+    AzureInvoiceParser) answering from a FixtureLibrary after a simulated delay
+    """
+
+    def __init__(self, library, latency, latency_name="parse", pages_key="pages"):
+        self.library = library
+        self.latency = latency
+        self.latency_name = latency_name
+        self.pages_key = pages_key
+
+    def warm_up(self):
+        pass
+
+    def pdf_to_markdown(self, file_content):
+        from llama_index.core import Document
+        from .bbox_store import LazyBoundingBoxes
+
+        fixture = self.library.for_content(file_content)
+        self.latency.sleep(self.latency_name)
+        pages = fixture.get(self.pages_key) or fixture["pages"]
+        bounding_boxes = fixture.get(self.pages_key.replace("pages", "bounding_boxes")) or fixture["bounding_boxes"]
+        documents = [Document(text=page, metadata={"page": index + 1}) for index, page in enumerate(pages)]
+        return documents, LazyBoundingBoxes.from_dict(bounding_boxes)
+
+    def parse_invoice(self, file_content):
+        fixture = self.library.for_content(file_content)
+        self.latency.sleep("extract")
+        return fixture["extraction"]
+
+    def extract_from_text(self, text_content):
+        fixture = self.library.for_text(text_content)
+        self.latency.sleep("extract")
+        if fixture is None:
+            raise Exception("Extraction failed - no fixture matches the text")
+        return fixture["extraction"]
+
+    async def apdf_to_markdown(self, file_content):
+        return await asyncio.to_thread(self.pdf_to_markdown, file_content)
+
+    async def aparse_invoice(self, file_content):
+        return await asyncio.to_thread(self.parse_invoice, file_content)
+
+    async def aextract_from_text(self, text_content):
+        return await asyncio.to_thread(self.extract_from_text, text_content)
+
+class ReplayCompletions:
+    """
+    Stand-in for client.chat.completions. Recorded completions are replayed
+    by prompt; otherwise detection answers with the fixture's language and
+    translation returns the text as sent, markers and placeholders included.
+    """
+
+    def __init__(self, library, latency):
+        self.library = library
+        self.latency = latency
+
+    def create(self, model, messages, **kwargs):
+        system_prompt, user_prompt = messages[0]["content"], messages[-1]["content"]
+        detection = "language detection" in system_prompt
+        content = self.library.completions.get(completion_key(model, messages))
+        if content is None and detection:
+            fixture = self.library.for_text(user_prompt)
+            content = fixture.get("source_language", "de") if fixture else "de"
+        elif content is None:
+            content = user_prompt.split("\n\n", 1)[1] if "\n\n" in user_prompt else user_prompt
+            if user_prompt.startswith("Translate this markdown text") and content.endswith("."):
+                content = content[:-1]
+
+        prompt_tokens = sum(len(message["content"]) for message in messages) // 4 + 1
+        completion_tokens = len(content) // 4 + 1
+        self.latency.sleep("detect" if detection else "translate", completion_tokens)
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=content))],
+            usage=SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+                                  total_tokens=prompt_tokens + completion_tokens)
+        )
+
+def replay_translator(library, latency):
+    """MarkdownTranslator whose OpenAI client replays fixtures"""
+    os.environ.setdefault("OPENAI_API_KEY", "offline-benchmark")
+    from .translation import MarkdownTranslator
+
+    translator = MarkdownTranslator()
+    translator.client = SimpleNamespace(
+        chat=SimpleNamespace(completions=ReplayCompletions(library, latency)),
+        models=SimpleNamespace(list=lambda: [])
+    )
+    return translator
+
+def replay_parser(library, latency, backends):
+    """Replay parser for the configured parse backends, with failover when there are several"""
+    from .backends import FailoverParser
+
+    llama = ReplayParser(library, latency)
+    if backends == ["llama"]:
+        return llama
+    parsers = {"llama": llama, "azure": ReplayParser(library, latency, "azure", "azure_pages")}
+    return FailoverParser([(name, parsers[name]) for name in backends], llama)
+
+def counter_totals(snapshot, name, *label_names):
+    """Sum a counter over every label except label_names"""
+    totals = {}
+    for entry in snapshot["counters"].get(name, []):
+        key = tuple(entry["labels"].get(label) for label in label_names)
+        totals[key] = totals.get(key, 0) + entry["value"]
+    return totals
+
+def pass_report(name, summary, snapshot, peak_traced_mb):
+    """Condense a batch summary and a metrics snapshot into one benchmark pass"""
+    cache = {}
+    for (cache_type, result), count in counter_totals(snapshot, "cache_requests_total", "cache_type", "result").items():
+        cache.setdefault(cache_type, {"hit": 0, "miss": 0, "error": 0, "save_error": 0})[result] = count
+    for counts in cache.values():
+        lookups = counts["hit"] + counts["miss"]
+        counts["hit_rate"] = counts["hit"] / lookups if lookups else 0.0
+
+    tokens = {}
+    for (model, kind), count in counter_totals(snapshot, "llm_tokens_total", "model", "kind").items():
+        tokens.setdefault(model, {"prompt": 0, "completion": 0})[kind] = count
+
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    max_rss_mb = max_rss / (1024 * 1024) if sys.platform == "darwin" else max_rss / 1024
+    return {
+        "name": name,
+        "invoices": summary["invoices"],
+        "failed": summary["failed"],
+        "elapsed_seconds": summary["elapsed_seconds"],
+        "invoices_per_minute": summary["invoices_per_minute"],
+        "translation_llm_calls": summary["translation_llm_calls"],
+        "page_cache_hit_rate": summary["page_cache_hit_rate"],
+        "segment_hit_rate": summary["segment_hit_rate"],
+        "extraction_routes": summary["extraction_routes"],
+        "stages": summary["stages"],
+        "cache": cache,
+        "tokens": tokens,
+        "peak_traced_mb": peak_traced_mb,
+        "max_rss_mb": max_rss_mb,
+    }
+
+def run_benchmark(input_dir, fixtures_dir=DEFAULT_FIXTURES_DIR, pattern="*", workers=4, engine="threads",
+                  latency=DEFAULT_LATENCY, latency_scale=1.0, passes=2, batch_translation=False, backends=None,
+                  trace_memory=False, seed=0, keep_work_dir=False):
+    """
+    Process the invoices in input_dir against replayed provider responses,
+    first with an empty cache and then again with the cache it filled.
+    Returns a report with throughput, per-stage latency, cache efficiency,
+    token usage and memory peak per pass.
+    """
+    work_dir = Path(tempfile.mkdtemp(prefix="invoice-benchmark-"))
+    # The cache directory is read when cache_manager is first imported
+    if "src.cache_manager" in sys.modules:
+        raise Exception("Error running benchmark: cache_manager was imported before the benchmark cache was set up")
+    os.environ["CACHE_DIR"] = str(work_dir / "cache")
+    from .batch import run_batch
+    from .metrics import get_metrics
+
+    library = FixtureLibrary(fixtures_dir)
+    latency_model = LatencyModel(parse_latency(latency), latency_scale, seed=seed)
+    llama_parser = replay_parser(library, latency_model, backends or ["llama"])
+    translator = replay_translator(library, latency_model)
+
+    report = {
+        "input_dir": str(input_dir),
+        "pattern": pattern,
+        "engine": engine,
+        "workers": workers,
+        "latency": latency,
+        "latency_scale": latency_scale,
+        "batch_translation": batch_translation,
+        "backends": backends or ["llama"],
+        "recorded_fixtures": sum(1 for fixture in library.fixtures.values() if not fixture.get("synthetic")),
+        "passes": [],
+    }
+    try:
+        for index in range(passes):
+            name = "cold" if index == 0 else f"warm{index if passes > 2 else ''}"
+            get_metrics().reset()
+            if trace_memory:
+                tracemalloc.start()
+            summary = run_batch(
+                input_dir, work_dir / f"results_{name}", workers, pattern, engine,
+                batch_translation=batch_translation, llama_parser=llama_parser, translator=translator
+            )
+            peak_traced_mb = None
+            if trace_memory:
+                peak_traced_mb = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+                tracemalloc.stop()
+            report["passes"].append(pass_report(name, summary, get_metrics().snapshot(), peak_traced_mb))
+        report["synthetic_fixtures"] = sum(1 for fixture in library.fixtures.values() if fixture.get("synthetic"))
+    finally:
+        if not keep_work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    return report
+
+def compare_reports(report, baseline, max_regression=0.15):
+    """List regressions of report against a baseline report: throughput, stage p95, tokens and memory"""
+    # Numbers are only comparable under the same simulated latency and concurrency
+    for setting in ("latency", "latency_scale", "engine", "workers", "pattern", "backends"):
+        if report.get(setting) != baseline.get(setting):
+            return [f"baseline was run with {setting}={baseline.get(setting)}, this run with {report.get(setting)}"]
+
+    regressions = []
+    baseline_passes = {entry["name"]: entry for entry in baseline.get("passes", [])}
+    for current in report["passes"]:
+        previous = baseline_passes.get(current["name"])
+        if previous is None:
+            continue
+        name = current["name"]
+        if current["invoices_per_minute"] < previous["invoices_per_minute"] * (1 - max_regression):
+            regressions.append(
+                f"{name}: throughput {current['invoices_per_minute']:.1f}/min, "
+                f"was {previous['invoices_per_minute']:.1f}/min"
+            )
+        for stage, stats in current["stages"].items():
+            before = previous["stages"].get(stage, {}).get("p95_seconds", 0.0)
+            after = stats["p95_seconds"]
+            if before and after > before * (1 + max_regression) and after - before > MIN_LATENCY_REGRESSION_SECONDS:
+                regressions.append(f"{name}: {stage} p95 {after:.2f}s, was {before:.2f}s")
+        tokens_after = sum(sum(counts.values()) for counts in current["tokens"].values())
+        tokens_before = sum(sum(counts.values()) for counts in previous["tokens"].values())
+        if tokens_before and tokens_after > tokens_before * (1 + max_regression):
+            regressions.append(f"{name}: {tokens_after} LLM tokens, was {tokens_before}")
+        if current["peak_traced_mb"] and previous.get("peak_traced_mb") and \
+                current["peak_traced_mb"] > previous["peak_traced_mb"] * (1 + max_regression):
+            regressions.append(
+                f"{name}: memory peak {current['peak_traced_mb']:.1f} MB, was {previous['peak_traced_mb']:.1f} MB"
+            )
+    return regressions
+
+def format_report(report):
+    """Format a benchmark report as a human-readable table per pass"""
+    lines = [
+        f"Benchmark of {report['input_dir']} ({report['engine']} engine, {report['workers']} workers, "
+        f"latency x{report['latency_scale']}; {report['recorded_fixtures']} recorded and "
+        f"{report.get('synthetic_fixtures', 0)} synthetic fixtures)",
+    ]
+    for entry in report["passes"]:
+        tokens = sum(sum(counts.values()) for counts in entry["tokens"].values())
+        memory = f", traced peak {entry['peak_traced_mb']:.1f} MB" if entry["peak_traced_mb"] is not None else ""
+        lines += [
+            "",
+            f"[{entry['name']}] {entry['invoices']} invoice(s), {entry['failed']} failed, "
+            f"{entry['elapsed_seconds']:.2f}s, {entry['invoices_per_minute']:.1f} invoices/min",
+            f"LLM calls {entry['translation_llm_calls']}, tokens {tokens}, page cache "
+            f"{entry['page_cache_hit_rate']:.0%}, translation memory {entry['segment_hit_rate']:.0%}, "
+            f"max RSS {entry['max_rss_mb']:.0f} MB{memory}",
+        ]
+        if entry["cache"]:
+            lines.append("Cache hit rates: " + ", ".join(
+                f"{cache_type} {counts['hit_rate']:.0%}" for cache_type, counts in sorted(entry["cache"].items())
+            ))
+        lines.append(f"{'Stage':<12} {'computed':>8} {'cached':>7} {'mean':>8} {'p50':>8} {'p95':>8} {'max':>8}")
+        for stage, stats in entry["stages"].items():
+            lines.append(
+                f"{stage:<12} {stats['computed']:>8} {stats['cached']:>7} "
+                f"{stats['mean_seconds']:>7.2f}s {stats['p50_seconds']:>7.2f}s "
+                f"{stats['p95_seconds']:>7.2f}s {stats['max_seconds']:>7.2f}s"
+            )
+    return "\n".join(lines)
+
+def record_fixtures(input_dir, fixtures_dir=DEFAULT_FIXTURES_DIR, pattern="*", live=False):
+    """
+    Write fixtures for the invoices in input_dir from the results already in
+    the cache. With live=True, invoices missing from the cache are processed
+    with the real services first, and their chat completions are recorded too.
+    Returns the number of fixtures written.
+    """
+    from .batch import discover_invoices, process_invoice
+    from .bbox_store import as_lazy_bounding_boxes
+    from .cache_manager import load_from_cache
+    from .clients import get_azure_parser, get_invoice_parser, get_translator
+    from .hashing import InvoiceFile
+
+    fixtures_dir = Path(fixtures_dir)
+    fixtures_dir.mkdir(parents=True, exist_ok=True)
+    completions_path = fixtures_dir / COMPLETIONS_FILE
+    completions = {}
+    if completions_path.exists():
+        with open(completions_path, encoding="utf-8") as f:
+            completions = json.load(f)
+
+    translator = None
+    if live:
+        translator = get_translator()
+        create = translator.client.chat.completions.create
+
+        def recording_create(model, messages, **kwargs):
+            response = create(model=model, messages=messages, **kwargs)
+            completions[completion_key(model, messages)] = response.choices[0].message.content
+            return response
+
+        translator.client.chat.completions.create = recording_create
+
+    written = 0
+    for path in discover_invoices(input_dir, pattern):
+        invoice_file = InvoiceFile.from_path(path)
+        file_hash = invoice_file.file_hash
+        if live and load_from_cache(file_hash, "extraction") is None:
+            record = process_invoice(path, get_invoice_parser(), translator)
+            if record["status"] != "ok":
+                print(f"{path.name}: skipped, {record['error']}")
+                continue
+
+        markdown_data = load_from_cache(file_hash, "markdown")
+        translation_data = load_from_cache(file_hash, "translation")
+        extracted_data = load_from_cache(file_hash, "extraction")
+        if markdown_data is None or extracted_data is None:
+            print(f"{path.name}: skipped, not in the cache (process it first or pass --live)")
+            continue
+
+        bounding_boxes = load_from_cache(file_hash, "bounding_box")
+        fixture = {
+            "file_name": path.name,
+            "file_hash": file_hash,
+            "source_language": translation_data["source_language"] if translation_data else None,
+            "pages": [document.text for document in markdown_data],
+            "bounding_boxes": as_lazy_bounding_boxes(bounding_boxes).to_dict() if bounding_boxes else {"pages": []},
+            "extraction": extracted_data,
+        }
+        if live and os.getenv("AZURE_DOCUMENT_INTELLIGENCE_ENDPOINT"):
+            azure_documents, azure_bounding_boxes = get_azure_parser().pdf_to_markdown(invoice_file.content)
+            fixture["azure_pages"] = [document.text for document in azure_documents]
+            fixture["azure_bounding_boxes"] = azure_bounding_boxes.to_dict()
+
+        with open(fixtures_dir / f"{path.stem}.json", 'w', encoding='utf-8') as f:
+            json.dump(fixture, f, indent=2, ensure_ascii=False, default=str)
+        written += 1
+        print(f"{path.name}: recorded {len(fixture['pages'])} page(s)")
+
+    if completions:
+        with open(completions_path, 'w', encoding='utf-8') as f:
+            json.dump(completions, f, indent=2, ensure_ascii=False)
+    return written
+
+def main(argv=None):
+    """Command line entry point for offline benchmarks"""
+    parser = argparse.ArgumentParser(description="Benchmark the invoice pipeline against recorded provider responses")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="Process sample invoices with replayed responses and report")
+    run_parser.add_argument("input_dir", nargs="?", default="data", help="Directory containing sample invoices")
+    run_parser.add_argument("--fixtures", default=DEFAULT_FIXTURES_DIR, help="Directory of recorded fixtures")
+    run_parser.add_argument("--pattern", default="*", help="Glob pattern for invoice files")
+    run_parser.add_argument("--workers", type=int, default=4, help="Number of invoices processed concurrently")
+    run_parser.add_argument("--engine", choices=["threads", "async"], default="threads")
+    run_parser.add_argument("--latency", default=DEFAULT_LATENCY, help="Simulated seconds per provider call")
+    run_parser.add_argument("--latency-scale", type=float, default=1.0, help="Multiply every simulated latency")
+    run_parser.add_argument("--passes", type=int, default=2, help="Cold pass plus this many minus one warm passes")
+    run_parser.add_argument("--batch-translation", action="store_true", help="Share translation requests")
+    run_parser.add_argument("--backends", default="llama", help="Parse backends, e.g. llama,azure")
+    run_parser.add_argument("--trace-memory", action="store_true",
+                            help="Measure the Python allocation peak (slows the run down)")
+    run_parser.add_argument("--seed", type=int, default=0, help="Seed of the latency jitter")
+    run_parser.add_argument("--output", help="Write the report as JSON")
+    run_parser.add_argument("--baseline", help="Fail when this earlier JSON report was faster")
+    run_parser.add_argument("--max-regression", type=float, default=0.15,
+                            help="Tolerated relative slowdown against the baseline")
+
+    record_parser = subparsers.add_parser("record", help="Write fixtures for sample invoices from the cache")
+    record_parser.add_argument("input_dir", nargs="?", default="data", help="Directory containing sample invoices")
+    record_parser.add_argument("--fixtures", default=DEFAULT_FIXTURES_DIR, help="Directory to write fixtures to")
+    record_parser.add_argument("--pattern", default="*", help="Glob pattern for invoice files")
+    record_parser.add_argument("--live", action="store_true",
+                               help="Process invoices missing from the cache with the real services")
+    args = parser.parse_args(argv)
+
+    if args.command == "record":
+        written = record_fixtures(args.input_dir, args.fixtures, args.pattern, args.live)
+        print(f"Wrote {written} fixture(s) to {args.fixtures}")
+        return 0
+
+    report = run_benchmark(
+        args.input_dir, args.fixtures, args.pattern, args.workers, args.engine, args.latency,
+        args.latency_scale, args.passes, args.batch_translation,
+        [name.strip() for name in args.backends.split(",") if name.strip()], args.trace_memory, args.seed
+    )
+    print()
+    print(format_report(report))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = compare_reports(report, json.load(f), args.max_regression)
+        if regressions:
+            print()
+            print("Regressions against the baseline:")
+            for regression in regressions:
+                print(f"  {regression}")
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,137 @@
+import argparse
+import json
+from pathlib import Path
+
+from .cache_manager import (
+    CACHE_STORE,
+    enforce_cache_limits,
+    get_duplicate_index,
+    get_fingerprint_index,
+    get_template_store,
+    get_translation_memory,
+    count_legacy_file_hashes,
+    migrate_file_hash
+)
+from .cache_store import cache_stats
+from .hashing import FILE_HASH_ALGORITHM, LEGACY_HASH_ALGORITHM, hash_file
+
+def format_bytes(size_bytes):
+    """Format a byte count for display"""
+    for unit in ["B", "KB", "MB", "GB"]:
+        if size_bytes < 1024 or unit == "GB":
+            return f"{size_bytes:.1f} {unit}" if unit != "B" else f"{size_bytes} B"
+        size_bytes /= 1024
+
+def format_stats(stats):
+    """Format cache statistics as a human-readable report"""
+    lines = [
+        f"Entries: {stats['entries']}  Size: {format_bytes(stats['bytes'])}",
+        f"Lookups: {stats['hits'] + stats['misses']}  Hit ratio: {stats['hit_ratio']:.1%}",
+        "",
+        f"{'Type':<18} {'entries':>8} {'size':>10} {'hits':>8} {'misses':>8} {'hit ratio':>10}",
+    ]
+    for cache_type, type_stats in sorted(stats["by_type"].items()):
+        lines.append(
+            f"{cache_type:<18} {type_stats['entries']:>8} {format_bytes(type_stats['bytes']):>10} "
+            f"{type_stats['hits']:>8} {type_stats['misses']:>8} {type_stats['hit_ratio']:>10.1%}"
+        )
+    if "translation_memory" in stats:
+        memory = stats["translation_memory"]
+        lines.append("")
+        lines.append(
+            f"Translation memory: {memory['segments']} segments, "
+            f"{format_bytes(memory['text_bytes'])} of text, {memory['hits']} hits"
+        )
+    if "templates" in stats:
+        templates = stats["templates"]
+        lines.append(
+            f"Invoice templates: {templates['templates']} learned, {templates['verified']} verified, "
+            f"{templates['local_extractions']} local extractions"
+        )
+    if "fingerprints" in stats:
+        fingerprints = stats["fingerprints"]
+        lines.append(
+            f"Layout fingerprints: {fingerprints['documents']} documents, {fingerprints['labels']} templates"
+        )
+    if "duplicates" in stats:
+        duplicates = stats["duplicates"]
+        lines.append(
+            f"Processed invoices: {duplicates['invoices']} registered, "
+            f"{duplicates['with_semantic_key']} with vendor/ID/total key"
+        )
+    if stats.get("legacy_file_hashes"):
+        lines.append(
+            f"Invoices under MD5 file hashes: {stats['legacy_file_hashes']} (not reused until migrate-hashes is run)"
+        )
+    return "\n".join(lines)
+
+def main(argv=None):
+    """Command line entry point for cache statistics and eviction"""
+    parser = argparse.ArgumentParser(description="Inspect and evict the invoice cache")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    stats_parser = subparsers.add_parser("stats", help="Report entries, bytes and hit/miss ratios")
+    stats_parser.add_argument("--json", action="store_true", help="Print statistics as JSON")
+
+    evict_parser = subparsers.add_parser("evict", help="Evict entries beyond size and age limits")
+    evict_parser.add_argument("--max-mb", type=float, help="Maximum cache size in megabytes")
+    evict_parser.add_argument("--max-age-days", type=float, help="Remove entries not accessed for this many days")
+    evict_parser.add_argument("--vacuum", action="store_true", help="Compact the SQLite store afterwards")
+
+    migrate_parser = subparsers.add_parser(
+        "migrate-hashes",
+        help="Re-key cache entries, duplicate records and layout fingerprints of invoices stored under MD5 file hashes"
+    )
+    migrate_parser.add_argument("input_dir", help="Directory containing the original invoice files")
+    migrate_parser.add_argument("--pattern", default="*.pdf", help="Glob pattern for invoice files")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "migrate-hashes":
+        files = moved = 0
+        for path in sorted(Path(args.input_dir).glob(args.pattern)):
+            if not path.is_file():
+                continue
+            # Both digests come from a single streaming read of the file
+            hashes = hash_file(path, [LEGACY_HASH_ALGORITHM, FILE_HASH_ALGORITHM])
+            count = migrate_file_hash(hashes[LEGACY_HASH_ALGORITHM], hashes[FILE_HASH_ALGORITHM])
+            files += 1 if count else 0
+            moved += count
+        print(f"Moved {moved} cache entries and index records of {files} invoice(s) to {FILE_HASH_ALGORITHM} keys")
+        return 0
+
+    if args.command == "stats":
+        stats = cache_stats(CACHE_STORE)
+        stats["legacy_file_hashes"] = count_legacy_file_hashes()
+        translation_memory = get_translation_memory()
+        if translation_memory is not None:
+            stats["translation_memory"] = translation_memory.stats()
+        template_store = get_template_store()
+        if template_store is not None:
+            stats["templates"] = template_store.stats()
+        fingerprint_index = get_fingerprint_index()
+        if fingerprint_index is not None:
+            stats["fingerprints"] = fingerprint_index.stats()
+        duplicate_index = get_duplicate_index()
+        if duplicate_index is not None:
+            stats["duplicates"] = duplicate_index.stats()
+        print(json.dumps(stats, indent=2) if args.json else format_stats(stats))
+        return 0
+
+    max_bytes = int(args.max_mb * 1024 * 1024) if args.max_mb is not None else None
+    max_age_seconds = args.max_age_days * 86400 if args.max_age_days is not None else None
+    summary = enforce_cache_limits(max_bytes, max_age_seconds)
+    if summary is None:
+        print("No limits given; set --max-mb/--max-age-days or CACHE_MAX_MB/CACHE_MAX_AGE_DAYS")
+        return 1
+    if args.vacuum and hasattr(CACHE_STORE, "vacuum"):
+        CACHE_STORE.vacuum()
+    print(f"Removed {summary['removed_entries']} entries ({format_bytes(summary['removed_bytes'])})")
+    for cache_type, type_summary in sorted(summary["by_type"].items()):
+        print(f"  {cache_type}: {type_summary['entries']} entries ({format_bytes(type_summary['bytes'])})")
+    if "removed_segments" in summary:
+        print(f"Removed {summary['removed_segments']} translation memory segments")
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
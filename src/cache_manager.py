@@ -1,36 +1,186 @@
 import hashlib
-import pickle
+import os
+import queue
+import re
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import streamlit as st
+from .bbox_store import LazyBoundingBoxes, as_lazy_bounding_boxes
+from .cache_store import create_cache_store, evict
+from .file_utils import cleanup_temp_files
+from .routing import choose_extraction_route, run_extraction, start_extraction
+from .translation_memory import TranslationMemory
+from .templates import TemplateStore
+from .fingerprint import FingerprintIndex, layout_fingerprint
+from .dedup import DuplicateIndex
+from .hashing import FILE_HASH_ALGORITHM, LEGACY_HASH_ALGORITHM, file_hash_algorithm, hash_bytes
+from .language_detection import StopwordLanguageDetector
+from .masking import TRANSLATION_MASKING
+from .metrics import get_metrics
 
 # Create cache directory
-CACHE_DIR = Path("cache")
+CACHE_DIR = Path(os.getenv("CACHE_DIR", "cache"))
 CACHE_DIR.mkdir(exist_ok=True)
 
+# Indexed cache store (CACHE_BACKEND=sqlite by default, or pickle for the old one-file-per-entry layout)
+CACHE_STORE = create_cache_store(CACHE_DIR)
+
+# Cache limits applied every CACHE_EVICTION_INTERVAL saves; unset means unbounded
+CACHE_MAX_BYTES = int(float(os.getenv("CACHE_MAX_MB")) * 1024 * 1024) if os.getenv("CACHE_MAX_MB") else None
+CACHE_MAX_AGE_SECONDS = float(os.getenv("CACHE_MAX_AGE_DAYS")) * 86400 if os.getenv("CACHE_MAX_AGE_DAYS") else None
+CACHE_EVICTION_INTERVAL = int(os.getenv("CACHE_EVICTION_INTERVAL", "200"))
+_saves_since_eviction = 0
+_eviction_lock = threading.Lock()
+
+# Maximum number of pages translated concurrently per document
+TRANSLATION_MAX_WORKERS = int(os.getenv("TRANSLATION_MAX_WORKERS", "4"))
+
+# Part of every page translation key; bump it when the same page would now be translated differently
+PAGE_TRANSLATION_VERSION = 2
+
+# Screens every page for a language other than the document's, also when LOCAL_LANGUAGE_DETECTION is off
+PAGE_LANGUAGE_SCREEN = StopwordLanguageDetector()
+
+# Segment-level translation memory shared by all invoices
+TRANSLATION_MEMORY_ENABLED = os.getenv("TRANSLATION_MEMORY", "true").lower() != "false"
+_translation_memory = None
+_translation_memory_lock = threading.Lock()
+
+# Vendor templates learned from remote extractions; verified templates extract known layouts locally
+TEMPLATE_EXTRACTION_ENABLED = os.getenv("TEMPLATE_EXTRACTION", "true").lower() != "false"
+TEMPLATE_MIN_VERIFICATIONS = int(os.getenv("TEMPLATE_MIN_VERIFICATIONS", "2"))
+_template_store = None
+_template_store_lock = threading.Lock()
+
+# Layout fingerprints of processed documents; template lookup only tries the templates of similar layouts
+FINGERPRINT_INDEX_ENABLED = os.getenv("FINGERPRINT_INDEX", "true").lower() != "false"
+FINGERPRINT_MIN_SIMILARITY = float(os.getenv("FINGERPRINT_MIN_SIMILARITY", "0.5"))
+_fingerprint_index = None
+_fingerprint_index_lock = threading.Lock()
+
+# Registry of processed invoices; rescans of a processed invoice reuse its translation and extraction
+DUPLICATE_DETECTION_ENABLED = os.getenv("DUPLICATE_DETECTION", "true").lower() != "false"
+DUPLICATE_MIN_SIMILARITY = float(os.getenv("DUPLICATE_MIN_SIMILARITY", "0.8"))
+_duplicate_index = None
+_duplicate_index_lock = threading.Lock()
+
+# Cache types keyed by the invoice's file hash
+FILE_CACHE_TYPES = ("markdown", "bounding_box", "translation", "extraction")
+LEGACY_FILE_HASH = re.compile(r"[0-9a-f]{32}")
+_legacy_file_hashes = None
+
 def get_file_hash(file_content):
-    """Generate consistent hash for file content"""
-    return hashlib.md5(file_content).hexdigest()
+    """Generate consistent hash for file content, prefixed with the hash algorithm"""
+    return hash_bytes(file_content)
+
+def migrate_file_hash(old_hash, new_hash):
+    """
+    Move the per-file cache entries of an invoice and its records in the
+    duplicate registry and layout fingerprint index to a new file hash,
+    returning how many were moved
+    """
+    moved = 0
+    if old_hash == new_hash:
+        return moved
+    for cache_type in FILE_CACHE_TYPES:
+        data = CACHE_STORE.load(old_hash, cache_type)
+        if data is None:
+            continue
+        if CACHE_STORE.load(new_hash, cache_type) is None:
+            CACHE_STORE.save(new_hash, cache_type, data)
+        CACHE_STORE.delete(old_hash, cache_type)
+        moved += 1
+    duplicate_index = get_duplicate_index()
+    if duplicate_index is not None and duplicate_index.rename(old_hash, new_hash):
+        moved += 1
+    fingerprint_index = get_fingerprint_index()
+    if fingerprint_index is not None and fingerprint_index.rename(old_hash, new_hash):
+        moved += 1
+    return moved
+
+def count_legacy_file_hashes():
+    """
+    Number of invoices whose cache entries are still keyed by bare MD5 file
+    hashes, counted once per process
+    """
+    global _legacy_file_hashes
+    if FILE_HASH_ALGORITHM == LEGACY_HASH_ALGORITHM:
+        return 0
+    if _legacy_file_hashes is None:
+        stores = [CACHE_STORE, getattr(CACHE_STORE, "legacy_store", None)]
+        _legacy_file_hashes = len({
+            cache_key
+            for store in stores if store is not None
+            for cache_key, cache_type, _, _ in store.entries()
+            if cache_type in FILE_CACHE_TYPES and file_hash_algorithm(cache_key) == LEGACY_HASH_ALGORITHM
+            and LEGACY_FILE_HASH.fullmatch(cache_key)
+        })
+    return _legacy_file_hashes
+
+def legacy_file_hash_warning():
+    """Warning text when MD5-keyed cache entries need migrating, otherwise None"""
+    count = count_legacy_file_hashes()
+    if not count:
+        return None
+    return (
+        f"{count} invoice(s) are cached under MD5 file hashes and will not be reused; "
+        f"run python -m src.cache_admin migrate-hashes <invoice directory> to re-key them"
+    )
 
 def load_from_cache(cache_key, cache_type):
     """Load data from disk cache"""
-    cache_file = CACHE_DIR / f"{cache_key}_{cache_type}.pkl"
-    if cache_file.exists():
-        try:
-            with open(cache_file, 'rb') as f:
-                return pickle.load(f)
-        except Exception as e:
-            st.warning(f"Cache loading error for {cache_type}: {str(e)}")
+    metrics = get_metrics()
+    start = time.perf_counter()
+    try:
+        data = CACHE_STORE.load(cache_key, cache_type)
+        metrics.increment("cache_requests_total", cache_type=cache_type, result="hit" if data is not None else "miss")
+        return data
+    except Exception as e:
+        metrics.increment("cache_requests_total", cache_type=cache_type, result="error")
+        st.warning(f"Cache loading error for {cache_type}: {str(e)}")
+    finally:
+        metrics.observe("cache_operation_seconds", time.perf_counter() - start, operation="load", cache_type=cache_type)
     return None
 
 def save_to_cache(cache_key, cache_type, data):
     """Save data to disk cache"""
-    cache_file = CACHE_DIR / f"{cache_key}_{cache_type}.pkl"
+    metrics = get_metrics()
+    start = time.perf_counter()
     try:
-        with open(cache_file, 'wb') as f:
-            pickle.dump(data, f)
+        CACHE_STORE.save(cache_key, cache_type, data)
     except Exception as e:
+        metrics.increment("cache_requests_total", cache_type=cache_type, result="save_error")
         st.warning(f"Cache saving error for {cache_type}: {str(e)}")
+    metrics.observe("cache_operation_seconds", time.perf_counter() - start, operation="save", cache_type=cache_type)
+    
+    global _saves_since_eviction
+    with _eviction_lock:
+        _saves_since_eviction += 1
+        run_eviction = _saves_since_eviction >= CACHE_EVICTION_INTERVAL
+        if run_eviction:
+            _saves_since_eviction = 0
+    if run_eviction:
+        enforce_cache_limits()
+
+def enforce_cache_limits(max_bytes=None, max_age_seconds=None):
+    """Evict cache entries beyond the configured size and age limits"""
+    max_bytes = max_bytes if max_bytes is not None else CACHE_MAX_BYTES
+    max_age_seconds = max_age_seconds if max_age_seconds is not None else CACHE_MAX_AGE_SECONDS
+    if max_bytes is None and max_age_seconds is None:
+        return None
+    try:
+        # Leftovers from interrupted atomic writes
+        cleanup_temp_files([str(CACHE_DIR / "*.tmp")])
+        summary = evict(CACHE_STORE, max_bytes, max_age_seconds)
+        translation_memory = get_translation_memory()
+        if translation_memory is not None and max_age_seconds is not None:
+            summary["removed_segments"] = translation_memory.evict(max_age_seconds)
+        return summary
+    except Exception as e:
+        st.warning(f"Cache eviction error: {str(e)}")
+    return None
 
 def get_cached_or_compute_markdown(file_content, file_hash, llama_parser):
     """Get markdown data from cache or compute it"""
@@ -42,7 +192,7 @@ def get_cached_or_compute_markdown(file_content, file_hash, llama_parser):
     
     # Check disk cache
     cached_markdown = load_from_cache(file_hash, "markdown")
-    cached_bounding_box = load_from_cache(file_hash, "bounding_box")
+    cached_bounding_box = as_lazy_bounding_boxes(load_from_cache(file_hash, "bounding_box"))
     if cached_markdown is not None and cached_bounding_box is not None:
         st.session_state.markdown_data = cached_markdown
         st.session_state.bounding_box_data = cached_bounding_box
@@ -60,7 +210,252 @@ def get_cached_or_compute_markdown(file_content, file_hash, llama_parser):
     
     return markdown_data, bounding_box_data, False
 
-def get_cached_or_compute_translation(markdown_data, file_hash, translator):
+def get_language_sample(markdown_data):
+    """Pick the text used for document-level language detection"""
+    for doc in markdown_data:
+        if doc.text.strip():
+            return doc.text
+    return markdown_data[0].text
+
+def page_language_differs(translator, markdown_text, document_language):
+    """Screen a page locally; True when the page clearly looks like a language other than the document's"""
+    detector = translator.local_detector or PAGE_LANGUAGE_SCREEN
+    return detector.differs_from(markdown_text, document_language, translator.local_confidence_threshold)
+
+def detect_page_language(translator, markdown_text, document_language):
+    """
+    Detect the language of one page of a document, returning (language, detection_calls).
+    Only pages the local screen disagrees on are detected on their own.
+    """
+    if not page_language_differs(translator, markdown_text, document_language):
+        return document_language, 0
+    language, source = translator.detect_language_with_source(markdown_text)
+    return language, 1 if source == 'llm' else 0
+
+def resolve_page_languages(markdown_data, translator, per_page=False):
+    """
+    Detect source languages for all pages, returning (languages, detection_calls).
+    The document is detected once and every page is screened locally for
+    another language; per_page detects every page on its own instead.
+    """
+    if per_page:
+        detections = [translator.detect_language_with_source(doc.text) for doc in markdown_data]
+        return [language for language, _ in detections], sum(1 for _, source in detections if source == 'llm')
+    
+    sample = get_language_sample(markdown_data)
+    document_language, source = translator.detect_language_with_source(sample)
+    detection_calls = 1 if source == 'llm' else 0
+    languages = []
+    for doc in markdown_data:
+        # The sample page was already detected with the document
+        language, calls = (document_language, 0) if doc.text == sample else \
+            detect_page_language(translator, doc.text, document_language)
+        languages.append(language)
+        detection_calls += calls
+    return languages, detection_calls
+
+def page_translation_mode():
+    """Translation pipeline version and masking setting a page translation was made with"""
+    return f"v{PAGE_TRANSLATION_VERSION}-{'masked' if TRANSLATION_MASKING else 'plain'}"
+
+def get_page_cache_key(markdown_text, source_language, model):
+    """Generate content-addressed cache key for one page translation"""
+    # Pages translated by an older pipeline or with the other masking setting are not served
+    page_key = f"{model}\n{source_language.lower()}\n{page_translation_mode()}\n{markdown_text}"
+    return hashlib.sha256(page_key.encode('utf-8')).hexdigest()
+
+def load_page_translation(markdown_text, source_language, model):
+    """Load a cached translation of identical page text, if any"""
+    return load_from_cache(get_page_cache_key(markdown_text, source_language, model), "page_translation")
+
+def save_page_translation(markdown_text, source_language, model, translated_text):
+    """Save a page translation under its content-addressed key"""
+    save_to_cache(get_page_cache_key(markdown_text, source_language, model), "page_translation", translated_text)
+
+def get_translation_memory():
+    """Get the shared translation memory, or None when it is disabled"""
+    global _translation_memory
+    if not TRANSLATION_MEMORY_ENABLED:
+        return None
+    with _translation_memory_lock:
+        if _translation_memory is None:
+            _translation_memory = TranslationMemory(CACHE_DIR / "translation_memory.sqlite")
+    return _translation_memory
+
+def get_template_store():
+    """Get the shared invoice template store, or None when template extraction is disabled"""
+    global _template_store
+    if not TEMPLATE_EXTRACTION_ENABLED:
+        return None
+    with _template_store_lock:
+        if _template_store is None:
+            _template_store = TemplateStore(CACHE_DIR / "templates.sqlite", TEMPLATE_MIN_VERIFICATIONS)
+    return _template_store
+
+def get_fingerprint_index():
+    """Get the shared layout fingerprint index, or None when it is disabled"""
+    global _fingerprint_index
+    if not FINGERPRINT_INDEX_ENABLED:
+        return None
+    with _fingerprint_index_lock:
+        if _fingerprint_index is None:
+            _fingerprint_index = FingerprintIndex(CACHE_DIR / "fingerprints.sqlite")
+    return _fingerprint_index
+
+def find_similar_layouts(markdown_data, bounding_box_data=None, top_k=5):
+    """Return the template ids of the most similar known layouts, best first"""
+    fingerprint_index = get_fingerprint_index()
+    if fingerprint_index is None:
+        return None
+    signature = layout_fingerprint(markdown_data, bounding_box_data)
+    return fingerprint_index.top_labels(signature, top_k, FINGERPRINT_MIN_SIMILARITY)
+
+def extract_with_template(markdown_data, bounding_box_data=None):
+    """Extract an invoice locally with a verified vendor template, or return None"""
+    template_store = get_template_store()
+    if template_store is None:
+        return None
+    try:
+        # Only templates of similar layouts are tried; None means the index is off and every template is checked
+        template_ids = find_similar_layouts(markdown_data, bounding_box_data)
+        if template_ids == []:
+            return None
+        extracted_data, _ = template_store.extract(markdown_data, template_ids)
+        return extracted_data
+    except Exception as e:
+        st.warning(f"Template extraction error: {str(e)}")
+        return None
+
+def learn_extraction_template(markdown_data, extracted_data, bounding_box_data=None, file_hash=None):
+    """Learn or verify a vendor template from a remote extraction and index the document's layout"""
+    template_store = get_template_store()
+    if template_store is None or not markdown_data or not extracted_data:
+        return
+    try:
+        template_id = template_store.learn(markdown_data, extracted_data)
+        fingerprint_index = get_fingerprint_index()
+        if fingerprint_index is not None and file_hash is not None:
+            fingerprint_index.add(file_hash, layout_fingerprint(markdown_data, bounding_box_data), template_id)
+    except Exception as e:
+        st.warning(f"Template learning error: {str(e)}")
+
+def get_duplicate_index():
+    """Get the shared duplicate invoice registry, or None when duplicate detection is disabled"""
+    global _duplicate_index
+    if not DUPLICATE_DETECTION_ENABLED:
+        return None
+    with _duplicate_index_lock:
+        if _duplicate_index is None:
+            _duplicate_index = DuplicateIndex(CACHE_DIR / "duplicates.sqlite", DUPLICATE_MIN_SIMILARITY)
+    return _duplicate_index
+
+def check_duplicate(file_hash, markdown_data, file_name=None):
+    """
+    Look for an already processed invoice this document duplicates. Detection
+    only: no stage is skipped. An exact duplicate shares the original's cache
+    entries by content hash; a near duplicate is only 'suspected', and
+    register_processed_invoice settles it from the extraction.
+    """
+    duplicate_index = get_duplicate_index()
+    if duplicate_index is None or not markdown_data:
+        return None
+    try:
+        return duplicate_index.find(file_hash, markdown_data, file_name)
+    except Exception as e:
+        st.warning(f"Duplicate detection error: {str(e)}")
+        return None
+
+def register_processed_invoice(file_hash, markdown_data, extracted_data, file_name=None, duplicate=None):
+    """
+    Record a processed invoice and return the duplicate to report: the match
+    from check_duplicate, with a suspected near duplicate confirmed or
+    cleared by the extraction, or else an earlier invoice with the same
+    vendor, invoice ID and total
+    """
+    duplicate_index = get_duplicate_index()
+    if duplicate_index is None or not markdown_data:
+        return duplicate
+    try:
+        if duplicate is not None and duplicate['kind'] == "suspected":
+            duplicate = duplicate_index.confirm(duplicate, extracted_data)
+        semantic_duplicate = duplicate_index.register(file_hash, markdown_data, extracted_data, file_name)
+        return duplicate if duplicate is not None else semantic_duplicate
+    except Exception as e:
+        st.warning(f"Duplicate registration error: {str(e)}")
+        return duplicate
+
+def translate_page(translator, markdown_text, source_language):
+    """Translate one page, reusing the page cache for text seen in other invoices"""
+    if source_language.lower() == 'en':
+        return translator.process_markdown(markdown_text, source_language)
+    
+    cached_text = load_page_translation(markdown_text, source_language, translator.translation_model)
+    if cached_text is not None:
+        return {
+            'source_language': source_language,
+            'translated_text': cached_text,
+            'was_translated': True,
+            'llm_calls': 0,
+            'page_cache_hit': True
+        }
+    
+    translation_memory = get_translation_memory()
+    if translation_memory is not None:
+        translation_result = translation_memory.process_markdown(translator, markdown_text, source_language)
+    else:
+        translation_result = translator.process_markdown(markdown_text, source_language)
+    save_page_translation(markdown_text, source_language, translator.translation_model,
+                          translation_result['translated_text'])
+    translation_result['page_cache_hit'] = False
+    return translation_result
+
+def combine_translation_results(translation_results, source_language, detection_calls):
+    """Combine per-page translation results into translation data"""
+    translation_calls = sum(result.get('llm_calls', 0) for result in translation_results)
+    page_cache_hits = sum(1 for result in translation_results if result.get('page_cache_hit') is True)
+    page_cache_misses = sum(1 for result in translation_results if result.get('page_cache_hit') is False)
+    segment_hits = sum(result['segments']['hits'] for result in translation_results if 'segments' in result)
+    segment_misses = sum(result['segments']['misses'] for result in translation_results if 'segments' in result)
+    return {
+        'results': translation_results,
+        'combined_text': "".join(result['translated_text'] + '\n\n' for result in translation_results),
+        'source_language': source_language,
+        'llm_calls': {
+            'detect_language': detection_calls,
+            'translate_to_english': translation_calls,
+            'total': detection_calls + translation_calls
+        },
+        'page_cache': {
+            'hits': page_cache_hits,
+            'misses': page_cache_misses
+        },
+        'translation_memory': {
+            'hits': segment_hits,
+            'misses': segment_misses
+        }
+    }
+
+def compute_translation(markdown_data, translator, max_workers=TRANSLATION_MAX_WORKERS, per_page_language=False,
+                        detected=None):
+    """Translate all markdown pages and combine them into translation data"""
+    # Resolve languages up front so no page is detected more than once; detected reuses an earlier detection
+    if detected is None:
+        detected = resolve_page_languages(markdown_data, translator, per_page_language)
+    languages, detection_calls = detected
+    
+    # Process all pages, up to max_workers at a time; map keeps page order
+    page_texts = [doc.text for doc in markdown_data]
+    translators = [translator] * len(page_texts)
+    if max_workers > 1 and len(page_texts) > 1:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(page_texts))) as executor:
+            translation_results = list(executor.map(translate_page, translators, page_texts, languages))
+    else:
+        translation_results = list(map(translate_page, translators, page_texts, languages))
+    
+    return combine_translation_results(translation_results, languages[0], detection_calls)
+
+def get_cached_or_compute_translation(markdown_data, file_hash, translator, max_workers=TRANSLATION_MAX_WORKERS,
+                                      per_page_language=False, detected=None):
     """Get translation data from cache or compute it"""
     # Check session state first
     if (st.session_state.current_file_hash == file_hash and 
@@ -74,34 +469,235 @@ def get_cached_or_compute_translation(markdown_data, file_hash, translator):
         return cached_data, True
     
     # Compute new
-    translation_results = []
-    translation_text = ""
+    with st.spinner(f"Translating {len(markdown_data)} page(s)..."):
+        translation_data = compute_translation(markdown_data, translator, max_workers, per_page_language, detected)
     
-    # Process first page for language detection
-    with st.spinner("Detecting language..."):
-        first_result = translator.process_markdown(markdown_data[0].text)
+    # Save to cache
+    save_to_cache(file_hash, "translation", translation_data)
+    st.session_state.translation_data = translation_data
     
-    # Process all pages
-    for i, doc in enumerate(markdown_data):
-        with st.spinner(f"Processing page {i+1}..."):
-            translation_result = translator.process_markdown(doc.text)
+    return translation_data, False
+
+def stream_markdown_and_translation(file_content, file_hash, llama_parser, translator,
+                                    max_workers=TRANSLATION_MAX_WORKERS, per_page_language=False):
+    """
+    Parse and translate a document, yielding events as results arrive so the
+    UI can show pages before the whole document is done:
+
+    {'stage': 'markdown', 'pages': {index: document}} for each parse job,
+    {'stage': 'translation', 'pages': {index: result}} for each translated page,
+    {'stage': 'markdown_complete', 'markdown_data', 'bounding_box_data', 'detected'} once parsing ends,
+    {'stage': 'complete', 'markdown_data', 'bounding_box_data', 'translation_data', 'cached'} last.
+
+    Cached stages are yielded as a single event.
+    """
+    cached = {'markdown': False, 'translation': False}
+    if st.session_state.current_file_hash == file_hash and st.session_state.markdown_data is not None:
+        markdown_data, bounding_box_data = st.session_state.markdown_data, st.session_state.bounding_box_data
+    else:
+        markdown_data = load_from_cache(file_hash, "markdown")
+        bounding_box_data = as_lazy_bounding_boxes(load_from_cache(file_hash, "bounding_box"))
+        if markdown_data is None or bounding_box_data is None:
+            markdown_data, bounding_box_data = None, None
+    cached['markdown'] = markdown_data is not None
+    
+    if st.session_state.current_file_hash == file_hash and st.session_state.translation_data is not None:
+        translation_data = st.session_state.translation_data
+    else:
+        translation_data = load_from_cache(file_hash, "translation")
+    cached['translation'] = translation_data is not None
+    
+    if cached['markdown']:
+        yield {'stage': 'markdown', 'pages': dict(enumerate(markdown_data))}
+    if cached['translation']:
+        yield {'stage': 'translation', 'pages': dict(enumerate(translation_data['results']))}
+    
+    if not (cached['markdown'] and cached['translation']):
+        # Parse jobs and page translations run in worker threads and report back through one queue
+        events = queue.Queue()
+        executor = ThreadPoolExecutor(max_workers=max(1, max_workers))
+        pages = list(markdown_data) if cached['markdown'] else []
+        bounding_box_parts = []
+        translation_results = {}
+        languages = []
+        document_language = None
+        sample = None
+        detection_calls = 0
+        waiting_pages = []
+        pending_translations = 0
+        parsing = not cached['markdown']
+        
+        def parse_pages():
+            try:
+                for documents, bounding_boxes in llama_parser.iter_pdf_to_markdown(file_content):
+                    events.put(('markdown', documents, bounding_boxes))
+                events.put(('parsed', None, None))
+            except Exception as e:
+                events.put(('error', e, None))
+        
+        def submit_translation(index, language):
+            future = executor.submit(translate_page, translator, pages[index].text, language)
+            future.add_done_callback(lambda done, index=index: events.put(('translation', index, done)))
+        
+        def assign_languages(new_indices, final=False):
+            """Detect languages for new pages and start translating them; returns the number started"""
+            nonlocal detection_calls, document_language, sample
+            if cached['translation']:
+                return 0
+            waiting_pages.extend(new_indices)
+            if document_language is None and not per_page_language:
+                # Document-level detection waits for the first page with text, as get_language_sample does
+                sample = next((pages[index].text for index in waiting_pages if pages[index].text.strip()), None)
+                if sample is None and not final:
+                    return 0
+                if sample is None:
+                    sample = pages[0].text
+                document_language, source = translator.detect_language_with_source(sample)
+                detection_calls += 1 if source == 'llm' else 0
+            started = 0
+            for index in waiting_pages:
+                if per_page_language:
+                    language, source = translator.detect_language_with_source(pages[index].text)
+                    calls = 1 if source == 'llm' else 0
+                elif pages[index].text == sample:
+                    language, calls = document_language, 0
+                else:
+                    language, calls = detect_page_language(translator, pages[index].text, document_language)
+                detection_calls += calls
+                languages.append(language)
+                submit_translation(index, language)
+                started += 1
+            waiting_pages.clear()
+            return started
+        
+        try:
+            if parsing:
+                threading.Thread(target=parse_pages, name="parse-stream", daemon=True).start()
+            else:
+                pending_translations += assign_languages(range(len(pages)), final=True)
+                yield {'stage': 'markdown_complete', 'markdown_data': markdown_data,
+                       'bounding_box_data': bounding_box_data,
+                       'detected': (languages, detection_calls)}
             
-            translation_results.append(translation_result)
-            translation_text += (translation_result['translated_text'] + '\n\n')
+            while parsing or pending_translations:
+                kind, payload, extra = events.get()
+                if kind == 'error':
+                    raise payload
+                if kind == 'markdown':
+                    first_index = len(pages)
+                    pages.extend(payload)
+                    bounding_box_parts.append(extra)
+                    yield {'stage': 'markdown', 'pages': {first_index + i: doc for i, doc in enumerate(payload)}}
+                    pending_translations += assign_languages(range(first_index, len(pages)))
+                elif kind == 'parsed':
+                    parsing = False
+                    if not pages:
+                        raise Exception("No markdown data could be generated from the invoice")
+                    pending_translations += assign_languages([], final=True)
+                    markdown_data = pages
+                    bounding_box_data = LazyBoundingBoxes.concat(bounding_box_parts)
+                    save_to_cache(file_hash, "markdown", markdown_data)
+                    save_to_cache(file_hash, "bounding_box", bounding_box_data)
+                    st.session_state.markdown_data = markdown_data
+                    st.session_state.bounding_box_data = bounding_box_data
+                    yield {'stage': 'markdown_complete', 'markdown_data': markdown_data,
+                           'bounding_box_data': bounding_box_data,
+                           'detected': None if cached['translation'] else (languages, detection_calls)}
+                else:
+                    pending_translations -= 1
+                    translation_results[payload] = extra.result()
+                    yield {'stage': 'translation', 'pages': {payload: translation_results[payload]}}
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+        
+        if not cached['translation']:
+            translation_data = combine_translation_results(
+                [translation_results[index] for index in range(len(pages))], languages[0], detection_calls
+            )
+            save_to_cache(file_hash, "translation", translation_data)
     
-    translation_data = {
-        'results': translation_results,
-        'combined_text': translation_text,
-        'source_language': first_result['source_language']
-    }
+    else:
+        yield {'stage': 'markdown_complete', 'markdown_data': markdown_data,
+               'bounding_box_data': bounding_box_data, 'detected': None}
     
-    # Save to cache
-    save_to_cache(file_hash, "translation", translation_data)
+    st.session_state.markdown_data = markdown_data
+    st.session_state.bounding_box_data = bounding_box_data
     st.session_state.translation_data = translation_data
+    yield {'stage': 'complete', 'markdown_data': markdown_data, 'bounding_box_data': bounding_box_data,
+           'translation_data': translation_data, 'cached': cached}
+
+def plan_extraction(file_content, file_hash, markdown_data, translator, llama_parser, per_page_language=False,
+                    detected=None, bounding_box_data=None):
+    """
+    Choose the extraction route for a document from its languages and page
+    count, and start extraction right away when the route does not need the
+    translation. Returns a plan dict for compute_extraction; its 'seconds'
+    is the time spent on extraction itself, without language detection or
+    translation, and 'wait_seconds' how long the caller waited for a
+    background extraction after the translation.
+    """
+    start = time.perf_counter()
+    plan = {
+        'route': None,
+        'detected': None,
+        'future': None,
+        'cached_data': load_from_cache(file_hash, "extraction"),
+        'template_data': None,
+        'file_content': file_content,
+        'file_hash': file_hash,
+        'markdown_data': markdown_data,
+        'bounding_box_data': bounding_box_data,
+        'seconds': None,
+        'wait_seconds': None
+    }
+    if plan['cached_data'] is not None:
+        plan['seconds'] = time.perf_counter() - start
+        return plan
     
-    return translation_data, False
+    # Known vendor layouts are extracted locally, without language detection or any remote call
+    start = time.perf_counter()
+    plan['template_data'] = extract_with_template(markdown_data, bounding_box_data)
+    if plan['template_data'] is not None:
+        plan['route'] = "template"
+        plan['seconds'] = time.perf_counter() - start
+        return plan
+    
+    cached_translation = load_from_cache(file_hash, "translation") if detected is None else None
+    if detected is not None:
+        # Languages already detected by the caller, e.g. while streaming pages
+        plan['detected'] = detected
+        languages = detected[0]
+    elif cached_translation is not None:
+        languages = [result['source_language'] for result in cached_translation['results']]
+    else:
+        # Detected once here and handed on to the translation stage
+        plan['detected'] = resolve_page_languages(markdown_data, translator, per_page_language)
+        languages = plan['detected'][0]
+    
+    plan['route'] = choose_extraction_route(languages, len(markdown_data))
+    plan['future'] = start_extraction(plan['route'], llama_parser, file_content, markdown_data, timing=plan)
+    return plan
+
+def compute_extraction(translation_text, llama_parser, plan=None):
+    """Finish extraction for a plan, or extract from the translated text when there is no plan"""
+    if plan is None or plan['route'] is None:
+        return llama_parser.extract_from_text(translation_text)
+    if plan['route'] == "template":
+        return plan['template_data']
+    start = time.perf_counter()
+    if plan['future'] is not None:
+        # The background extraction sets plan['seconds'] itself
+        extracted_data = plan['future'].result()
+        plan['wait_seconds'] = time.perf_counter() - start
+    else:
+        extracted_data = run_extraction(
+            plan['route'], llama_parser, plan['file_content'], plan['markdown_data'], translation_text
+        )
+        plan['seconds'] = time.perf_counter() - start
+    learn_extraction_template(plan['markdown_data'], extracted_data, plan['bounding_box_data'], plan['file_hash'])
+    return extracted_data
 
-def get_cached_or_compute_extraction(translation_text, file_hash, llama_parser):
+def get_cached_or_compute_extraction(translation_text, file_hash, llama_parser, plan=None):
     """Get extraction data from cache or compute it"""
     # Check session state first
     if (st.session_state.current_file_hash == file_hash and 
@@ -109,14 +705,14 @@ def get_cached_or_compute_extraction(translation_text, file_hash, llama_parser):
         return st.session_state.extracted_data, True
     
     # Check disk cache
-    cached_data = load_from_cache(file_hash, "extraction")
+    cached_data = plan['cached_data'] if plan is not None else load_from_cache(file_hash, "extraction")
     if cached_data is not None:
         st.session_state.extracted_data = cached_data
         return cached_data, True
     
     # Compute new
     with st.spinner("Extracting structured data..."):
-        extracted_data = llama_parser.extract_from_text(translation_text)
+        extracted_data = compute_extraction(translation_text, llama_parser, plan)
     
     # Save to cache
     save_to_cache(file_hash, "extraction", extracted_data)
@@ -138,10 +734,13 @@ def initialize_session_cache():
         st.session_state.bounding_box_data = None
     if 'translation_data' not in st.session_state:
         st.session_state.translation_data = None
+    if 'duplicate' not in st.session_state:
+        st.session_state.duplicate = None
 
 def clear_session_cache():
     """Clear session cache for new file"""
     st.session_state.markdown_data = None
     st.session_state.bounding_box_data = None
     st.session_state.translation_data = None
-    st.session_state.extracted_data = None 
\ No newline at end of file
+    st.session_state.extracted_data = None
+    st.session_state.duplicate = None 
\ No newline at end of file
@@ -0,0 +1,359 @@
+import atexit
+import json
+import os
+import pickle
+import sqlite3
+import tempfile
+import threading
+import time
+from pathlib import Path
+from .bbox_store import LazyBoundingBoxes
+
+# Order in which artifact types are dropped when the cache is over its size
+# budget. Markdown with its bounding boxes is the largest payload; extractions
+# are the smallest and the most expensive to recompute.
+EVICTION_PRIORITY = ["page_translation", "markdown", "translation", "extraction"]
+
+# Seconds between writes of buffered last-access times and hit/miss counters
+ACCESS_FLUSH_SECONDS = float(os.getenv("CACHE_ACCESS_FLUSH_SECONDS", "5"))
+
+# Types only useful together with another type of the same key. The markdown
+# stage is a hit only when both markdown and bounding boxes are cached, so they
+# are evicted as one unit.
+EVICTION_UNITS = {"bounding_box": "markdown"}
+
+def encode_payload(data):
+    """
+    Serialize a cache payload, returning (encoding, bytes). Lists of parsed
+    markdown documents and plain JSON data are stored as compact UTF-8 JSON,
+    bounding boxes keep their per-page compressed frame, and anything else
+    falls back to pickle.
+    """
+    if isinstance(data, LazyBoundingBoxes):
+        return "bounding-boxes", data.to_bytes()
+    if isinstance(data, list) and data and all(hasattr(doc, 'text') and hasattr(doc, 'metadata') for doc in data):
+        documents = [{"id": getattr(doc, 'id_', None), "text": doc.text, "metadata": doc.metadata} for doc in data]
+        try:
+            return "documents-json", json.dumps(documents, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        except (TypeError, ValueError):
+            pass
+    try:
+        return "json", json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    except (TypeError, ValueError):
+        return "pickle", pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+
+def decode_payload(encoding, payload):
+    """Deserialize a cache payload written by encode_payload"""
+    if encoding == "documents-json":
+        from llama_index.core import Document
+        return [
+            Document(text=doc["text"], metadata=doc["metadata"], **({"id_": doc["id"]} if doc["id"] else {}))
+            for doc in json.loads(payload)
+        ]
+    if encoding == "bounding-boxes":
+        return LazyBoundingBoxes.from_bytes(payload)
+    if encoding == "json":
+        return json.loads(payload)
+    if encoding == "pickle":
+        return pickle.loads(payload)
+    raise ValueError(f"Unknown cache payload encoding: {encoding}")
+
+class PickleDirectoryStore:
+    """
+    Original cache layout: one pickle file per (key, type) in a flat directory.
+    Writes go through a temporary file and an atomic rename.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        # Hit/miss counters are per process for this backend
+        self._counters = {}
+        self._counters_lock = threading.Lock()
+
+    def _path(self, cache_key, cache_type):
+        return self.cache_dir / f"{cache_key}_{cache_type}.pkl"
+
+    def _count(self, cache_type, hit):
+        with self._counters_lock:
+            counters = self._counters.setdefault(cache_type, {"hits": 0, "misses": 0})
+            counters["hits" if hit else "misses"] += 1
+
+    def load(self, cache_key, cache_type):
+        """Load an entry, or None when it does not exist"""
+        cache_file = self._path(cache_key, cache_type)
+        if not cache_file.exists():
+            self._count(cache_type, False)
+            return None
+        with open(cache_file, 'rb') as f:
+            data = pickle.load(f)
+        # The file's mtime doubles as the last-access time for LRU eviction
+        os.utime(cache_file)
+        self._count(cache_type, True)
+        return data
+
+    def save(self, cache_key, cache_type, data):
+        """Save an entry atomically"""
+        cache_file = self._path(cache_key, cache_type)
+        fd, temp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, cache_file)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            raise
+
+    def delete(self, cache_key, cache_type):
+        """Remove an entry if present"""
+        self._path(cache_key, cache_type).unlink(missing_ok=True)
+
+    def entries(self):
+        """List (cache_key, cache_type, size_bytes, accessed_at) for every entry"""
+        entries = []
+        for cache_file in self.cache_dir.glob("*_*.pkl"):
+            cache_key, _, cache_type = cache_file.stem.partition("_")
+            try:
+                stat = cache_file.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((cache_key, cache_type, stat.st_size, stat.st_mtime))
+        return entries
+
+    def hit_counters(self):
+        """Hit/miss counters per cache type"""
+        with self._counters_lock:
+            return {cache_type: dict(counters) for cache_type, counters in self._counters.items()}
+
+class SQLiteCacheStore:
+    """
+    Single indexed SQLite cache. Every entry keeps its serialization, size,
+    creation and last-access time. Writes are transactional, and WAL mode lets
+    the Streamlit app and batch runs share the store.
+    When legacy_dir is given, entries missing here are imported from the old
+    pickle-per-file cache on first access.
+    Reads do not write: last-access times and hit/miss counters are buffered
+    in memory and flushed at most every flush_seconds, before entries are
+    listed, and at exit.
+    """
+
+    def __init__(self, db_path, legacy_dir=None, flush_seconds=ACCESS_FLUSH_SECONDS):
+        self.db_path = str(db_path)
+        Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+        self.legacy_store = PickleDirectoryStore(legacy_dir) if legacy_dir else None
+        self._local = threading.local()
+        self.flush_seconds = flush_seconds
+        self._pending_lock = threading.Lock()
+        self._pending_accesses = {}
+        self._pending_counters = {}
+        self._last_flush = time.monotonic()
+        atexit.register(self.flush)
+        connection = self._connection()
+        connection.execute(
+            """CREATE TABLE IF NOT EXISTS cache_entries (
+                cache_key TEXT NOT NULL,
+                cache_type TEXT NOT NULL,
+                encoding TEXT NOT NULL,
+                payload BLOB NOT NULL,
+                size_bytes INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL,
+                PRIMARY KEY (cache_key, cache_type)
+            )"""
+        )
+        connection.execute("CREATE INDEX IF NOT EXISTS idx_cache_entries_accessed ON cache_entries (accessed_at)")
+        connection.execute(
+            """CREATE TABLE IF NOT EXISTS cache_stats (
+                cache_type TEXT PRIMARY KEY,
+                hits INTEGER NOT NULL DEFAULT 0,
+                misses INTEGER NOT NULL DEFAULT 0
+            )"""
+        )
+        connection.commit()
+
+    def _connection(self):
+        """Get this thread's connection to the store"""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.db_path, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def load(self, cache_key, cache_type):
+        """Load an entry, or None when it does not exist"""
+        row = self._connection().execute(
+            "SELECT encoding, payload FROM cache_entries WHERE cache_key = ? AND cache_type = ?",
+            (cache_key, cache_type)
+        ).fetchone()
+        if row is None:
+            data = self._import_legacy(cache_key, cache_type)
+            self._record(cache_type, data is not None)
+            return data
+
+        self._record(cache_type, True, cache_key)
+        if time.monotonic() - self._last_flush >= self.flush_seconds:
+            self.flush()
+        return decode_payload(row[0], row[1])
+
+    def _record(self, cache_type, hit, cache_key=None):
+        """Buffer a hit or miss, and the access time of a hit entry"""
+        with self._pending_lock:
+            counters = self._pending_counters.setdefault(cache_type, {"hits": 0, "misses": 0})
+            counters["hits" if hit else "misses"] += 1
+            if cache_key is not None:
+                self._pending_accesses[(cache_key, cache_type)] = time.time()
+
+    def flush(self):
+        """Write buffered last-access times and hit/miss counters in one transaction"""
+        with self._pending_lock:
+            accesses, self._pending_accesses = self._pending_accesses, {}
+            counters, self._pending_counters = self._pending_counters, {}
+            self._last_flush = time.monotonic()
+        if not accesses and not counters:
+            return
+
+        connection = self._connection()
+        with connection:
+            connection.executemany(
+                "UPDATE cache_entries SET accessed_at = MAX(accessed_at, ?) WHERE cache_key = ? AND cache_type = ?",
+                [(accessed_at, cache_key, cache_type) for (cache_key, cache_type), accessed_at in accesses.items()]
+            )
+            connection.executemany(
+                "INSERT INTO cache_stats (cache_type, hits, misses) VALUES (?, ?, ?) "
+                "ON CONFLICT(cache_type) DO UPDATE SET hits = hits + excluded.hits, misses = misses + excluded.misses",
+                [(cache_type, type_counters["hits"], type_counters["misses"]) for cache_type, type_counters in counters.items()]
+            )
+
+    def save(self, cache_key, cache_type, data):
+        """Save an entry in a single transaction"""
+        encoding, payload = encode_payload(data)
+        now = time.time()
+        connection = self._connection()
+        with connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO cache_entries "
+                "(cache_key, cache_type, encoding, payload, size_bytes, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (cache_key, cache_type, encoding, sqlite3.Binary(payload), len(payload), now, now)
+            )
+
+    def delete(self, cache_key, cache_type):
+        """Remove an entry if present"""
+        connection = self._connection()
+        with connection:
+            connection.execute(
+                "DELETE FROM cache_entries WHERE cache_key = ? AND cache_type = ?", (cache_key, cache_type)
+            )
+
+    def entries(self):
+        """List (cache_key, cache_type, size_bytes, accessed_at) for every entry"""
+        self.flush()
+        return self._connection().execute(
+            "SELECT cache_key, cache_type, size_bytes, accessed_at FROM cache_entries"
+        ).fetchall()
+
+    def hit_counters(self):
+        """Hit/miss counters per cache type"""
+        self.flush()
+        rows = self._connection().execute("SELECT cache_type, hits, misses FROM cache_stats").fetchall()
+        return {cache_type: {"hits": hits, "misses": misses} for cache_type, hits, misses in rows}
+
+    def vacuum(self):
+        """Return space freed by deleted entries to the filesystem"""
+        self._connection().execute("VACUUM")
+
+    def _import_legacy(self, cache_key, cache_type):
+        """Move an entry from the legacy pickle directory into the store"""
+        if self.legacy_store is None:
+            return None
+        data = self.legacy_store.load(cache_key, cache_type)
+        if data is not None:
+            self.save(cache_key, cache_type, data)
+            self.legacy_store.delete(cache_key, cache_type)
+        return data
+
+def create_cache_store(cache_dir, backend=None):
+    """Create the cache store selected by CACHE_BACKEND ('sqlite' or 'pickle')"""
+    backend = (backend or os.getenv("CACHE_BACKEND", "sqlite")).lower()
+    if backend == "pickle":
+        return PickleDirectoryStore(cache_dir)
+    if backend == "sqlite":
+        return SQLiteCacheStore(Path(cache_dir) / "cache.sqlite", legacy_dir=cache_dir)
+    raise ValueError(f"Unknown cache backend: {backend}")
+
+def evict(store, max_bytes=None, max_age_seconds=None, type_priority=EVICTION_PRIORITY, units=EVICTION_UNITS):
+    """
+    Evict cache entries. Entries not accessed within max_age_seconds are
+    removed first; then, while the store is larger than max_bytes, entries are
+    removed by type in type_priority order and least recently used first
+    within each type. Types mapped in units are removed together with the
+    entry of the same key they belong to. Returns a summary of what was removed.
+    """
+    groups = {}
+    for entry in store.entries():
+        groups.setdefault((entry[0], units.get(entry[1], entry[1])), []).append(entry)
+    # (unit type, size, last access, entries) for every eviction unit
+    candidates = [
+        (unit_type, sum(entry[2] for entry in group), max(entry[3] for entry in group), group)
+        for (_, unit_type), group in groups.items()
+    ]
+    now = time.time()
+    removed = []
+
+    if max_age_seconds is not None:
+        for candidate in candidates:
+            if now - candidate[2] > max_age_seconds:
+                removed.extend(candidate[3])
+        candidates = [candidate for candidate in candidates if now - candidate[2] <= max_age_seconds]
+
+    total_bytes = sum(candidate[1] for candidate in candidates)
+    if max_bytes is not None and total_bytes > max_bytes:
+        rank = {cache_type: index for index, cache_type in enumerate(type_priority)}
+        candidates.sort(key=lambda candidate: (rank.get(candidate[0], len(type_priority)), candidate[2]))
+        for candidate in candidates:
+            if total_bytes <= max_bytes:
+                break
+            removed.extend(candidate[3])
+            total_bytes -= candidate[1]
+
+    for cache_key, cache_type, _, _ in removed:
+        store.delete(cache_key, cache_type)
+
+    by_type = {}
+    for _, cache_type, size_bytes, _ in removed:
+        type_summary = by_type.setdefault(cache_type, {"entries": 0, "bytes": 0})
+        type_summary["entries"] += 1
+        type_summary["bytes"] += size_bytes
+    return {
+        "removed_entries": len(removed),
+        "removed_bytes": sum(entry[2] for entry in removed),
+        "by_type": by_type,
+    }
+
+def cache_stats(store):
+    """Report entry counts, bytes and hit/miss ratios per cache type"""
+    hit_counters = store.hit_counters()
+    by_type = {}
+    for _, cache_type, size_bytes, _ in store.entries():
+        type_stats = by_type.setdefault(cache_type, {"entries": 0, "bytes": 0})
+        type_stats["entries"] += 1
+        type_stats["bytes"] += size_bytes
+    for cache_type in set(by_type) | set(hit_counters):
+        type_stats = by_type.setdefault(cache_type, {"entries": 0, "bytes": 0})
+        counters = hit_counters.get(cache_type, {"hits": 0, "misses": 0})
+        lookups = counters["hits"] + counters["misses"]
+        type_stats.update(counters, hit_ratio=(counters["hits"] / lookups) if lookups else 0.0)
+
+    hits = sum(type_stats["hits"] for type_stats in by_type.values())
+    misses = sum(type_stats["misses"] for type_stats in by_type.values())
+    return {
+        "entries": sum(type_stats["entries"] for type_stats in by_type.values()),
+        "bytes": sum(type_stats["bytes"] for type_stats in by_type.values()),
+        "hits": hits,
+        "misses": misses,
+        "hit_ratio": (hits / (hits + misses)) if hits + misses else 0.0,
+        "by_type": by_type,
+    }
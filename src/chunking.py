@@ -0,0 +1,128 @@
+import os
+import re
+
+from .translation_memory import TABLE_ROW, TABLE_SEPARATOR
+
+# Pages longer than this many characters are translated in chunks
+TRANSLATION_CHUNK_CHARS = int(os.getenv("TRANSLATION_CHUNK_CHARS", "6000"))
+
+BLANK_LINES = re.compile(r"(\n[ \t]*\n(?:[ \t]*\n)*)")
+
+def table_header(lines, index):
+    """Header and separator lines of the table containing lines[index], or None outside a table"""
+    if not TABLE_ROW.match(lines[index]) and not TABLE_SEPARATOR.match(lines[index]):
+        return None
+    start = index
+    while start > 0 and (TABLE_ROW.match(lines[start - 1]) or TABLE_SEPARATOR.match(lines[start - 1])):
+        start -= 1
+    if start + 1 < len(lines) and TABLE_SEPARATOR.match(lines[start + 1]) and index > start + 1:
+        return lines[start:start + 2]
+    return None
+
+def split_block(block, max_chars):
+    """
+    Split one oversized block at line boundaries into (separator, text, header)
+    pieces. Rows of a table are grouped, and every group after the first
+    carries the table header so it can be translated on its own.
+    """
+    lines = block.split('\n')
+    pieces = []
+    current = []
+    current_header = None
+    size = 0
+    for index, line in enumerate(lines):
+        if current and size + len(line) + 1 > max_chars:
+            pieces.append(("\n" if pieces else "", '\n'.join(current), current_header))
+            header = table_header(lines, index)
+            current, current_header, size = [], header, sum(len(text) + 1 for text in header or [])
+        current.append(line)
+        size += len(line) + 1
+    if current:
+        pieces.append(("\n" if pieces else "", '\n'.join(current), current_header))
+    return pieces
+
+def split_markdown_chunks(markdown_text, max_chars=TRANSLATION_CHUNK_CHARS):
+    """
+    Split page markdown into chunks of at most about max_chars at safe
+    boundaries: blank lines between paragraphs first, then line boundaries
+    inside oversized blocks, never inside a table row. Returns a list of
+    {'separator', 'text', 'header'} dicts; separator is the original text
+    before the chunk and header the repeated table header, if any.
+    """
+    parts = BLANK_LINES.split(markdown_text)
+    pieces = []
+    separator = ""
+    for index, part in enumerate(parts):
+        if index % 2:
+            separator = part
+            continue
+        if len(part) > max_chars:
+            block_pieces = split_block(part, max_chars)
+            first_separator, text, header = block_pieces[0]
+            pieces.append((separator + first_separator, text, header))
+            pieces.extend(block_pieces[1:])
+        else:
+            pieces.append((separator, part, None))
+        separator = ""
+
+    chunks = []
+    for separator, text, header in pieces:
+        header_size = sum(len(line) + 1 for line in header or [])
+        if chunks and not header and len(chunks[-1]['text']) + len(separator) + len(text) + \
+                sum(len(line) + 1 for line in chunks[-1]['header'] or []) <= max_chars:
+            chunks[-1]['text'] += separator + text
+        elif chunks and header and chunks[-1]['header'] == header and \
+                len(chunks[-1]['text']) + len(separator) + len(text) + header_size <= max_chars:
+            chunks[-1]['text'] += separator + text
+        else:
+            chunks.append({'separator': separator, 'text': text, 'header': header})
+    return chunks
+
+def chunk_prompt_text(chunk):
+    """Text sent to the translator for a chunk, with its table header repeated"""
+    if chunk['header']:
+        return '\n'.join(chunk['header']) + '\n' + chunk['text']
+    return chunk['text']
+
+def column_count(line):
+    """Number of cells in a markdown table row or separator"""
+    return line.strip().strip('|').count('|') + 1
+
+def strip_repeated_header(translated_text, header):
+    """
+    Remove the translated copy of a repeated table header from a chunk
+    translation. The header is only removed when the response starts with table
+    rows followed by a separator of the header's width; otherwise the
+    translation is returned unchanged rather than dropping lines blindly.
+    """
+    lines = translated_text.split('\n')
+    columns = column_count(header[-1])
+    for index, line in enumerate(lines[:len(header) + 2]):
+        if TABLE_SEPARATOR.match(line):
+            rows = [row for row in lines[:index] if row.strip()]
+            if rows and all(TABLE_ROW.match(row) for row in rows) and column_count(line) == columns:
+                return '\n'.join(lines[index + 1:])
+            break
+    return translated_text
+
+def stitch_chunks(chunks, translations):
+    """Join chunk translations with the original separators between them"""
+    output = []
+    for chunk, translated_text in zip(chunks, translations):
+        if chunk['header']:
+            translated_text = strip_repeated_header(translated_text, chunk['header'])
+        output.append(chunk['separator'] + translated_text)
+    return "".join(output)
+
+def group_segments(segments, max_chars=TRANSLATION_CHUNK_CHARS):
+    """Split a list of segments into consecutive groups of at most about max_chars"""
+    groups = []
+    size = 0
+    for segment in segments:
+        if groups and size + len(segment) <= max_chars:
+            groups[-1].append(segment)
+            size += len(segment)
+        else:
+            groups.append([segment])
+            size = len(segment)
+    return groups
@@ -0,0 +1,76 @@
+import os
+import threading
+
+from .azure_parser import AzureInvoiceParser
+from .backends import HEDGE_AFTER_SECONDS, PARSE_BACKENDS, FailoverParser
+from .llama_parser import LlamaInvoiceParser
+from .translation import MarkdownTranslator
+
+# Process-wide client instances, shared by Streamlit sessions and batch workers
+_clients = {}
+_clients_lock = threading.Lock()
+_warm_up_thread = None
+
+# Resolve the extraction agent and open connections at startup; set WARM_UP_CLIENTS=false to skip
+WARM_UP_ENABLED = os.getenv("WARM_UP_CLIENTS", "true").lower() != "false"
+
+def get_client(name, factory):
+    """Return the shared client registered under name, creating it on first use"""
+    client = _clients.get(name)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(name)
+            if client is None:
+                client = factory()
+                _clients[name] = client
+    return client
+
+def get_llama_parser():
+    """Return the shared LlamaInvoiceParser"""
+    return get_client("llama_parser", LlamaInvoiceParser)
+
+def get_translator():
+    """Return the shared MarkdownTranslator"""
+    return get_client("translator", MarkdownTranslator)
+
+def get_azure_parser():
+    """Return the shared AzureInvoiceParser"""
+    return get_client("azure_parser", AzureInvoiceParser)
+
+def get_invoice_parser():
+    """
+    Return the shared parser for the app and batch runs: LlamaInvoiceParser,
+    wrapped in a FailoverParser when PARSE_BACKENDS lists several backends or
+    hedging is enabled
+    """
+    if PARSE_BACKENDS == ["llama"] and not HEDGE_AFTER_SECONDS:
+        return get_llama_parser()
+
+    def create():
+        factories = {"llama": get_llama_parser, "azure": get_azure_parser}
+        unknown = [name for name in PARSE_BACKENDS if name not in factories]
+        if unknown:
+            raise Exception(f"Unknown parse backend(s): {', '.join(unknown)}. Use llama or azure.")
+        return FailoverParser([(name, factories[name]()) for name in PARSE_BACKENDS], get_llama_parser())
+    return get_client("invoice_parser", create)
+
+def warm_up_clients():
+    """Resolve the extraction agent and open translation connections, returning any errors by client"""
+    errors = {}
+    for name, get in [("llama_parser", get_llama_parser), ("translator", get_translator)]:
+        try:
+            get().warm_up()
+        except Exception as e:
+            errors[name] = str(e)
+    return errors
+
+def start_warm_up():
+    """Run warm_up_clients once per process on a background thread"""
+    global _warm_up_thread
+    if not WARM_UP_ENABLED:
+        return None
+    with _clients_lock:
+        if _warm_up_thread is None:
+            _warm_up_thread = threading.Thread(target=warm_up_clients, name="client-warm-up", daemon=True)
+            _warm_up_thread.start()
+    return _warm_up_thread
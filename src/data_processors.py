@@ -2,6 +2,7 @@ import pandas as pd
 from datetime import datetime
 import io
 import json
+from .bbox_store import bounding_boxes_to_json
 
 def convert_to_csv_data(extracted_data):
     """Convert extracted data to CSV-ready format"""
@@ -194,7 +195,7 @@ def create_comprehensive_csv_data(invoice_filename, extracted_data, bounding_box
         "Markdown_Text": markdown_text,
         "Translated_Text": translated_text,
         "Extracted_JSON": json.dumps(extracted_data, indent=2) if extracted_data else "",
-        "Bounding_Box_JSON": json.dumps(bounding_box_data, indent=2) if bounding_box_data else ""
+        "Bounding_Box_JSON": bounding_boxes_to_json(bounding_box_data, indent=2) if bounding_box_data else ""
     }]
     
     return pd.DataFrame(csv_data) 
\ No newline at end of file
@@ -0,0 +1,180 @@
+import json
+import re
+import sqlite3
+import threading
+import time
+
+from .fingerprint import FingerprintIndex, minhash
+from .templates import document_text, normalize_text
+
+WORD_PATTERN = re.compile(r"\w+", re.UNICODE)
+NUMBER_PATTERN = re.compile(r"\d[\d.,' ]*\d|\d")
+SHINGLE_SIZE = 3
+# Share of printed numbers a near duplicate must have in common; amounts, dates and IDs must match
+NUMBER_MIN_SIMILARITY = 0.9
+
+def text_tokens(markdown_data):
+    """Word 3-shingles of the whole document, ignoring case, markup and spacing"""
+    words = WORD_PATTERN.findall(document_text(markdown_data).lower())
+    if len(words) < SHINGLE_SIZE:
+        return set(words)
+    return {" ".join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+def number_tokens(markdown_data):
+    """Every number printed on the document, with separators removed so 1.190,00 and 1190.00 agree"""
+    return {re.sub(r"\D", "", match) for match in NUMBER_PATTERN.findall(document_text(markdown_data))}
+
+def jaccard(left, right):
+    """Jaccard similarity of two sets"""
+    if not left and not right:
+        return 1.0
+    return len(left & right) / len(left | right)
+
+def semantic_key(extracted_data):
+    """
+    Key of vendor, invoice ID and total from an extraction, or None when
+    one of them is missing
+    """
+    if not extracted_data:
+        return None
+    vendor = normalize_text((extracted_data.get("Merchant Details") or {}).get("Name") or "").lower()
+    invoice_id = re.sub(r"[^0-9A-Z]", "", str((extracted_data.get("Invoice Details") or {}).get("Invoice ID") or "").upper())
+    total = (extracted_data.get("Financial Summary") or {}).get("Total Amount")
+    if not vendor or not invoice_id or total in (None, ""):
+        return None
+    try:
+        total = f"{float(total):.2f}"
+    except (TypeError, ValueError):
+        return None
+    return f"{vendor}|{invoice_id}|{total}"
+
+class DuplicateIndex:
+    """
+    Registry of processed invoices for duplicate detection. A new document
+    is checked in three steps: the same file hash, a near-identical text
+    (rescans and re-exports of the same invoice), and after extraction the
+    same vendor, invoice ID and total. A near-identical text is only a
+    suspicion until the extraction confirms it, since recurring invoices of
+    one vendor are near-identical too.
+    """
+
+    def __init__(self, db_path, min_similarity=0.8):
+        self.db_path = str(db_path)
+        self.min_similarity = min_similarity
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self.db_path, check_same_thread=False, timeout=30)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            """CREATE TABLE IF NOT EXISTS invoices (
+                file_hash TEXT PRIMARY KEY,
+                file_name TEXT,
+                numbers TEXT NOT NULL,
+                semantic_key TEXT,
+                created_at REAL NOT NULL
+            )"""
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS invoices_semantic_key ON invoices (semantic_key)")
+        self._connection.commit()
+        # Text signatures share the database file
+        self.signatures = FingerprintIndex(self.db_path)
+
+    def _invoice(self, file_hash):
+        with self._lock:
+            return self._connection.execute(
+                "SELECT file_hash, file_name, numbers, created_at FROM invoices WHERE file_hash = ?", (file_hash,)
+            ).fetchone()
+
+    @staticmethod
+    def _match(kind, row, similarity):
+        return {"kind": kind, "file_hash": row[0], "file_name": row[1], "similarity": similarity,
+                "processed_at": row[3]}
+
+    def find(self, file_hash, markdown_data, file_name=None):
+        """
+        Find an already processed invoice this document duplicates. Returns
+        {'kind', 'file_hash', 'file_name', 'similarity', 'processed_at'} with
+        kind 'exact' or 'suspected', or None. Pass a suspected match to
+        confirm after extraction.
+        """
+        row = self._invoice(file_hash)
+        if row is not None:
+            # Reprocessing the same file under the same name is not a new submission
+            if file_name is not None and row[1] == file_name:
+                return None
+            return self._match("exact", row, 1.0)
+
+        signature = minhash(text_tokens(markdown_data))
+        numbers = number_tokens(markdown_data)
+        for candidate in self.signatures.query(signature, top_k=5, min_similarity=self.min_similarity):
+            row = self._invoice(candidate["doc_id"])
+            if row is None:
+                continue
+            # Same wording is not enough: monthly invoices of one vendor differ only in a few numbers
+            if jaccard(numbers, set(json.loads(row[2]))) >= NUMBER_MIN_SIMILARITY:
+                return self._match("suspected", row, candidate["similarity"])
+        return None
+
+    def confirm(self, match, extracted_data):
+        """
+        Settle a suspected near duplicate with the new document's extraction:
+        a 'near' match when vendor, invoice ID and total equal the original's,
+        None when they differ, and the suspicion itself when either is unknown
+        """
+        key = semantic_key(extracted_data)
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT semantic_key FROM invoices WHERE file_hash = ?", (match["file_hash"],)
+            ).fetchone()
+        original_key = row[0] if row is not None else None
+        if key is None or original_key is None:
+            return match
+        return dict(match, kind="near") if key == original_key else None
+
+    def register(self, file_hash, markdown_data, extracted_data=None, file_name=None):
+        """
+        Record a processed invoice. Returns a 'semantic' match when another
+        invoice with the same vendor, invoice ID and total was registered
+        before this one, otherwise None.
+        """
+        key = semantic_key(extracted_data)
+        with self._lock:
+            row = None
+            if key is not None:
+                existing = self._connection.execute(
+                    "SELECT created_at FROM invoices WHERE file_hash = ?", (file_hash,)
+                ).fetchone()
+                # The first invoice with a key stays the original when a batch is run again
+                row = self._connection.execute(
+                    "SELECT file_hash, file_name, numbers, created_at FROM invoices "
+                    "WHERE semantic_key = ? AND file_hash != ? AND created_at < ? ORDER BY created_at LIMIT 1",
+                    (key, file_hash, existing[0] if existing else time.time())
+                ).fetchone()
+            self._connection.execute(
+                "INSERT INTO invoices (file_hash, file_name, numbers, semantic_key, created_at) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(file_hash) DO UPDATE SET semantic_key = COALESCE(excluded.semantic_key, semantic_key)",
+                (file_hash, file_name, json.dumps(sorted(number_tokens(markdown_data))), key, time.time())
+            )
+            self._connection.commit()
+        self.signatures.add(file_hash, minhash(text_tokens(markdown_data)))
+        return self._match("semantic", row, 1.0) if row is not None else None
+
+    def rename(self, file_hash, new_file_hash):
+        """Move a registered invoice to a new file hash, returning whether it was registered"""
+        with self._lock:
+            if self._connection.execute("SELECT 1 FROM invoices WHERE file_hash = ?", (new_file_hash,)).fetchone():
+                moved = self._connection.execute("DELETE FROM invoices WHERE file_hash = ?", (file_hash,)).rowcount > 0
+            else:
+                moved = self._connection.execute(
+                    "UPDATE invoices SET file_hash = ? WHERE file_hash = ?", (new_file_hash, file_hash)
+                ).rowcount > 0
+            self._connection.commit()
+        self.signatures.rename(file_hash, new_file_hash)
+        return moved
+
+    def stats(self):
+        """Report the number of registered invoices"""
+        with self._lock:
+            invoices, keyed = self._connection.execute(
+                "SELECT COUNT(*), COUNT(semantic_key) FROM invoices"
+            ).fetchone()
+        return {"invoices": invoices, "with_semantic_key": keyed}
@@ -21,6 +21,12 @@ def create_filename_with_task(original_filename, task_type, extension=None):
         return f"{base_filename}.{extension}"
     return base_filename
 
+def get_upload_size(uploaded_file):
+    """Size of an upload in bytes, without reading its contents"""
+    if hasattr(uploaded_file, 'size'):
+        return uploaded_file.size
+    return len(uploaded_file.getvalue())
+
 def validate_uploaded_file(uploaded_file, allowed_extensions=None):
     """Validate uploaded file type and size"""
     if uploaded_file is None:
@@ -36,7 +42,7 @@ def validate_uploaded_file(uploaded_file, allowed_extensions=None):
     
     # Check file size (optional - you can set a max size)
     max_size_mb = 50  # 50 MB limit
-    file_size_mb = len(uploaded_file.getvalue()) / (1024 * 1024)
+    file_size_mb = get_upload_size(uploaded_file) / (1024 * 1024)
     if file_size_mb > max_size_mb:
         return False, f"File size ({file_size_mb:.1f} MB) exceeds maximum allowed size ({max_size_mb} MB)"
     
@@ -61,12 +67,13 @@ def get_file_info(uploaded_file):
     if uploaded_file is None:
         return {}
     
+    size_bytes = get_upload_size(uploaded_file)
     return {
         "filename": uploaded_file.name,
         "original_name": extract_original_filename(uploaded_file),
         "extension": uploaded_file.name.split('.')[-1].lower(),
-        "size_bytes": len(uploaded_file.getvalue()),
-        "size_mb": len(uploaded_file.getvalue()) / (1024 * 1024),
+        "size_bytes": size_bytes,
+        "size_mb": size_bytes / (1024 * 1024),
         "mime_type": uploaded_file.type if hasattr(uploaded_file, 'type') else None
     }
 
@@ -0,0 +1,229 @@
+import hashlib
+import re
+import sqlite3
+import struct
+import threading
+import time
+
+from .bbox_store import LazyBoundingBoxes
+
+WORD_PATTERN = re.compile(r"[^\W\d_]{3,}", re.UNICODE)
+TABLE_ROW = re.compile(r"^\s*\|.*\|\s*$")
+
+# 16 bands of 4 rows: layouts with Jaccard similarity 0.7 collide in at least one band 99% of the time
+DEFAULT_BANDS = 16
+DEFAULT_ROWS = 4
+# Coarse grid laid over the first page for bounding-box tokens
+GRID_SIZE = 6
+
+MERSENNE_PRIME = (1 << 61) - 1
+MAX_HASH = (1 << 32) - 1
+
+def token_hash(token):
+    """Stable 32-bit hash of a token"""
+    return int.from_bytes(hashlib.blake2b(token.encode('utf-8'), digest_size=4).digest(), 'big')
+
+def permutations(count, seed=1):
+    """Deterministic (a, b) parameters for count MinHash permutations"""
+    parameters = []
+    for index in range(count):
+        digest = hashlib.blake2b(f"{seed}:{index}".encode('ascii'), digest_size=16).digest()
+        a, b = struct.unpack(">QQ", digest)
+        parameters.append(((a % (MERSENNE_PRIME - 1)) + 1, b % MERSENNE_PRIME))
+    return parameters
+
+PERMUTATIONS = permutations(DEFAULT_BANDS * DEFAULT_ROWS)
+
+def markdown_layout_tokens(markdown_data):
+    """
+    Tokens describing the printed labels of a document rather than its values:
+    word pairs per line, the first words of each line and table header cells.
+    Numbers are left out so invoices of one layout share their tokens.
+    """
+    tokens = set()
+    for page_index, doc in enumerate(markdown_data):
+        in_table = False
+        for line in doc.text.split('\n'):
+            words = [word.lower() for word in WORD_PATTERN.findall(line)]
+            if TABLE_ROW.match(line):
+                if not in_table:
+                    tokens.update(f"th:{word}" for word in words)
+                in_table = True
+            else:
+                in_table = False
+            if words:
+                tokens.add(f"line:{' '.join(words[:2])}")
+            tokens.update(f"w:{first} {second}" for first, second in zip(words, words[1:]))
+            if len(words) == 1:
+                tokens.add(f"w:{words[0]}")
+        if page_index == 0:
+            tokens.add(f"pages:{min(len(markdown_data), 5)}")
+    return tokens
+
+def grid_cell(x, y, width, height):
+    """Map a position to a coarse grid cell"""
+    column = min(GRID_SIZE - 1, max(0, int(x / width * GRID_SIZE)))
+    row = min(GRID_SIZE - 1, max(0, int(y / height * GRID_SIZE)))
+    return row, column
+
+def bounding_box_tokens(bounding_box_data):
+    """Tokens for which kinds of items occupy which cells of the first page"""
+    if bounding_box_data is None or len(bounding_box_data) == 0:
+        return set()
+    if isinstance(bounding_box_data, LazyBoundingBoxes):
+        page = bounding_box_data.page(0)
+    else:
+        page = (bounding_box_data.get("pages") or [{}])[0]
+
+    tokens = set()
+    width, height = page.get("width"), page.get("height")
+    if width and height:
+        for item in page.get("items") or []:
+            box = item.get("bBox") or {}
+            if box.get("x") is not None and box.get("y") is not None:
+                row, column = grid_cell(box["x"], box["y"], width, height)
+                tokens.add(f"grid:{item.get('type', '')}:{row}:{column}")
+    for item in page.get("layout") or []:
+        box = item.get("bbox") or {}
+        if box.get("x") is not None and box.get("y") is not None:
+            # Layout boxes are given relative to the page
+            row, column = grid_cell(box["x"], box["y"], 1.0, 1.0)
+            tokens.add(f"layout:{item.get('label', '')}:{row}:{column}")
+    return tokens
+
+def layout_tokens(markdown_data, bounding_box_data=None):
+    """All layout tokens of a parsed document"""
+    return markdown_layout_tokens(markdown_data) | bounding_box_tokens(bounding_box_data)
+
+def minhash(tokens, parameters=PERMUTATIONS):
+    """MinHash signature of a token set"""
+    hashes = [token_hash(token) for token in tokens]
+    if not hashes:
+        return [MAX_HASH] * len(parameters)
+    return [min(((a * value + b) % MERSENNE_PRIME) & MAX_HASH for value in hashes) for a, b in parameters]
+
+def layout_fingerprint(markdown_data, bounding_box_data=None):
+    """MinHash signature of a document's layout, as returned by LlamaInvoiceParser.pdf_to_markdown"""
+    return minhash(layout_tokens(markdown_data, bounding_box_data))
+
+def signature_similarity(left, right):
+    """Estimated Jaccard similarity of two signatures"""
+    return sum(1 for a, b in zip(left, right) if a == b) / len(left)
+
+def pack_signature(signature):
+    """Store a signature as a compact blob"""
+    return struct.pack(f">{len(signature)}I", *signature)
+
+def unpack_signature(blob):
+    """Read a signature written by pack_signature"""
+    return list(struct.unpack(f">{len(blob) // 4}I", blob))
+
+class FingerprintIndex:
+    """
+    Persistent locality-sensitive hash index over layout signatures. Each
+    signature is split into bands and every band is stored as one indexed
+    integer key, so a lookup is a single indexed query for the candidates
+    followed by an exact similarity check on the few that collide.
+    """
+
+    def __init__(self, db_path, bands=DEFAULT_BANDS, rows=DEFAULT_ROWS):
+        self.db_path = str(db_path)
+        self.bands = bands
+        self.rows = rows
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            """CREATE TABLE IF NOT EXISTS fingerprints (
+                doc_id TEXT PRIMARY KEY,
+                label TEXT,
+                signature BLOB NOT NULL,
+                created_at REAL NOT NULL
+            )"""
+        )
+        # Clustered on band_key, so a lookup reads the colliding documents without touching the table rows
+        self._connection.execute(
+            """CREATE TABLE IF NOT EXISTS fingerprint_bands (
+                band_key INTEGER NOT NULL,
+                doc_id TEXT NOT NULL,
+                PRIMARY KEY (band_key, doc_id)
+            ) WITHOUT ROWID"""
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS fingerprint_bands_doc ON fingerprint_bands (doc_id)")
+        self._connection.commit()
+
+    def band_keys(self, signature):
+        """One signed 64-bit key per band"""
+        keys = []
+        for band in range(self.bands):
+            rows = signature[band * self.rows:(band + 1) * self.rows]
+            digest = hashlib.blake2b(struct.pack(f">I{len(rows)}I", band, *rows), digest_size=8).digest()
+            keys.append(int.from_bytes(digest, 'big', signed=True))
+        return keys
+
+    def add(self, doc_id, signature, label=None):
+        """Add or replace the signature of a document"""
+        with self._lock:
+            with self._connection:
+                self._connection.execute("DELETE FROM fingerprint_bands WHERE doc_id = ?", (doc_id,))
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO fingerprints (doc_id, label, signature, created_at) VALUES (?, ?, ?, ?)",
+                    (doc_id, label, pack_signature(signature), time.time())
+                )
+                self._connection.executemany(
+                    "INSERT OR IGNORE INTO fingerprint_bands (band_key, doc_id) VALUES (?, ?)",
+                    [(key, doc_id) for key in self.band_keys(signature)]
+                )
+
+    def rename(self, doc_id, new_doc_id):
+        """Move a document's signature to a new id, returning whether there was one"""
+        with self._lock:
+            with self._connection:
+                if self._connection.execute("SELECT 1 FROM fingerprints WHERE doc_id = ?", (new_doc_id,)).fetchone():
+                    # Already indexed under the new id; the old entry is stale
+                    self._connection.execute("DELETE FROM fingerprint_bands WHERE doc_id = ?", (doc_id,))
+                    return self._connection.execute("DELETE FROM fingerprints WHERE doc_id = ?", (doc_id,)).rowcount > 0
+                self._connection.execute("UPDATE fingerprint_bands SET doc_id = ? WHERE doc_id = ?", (new_doc_id, doc_id))
+                return self._connection.execute(
+                    "UPDATE fingerprints SET doc_id = ? WHERE doc_id = ?", (new_doc_id, doc_id)
+                ).rowcount > 0
+
+    def query(self, signature, top_k=5, min_similarity=0.0, max_candidates=32):
+        """
+        Return up to top_k {'doc_id', 'label', 'similarity'} dicts for the
+        most similar indexed documents, best first. Only the max_candidates
+        documents sharing the most bands are compared exactly.
+        """
+        keys = self.band_keys(signature)
+        placeholders = ",".join("?" * len(keys))
+        with self._lock:
+            rows = self._connection.execute(
+                f"""SELECT f.doc_id, f.label, f.signature FROM fingerprints f
+                    JOIN (SELECT doc_id, COUNT(*) AS shared FROM fingerprint_bands
+                          WHERE band_key IN ({placeholders}) GROUP BY doc_id
+                          ORDER BY shared DESC LIMIT ?) c ON c.doc_id = f.doc_id""",
+                keys + [max_candidates]
+            ).fetchall()
+        matches = []
+        for doc_id, label, blob in rows:
+            similarity = signature_similarity(signature, unpack_signature(blob))
+            if similarity >= min_similarity:
+                matches.append({'doc_id': doc_id, 'label': label, 'similarity': similarity})
+        matches.sort(key=lambda match: match['similarity'], reverse=True)
+        return matches[:top_k]
+
+    def top_labels(self, signature, top_k=5, min_similarity=0.0):
+        """Distinct labels of the closest documents, best first"""
+        labels = []
+        for match in self.query(signature, top_k * 4, min_similarity):
+            if match['label'] and match['label'] not in labels:
+                labels.append(match['label'])
+        return labels[:top_k]
+
+    def stats(self):
+        """Report the number of indexed documents and distinct labels"""
+        with self._lock:
+            documents, labels = self._connection.execute(
+                "SELECT COUNT(*), COUNT(DISTINCT label) FROM fingerprints"
+            ).fetchone()
+        return {"documents": documents, "labels": labels}
@@ -0,0 +1,115 @@
+import hashlib
+import os
+from pathlib import Path
+
+# Content hash of invoice files; the algorithm name is part of every cache key
+FILE_HASH_ALGORITHM = os.getenv("FILE_HASH_ALGORITHM", "sha256").lower()
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# Keys written before algorithms were recorded are bare MD5 hex digests
+LEGACY_HASH_ALGORITHM = "md5"
+
+def new_hasher(algorithm=None):
+    """Create a hashlib object for a file hash algorithm"""
+    algorithm = algorithm or FILE_HASH_ALGORITHM
+    if algorithm == "blake2b":
+        return hashlib.blake2b(digest_size=32)
+    return hashlib.new(algorithm)
+
+def format_file_hash(algorithm, hexdigest):
+    """Cache key for a digest, e.g. sha256-<hex>; legacy MD5 keys keep their bare form"""
+    if algorithm == LEGACY_HASH_ALGORITHM:
+        return hexdigest
+    return f"{algorithm}-{hexdigest}"
+
+def file_hash_algorithm(file_hash):
+    """Algorithm a cache key was computed with"""
+    algorithm, separator, _ = file_hash.partition("-")
+    return algorithm if separator else LEGACY_HASH_ALGORITHM
+
+class StreamingHasher:
+    """
+    File hash updated chunk by chunk. Several algorithms can be computed in
+    the same pass, e.g. the legacy MD5 next to the current algorithm while
+    migrating cache keys.
+    """
+
+    def __init__(self, algorithms=None):
+        self.algorithms = algorithms or [FILE_HASH_ALGORITHM]
+        self._hashers = [new_hasher(algorithm) for algorithm in self.algorithms]
+
+    def update(self, chunk):
+        for hasher in self._hashers:
+            hasher.update(chunk)
+
+    def update_buffer(self, data, chunk_size=HASH_CHUNK_SIZE):
+        """Hash bytes, a bytearray or a memoryview in chunks, without copying it"""
+        view = memoryview(data)
+        for offset in range(0, len(view), chunk_size):
+            self.update(view[offset:offset + chunk_size])
+
+    def file_hashes(self):
+        """Return {algorithm: cache key}"""
+        return {
+            algorithm: format_file_hash(algorithm, hasher.hexdigest())
+            for algorithm, hasher in zip(self.algorithms, self._hashers)
+        }
+
+    def file_hash(self):
+        """Cache key of the first algorithm"""
+        return self.file_hashes()[self.algorithms[0]]
+
+def hash_bytes(data, algorithm=None):
+    """Cache key for file contents already in memory"""
+    hasher = StreamingHasher([algorithm or FILE_HASH_ALGORITHM])
+    hasher.update_buffer(data)
+    return hasher.file_hash()
+
+def hash_file(path, algorithms=None, chunk_size=HASH_CHUNK_SIZE):
+    """Hash a file from disk in fixed-size chunks, with constant memory. Returns {algorithm: cache key}"""
+    hasher = StreamingHasher(algorithms)
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    with open(path, 'rb', buffering=0) as f:
+        while True:
+            read = f.readinto(buffer)
+            if not read:
+                break
+            hasher.update(view[:read])
+    return hasher.file_hashes()
+
+class InvoiceFile:
+    """
+    Invoice contents read once and hashed once. Pass the object around instead
+    of re-reading the upload or the file for its size, hash or viewer.
+    """
+
+    def __init__(self, name, content, file_hash):
+        self.name = name
+        self.content = content
+        self.file_hash = file_hash
+
+    @property
+    def size(self):
+        return len(self.content)
+
+    @property
+    def size_mb(self):
+        return self.size / (1024 * 1024)
+
+    @classmethod
+    def from_bytes(cls, name, content, algorithm=None):
+        return cls(name, content, hash_bytes(content, algorithm))
+
+    @classmethod
+    def from_path(cls, path, algorithm=None):
+        """Read a file with a single read and hash the buffer in chunks"""
+        path = Path(path)
+        with open(path, 'rb') as f:
+            content = f.read()
+        return cls.from_bytes(path.name, content, algorithm)
+
+    @classmethod
+    def from_upload(cls, uploaded_file, algorithm=None):
+        """Wrap a Streamlit upload; getvalue() shares the uploaded buffer rather than copying it"""
+        return cls.from_bytes(uploaded_file.name, uploaded_file.getvalue(), algorithm)
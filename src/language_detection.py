@@ -0,0 +1,119 @@
+import re
+
+# Frequent function words plus common invoice vocabulary per ISO 639-1 code.
+# Words shared by several languages are kept in each profile; they simply
+# narrow the margin instead of deciding the result.
+STOPWORD_PROFILES = {
+    'en': {
+        'the', 'and', 'of', 'to', 'for', 'with', 'on', 'at', 'by', 'from', 'this', 'that', 'is', 'are',
+        'be', 'will', 'please', 'your', 'our', 'you', 'we', 'not', 'or', 'as', 'an', 'all', 'per',
+        'invoice', 'date', 'due', 'amount', 'total', 'subtotal', 'tax', 'vat', 'quantity', 'price',
+        'description', 'payment', 'terms', 'bill', 'customer', 'number', 'unit', 'account', 'bank',
+        'thank', 'business', 'order', 'balance', 'net', 'gross', 'paid', 'days', 'item', 'items',
+    },
+    'de': {
+        'der', 'die', 'das', 'und', 'ist', 'nicht', 'mit', 'von', 'für', 'auf', 'dem', 'den', 'des',
+        'ein', 'eine', 'einer', 'zu', 'im', 'wir', 'sie', 'ihre', 'ihr', 'bitte', 'bis', 'oder', 'bei',
+        'rechnung', 'rechnungsnummer', 'rechnungsdatum', 'datum', 'betrag', 'gesamtbetrag', 'summe',
+        'zwischensumme', 'mwst', 'ust', 'umsatzsteuer', 'mehrwertsteuer', 'steuer', 'menge', 'preis',
+        'einzelpreis', 'beschreibung', 'bezeichnung', 'zahlung', 'zahlbar', 'innerhalb', 'tagen',
+        'kunde', 'kundennummer', 'netto', 'brutto', 'vielen', 'dank', 'leistung', 'anzahl', 'stück',
+        'lieferung', 'zahlungsbedingungen', 'bankverbindung', 'gesamt', 'position', 'fällig',
+    },
+    'fr': {
+        'le', 'la', 'les', 'de', 'et', 'des', 'du', 'à', 'un', 'une', 'est', 'pour', 'avec', 'dans', 'sur',
+        'par', 'au', 'aux', 'vous', 'nous', 'votre', 'notre', 'pas', 'ou', 'ce', 'cette', 'qui', 'que',
+        'facture', 'numéro', 'montant', 'tva', 'quantité', 'prix', 'unitaire', 'désignation',
+        'paiement', 'règlement', 'échéance', 'client', 'jours', 'merci', 'total', 'ht', 'ttc', 'remise',
+        'taux', 'somme', 'livraison', 'conditions', 'référence', 'date',
+    },
+    'es': {
+        'el', 'la', 'los', 'las', 'y', 'de', 'del', 'en', 'un', 'una', 'es', 'por', 'para', 'con', 'que',
+        'se', 'su', 'sus', 'al', 'lo', 'como', 'más', 'o', 'nuestro', 'usted',
+        'factura', 'fecha', 'importe', 'iva', 'cantidad', 'precio', 'unitario', 'descripción', 'pago',
+        'vencimiento', 'cliente', 'días', 'gracias', 'total', 'subtotal', 'impuesto', 'base', 'imponible',
+        'forma', 'concepto', 'número',
+    },
+    'it': {
+        'il', 'lo', 'la', 'gli', 'le', 'e', 'di', 'del', 'della', 'dei', 'delle', 'un', 'una', 'è',
+        'per', 'con', 'che', 'non', 'da', 'al', 'alla', 'nel', 'sono', 'vostro', 'nostro',
+        'fattura', 'data', 'importo', 'iva', 'quantità', 'prezzo', 'unitario', 'descrizione',
+        'pagamento', 'scadenza', 'cliente', 'giorni', 'grazie', 'totale', 'imponibile', 'aliquota',
+        'sconto', 'numero', 'partita',
+    },
+    'nl': {
+        'de', 'het', 'een', 'en', 'van', 'is', 'niet', 'met', 'voor', 'op', 'aan', 'te', 'dat', 'die',
+        'bij', 'uw', 'ons', 'wij', 'u', 'of', 'naar', 'zijn', 'worden',
+        'factuur', 'factuurnummer', 'factuurdatum', 'datum', 'bedrag', 'totaal', 'btw', 'aantal', 'prijs',
+        'omschrijving', 'betaling', 'vervaldatum', 'klant', 'dagen', 'bedankt', 'subtotaal', 'excl',
+        'incl', 'betalingstermijn', 'rekening',
+    },
+    'pt': {
+        'o', 'a', 'os', 'as', 'e', 'de', 'do', 'da', 'dos', 'das', 'em', 'no', 'na', 'um', 'uma', 'para',
+        'com', 'por', 'que', 'não', 'se', 'ao', 'seu', 'sua',
+        'fatura', 'data', 'valor', 'iva', 'quantidade', 'preço', 'unitário', 'descrição', 'pagamento',
+        'vencimento', 'cliente', 'dias', 'obrigado', 'total', 'imposto', 'número', 'desconto',
+    },
+}
+
+WORD_PATTERN = re.compile(r"[^\W\d_]+", re.UNICODE)
+
+# Number of stopword hits at which the detector trusts its own confidence fully
+MIN_EVIDENCE = 8
+# Stopword hits another language needs over an expected one to count as different on thin evidence
+MIN_MARGIN = 3
+
+class StopwordLanguageDetector:
+    """
+    Offline language detector based on stopword profiles. Returns an ISO 639-1
+    code together with a confidence between 0 and 1, so callers can fall back
+    to a remote model when the text is too short or too mixed to call.
+    """
+
+    def __init__(self, profiles=None, min_evidence=MIN_EVIDENCE):
+        self.profiles = profiles or STOPWORD_PROFILES
+        self.min_evidence = min_evidence
+
+    def score(self, text):
+        """Count stopword hits per language"""
+        scores = {language: 0 for language in self.profiles}
+        for word in WORD_PATTERN.findall(text.lower()):
+            for language, stopwords in self.profiles.items():
+                if word in stopwords:
+                    scores[language] += 1
+        return scores
+
+    def detect(self, text):
+        """
+        Detect the language of the given text, returning (language, confidence).
+        language is None when no stopword matched at all.
+        """
+        scores = self.score(text)
+        total_hits = sum(scores.values())
+        if total_hits == 0:
+            return None, 0.0
+
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        best_language, best_hits = ranked[0]
+        runner_up_hits = ranked[1][1] if len(ranked) > 1 else 0
+
+        # Margin over the runner-up, scaled down while evidence is thin
+        margin = (best_hits - runner_up_hits) / best_hits
+        evidence = min(1.0, best_hits / self.min_evidence)
+        return best_language, margin * evidence
+
+    def differs_from(self, text, language, min_confidence, min_margin=MIN_MARGIN):
+        """
+        Check whether text is clearly in a language other than the given one:
+        the best match reaches min_confidence, or leads the given language by
+        min_margin stopword hits. Ties, thin evidence and text without
+        stopwords do not count.
+        """
+        detected, confidence = self.detect(text)
+        language = language.lower()
+        if detected is None or detected == language:
+            return False
+        if confidence >= min_confidence:
+            return True
+        scores = self.score(text)
+        return scores[detected] - scores.get(language, 0) >= min_margin
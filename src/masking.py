@@ -0,0 +1,50 @@
+import os
+import re
+
+from .translation_memory import HAS_LETTERS
+
+# Replace numbers, identifiers and links with placeholders before translation
+TRANSLATION_MASKING = os.getenv("TRANSLATION_MASKING", "true").lower() != "false"
+
+PLACEHOLDER = re.compile(r"\{\{(\d+)\}\}")
+
+# Links and e-mail addresses, then any token containing a digit: amounts, dates, IBANs, tax and
+# invoice IDs. Digit groups separated by single spaces (IBANs, phone numbers) become one token.
+NUMERIC_TOKEN = r"(?:[^\W_]+[-/.])*[^\W_]*\d(?:[\w./\-:,+']*[^\W_])?"
+MASKED_TOKEN = re.compile(
+    r"(?:https?://|www\.)[^\s)\]>]*[^\s)\]>.,;:!?]|[\w.+-]+@[\w-]+\.[\w.-]*\w"
+    rf"|{NUMERIC_TOKEN}(?:[ \u00a0](?=[^\W_]*\d){NUMERIC_TOKEN})*",
+    re.UNICODE
+)
+
+def mask_text(text):
+    """
+    Replace masked tokens with {{n}} placeholders. Returns (masked_text, values)
+    where values[n - 1] is the original of placeholder n. Text that already
+    contains placeholder-like markup is left as is.
+    """
+    if PLACEHOLDER.search(text):
+        return text, []
+    values = []
+
+    def replace(match):
+        values.append(match.group(0))
+        return f"{{{{{len(values)}}}}}"
+
+    return MASKED_TOKEN.sub(replace, text), values
+
+def unmask_text(text, values):
+    """
+    Put the original values back. Returns None when a placeholder was lost,
+    duplicated or invented, so the caller can fall back.
+    """
+    if not values:
+        return text
+    found = sorted(int(number) for number in PLACEHOLDER.findall(text))
+    if found != list(range(1, len(values) + 1)):
+        return None
+    return PLACEHOLDER.sub(lambda match: values[int(match.group(1)) - 1], text)
+
+def needs_translation(masked_text):
+    """Check whether anything besides placeholders, punctuation and spacing is left to translate"""
+    return bool(HAS_LETTERS.search(PLACEHOLDER.sub("", masked_text)))
@@ -0,0 +1,202 @@
+import functools
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Serve /metrics (Prometheus text format) and /metrics.json on this local port; empty disables the endpoint
+METRICS_PORT = os.getenv("METRICS_PORT", "").strip()
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+
+# Upper bounds in seconds; remote calls range from milliseconds (cache) to minutes (large parse jobs)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+METRIC_HELP = {
+    "invoice_stage_seconds": "Latency of pipeline stages",
+    "invoice_stage_errors_total": "Pipeline stage calls that raised",
+    "cache_operation_seconds": "Latency of disk cache loads and saves",
+    "cache_requests_total": "Disk cache lookups by result",
+    "language_detections_total": "Language detections by detector",
+    "llm_tokens_total": "Tokens reported by the OpenAI-compatible API",
+    "remote_request_seconds": "Latency of single remote request attempts",
+    "remote_request_errors_total": "Remote request attempts that failed",
+}
+
+_metrics = None
+_metrics_lock = threading.Lock()
+_server = None
+
+def label_key(labels):
+    """Hashable, ordered form of a label dict"""
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+def format_labels(key, extra=None):
+    """Prometheus label set, e.g. {stage="detect_language",le="0.5"}"""
+    pairs = list(key) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    escaped = (
+        f'{name}="' + value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+        for name, value in pairs
+    )
+    return "{" + ",".join(escaped) + "}"
+
+class MetricsRegistry:
+    """
+    In-process counters and latency histograms keyed by metric name and
+    labels. Updates take one lock and a dict lookup, so instrumented calls
+    add microseconds to requests that take hundreds of milliseconds.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._counters = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def increment(self, name, amount=1, **labels):
+        key = label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        key = label_key(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = {"buckets": [0] * len(self.buckets), "count": 0, "sum": 0.0}
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram["buckets"][index] += 1
+                    break
+            histogram["count"] += 1
+            histogram["sum"] += value
+
+    def snapshot(self):
+        """
+        Return {'counters': {name: [{'labels', 'value'}]}, 'histograms':
+        {name: [{'labels', 'count', 'sum', 'buckets'}]}} with cumulative buckets
+        """
+        with self._lock:
+            counters = {name: dict(series) for name, series in self._counters.items()}
+            histograms = {
+                name: {key: {"buckets": list(h["buckets"]), "count": h["count"], "sum": h["sum"]}
+                       for key, h in series.items()}
+                for name, series in self._histograms.items()
+            }
+        snapshot = {"counters": {}, "histograms": {}}
+        for name, series in sorted(counters.items()):
+            snapshot["counters"][name] = [{"labels": dict(key), "value": value} for key, value in sorted(series.items())]
+        for name, series in sorted(histograms.items()):
+            entries = []
+            for key, histogram in sorted(series.items()):
+                cumulative, running = {}, 0
+                for bound, count in zip(self.buckets, histogram["buckets"]):
+                    running += count
+                    cumulative[str(bound)] = running
+                cumulative["+Inf"] = histogram["count"]
+                entries.append({"labels": dict(key), "count": histogram["count"], "sum": histogram["sum"],
+                                "buckets": cumulative})
+            snapshot["histograms"][name] = entries
+        return snapshot
+
+    def render_prometheus(self):
+        """Render all metrics in the Prometheus text exposition format"""
+        snapshot = self.snapshot()
+        lines = []
+        for name, entries in snapshot["counters"].items():
+            lines += [f"# HELP {name} {METRIC_HELP.get(name, name)}", f"# TYPE {name} counter"]
+            for entry in entries:
+                lines.append(f"{name}{format_labels(label_key(entry['labels']))} {entry['value']}")
+        for name, entries in snapshot["histograms"].items():
+            lines += [f"# HELP {name} {METRIC_HELP.get(name, name)}", f"# TYPE {name} histogram"]
+            for entry in entries:
+                key = label_key(entry["labels"])
+                for bound, count in entry["buckets"].items():
+                    lines.append(f"{name}_bucket{format_labels(key, ('le', bound))} {count}")
+                lines.append(f"{name}_sum{format_labels(key)} {entry['sum']}")
+                lines.append(f"{name}_count{format_labels(key)} {entry['count']}")
+        return "\n".join(lines) + "\n"
+
+    def dump_json(self, path):
+        """Write a snapshot to a JSON file"""
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.snapshot(), f, indent=2)
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+def get_metrics():
+    """Get the process-wide metrics registry"""
+    global _metrics
+    with _metrics_lock:
+        if _metrics is None:
+            _metrics = MetricsRegistry()
+    return _metrics
+
+def timed(stage, **labels):
+    """
+    Decorator recording the latency of each call as invoice_stage_seconds
+    and failures as invoice_stage_errors_total
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            except Exception:
+                get_metrics().increment("invoice_stage_errors_total", stage=stage, **labels)
+                raise
+            finally:
+                get_metrics().observe("invoice_stage_seconds", time.perf_counter() - start, stage=stage, **labels)
+        return wrapper
+    return decorator
+
+def record_token_usage(model, usage):
+    """Count prompt and completion tokens from an OpenAI usage object"""
+    if usage is None:
+        return
+    metrics = get_metrics()
+    for kind in ("prompt_tokens", "completion_tokens"):
+        value = getattr(usage, kind, None)
+        if value:
+            metrics.increment("llm_tokens_total", value, model=model, kind=kind.replace("_tokens", ""))
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        path = self.path.split("?", 1)[0]
+        if path == "/metrics":
+            body = get_metrics().render_prometheus().encode("utf-8")
+            content_type = "text/plain; version=0.0.4; charset=utf-8"
+        elif path == "/metrics.json":
+            body = json.dumps(get_metrics().snapshot()).encode("utf-8")
+            content_type = "application/json"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Scrapes every few seconds would flood the console
+        pass
+
+def start_metrics_server(port=METRICS_PORT, host=METRICS_HOST):
+    """Serve metrics from a background thread, once per process; does nothing without a port"""
+    global _server
+    if not port:
+        return None
+    with _metrics_lock:
+        if _server is None:
+            _server = ThreadingHTTPServer((host, int(port)), MetricsHandler)
+            threading.Thread(target=_server.serve_forever, name="metrics-server", daemon=True).start()
+    return _server
@@ -0,0 +1,258 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .batch import new_result_record
+from .cache_manager import (
+    load_from_cache,
+    save_to_cache,
+    get_language_sample,
+    page_language_differs,
+    translate_page,
+    combine_translation_results,
+    extract_with_template,
+    learn_extraction_template,
+    check_duplicate,
+    register_processed_invoice
+)
+from .hashing import InvoiceFile
+from .routing import SPECULATIVE_EXTRACTION, choose_extraction_route, needs_translation, run_extraction
+
+class AsyncInvoicePipeline:
+    """
+    Asyncio pipeline that runs parse -> detect -> translate -> extract for many
+    invoices at once. Each stage has its own semaphore so a slow provider only
+    throttles its own stage, and parsing of one invoice overlaps translation of
+    another.
+    """
+
+    def __init__(self, llama_parser, translator, parse_concurrency=4, detect_concurrency=8,
+                 translate_concurrency=8, extract_concurrency=4, max_in_flight=32,
+                 page_workers=None, per_page_language=False):
+        self.llama_parser = llama_parser
+        self.translator = translator
+        # Pages of one invoice translated at once (None: only the translate stage limit applies)
+        self.page_workers = page_workers
+        # Detect every page on its own instead of screening pages against the document language
+        self.per_page_language = per_page_language
+        self.limits = {
+            "parse": parse_concurrency,
+            "detect": detect_concurrency,
+            "translate": translate_concurrency,
+            "extract": extract_concurrency,
+        }
+        # Bounds how many invoices hold file contents and intermediate results at once
+        self.max_in_flight = max_in_flight
+        self.semaphores = None
+
+    async def _limited(self, stage, coro):
+        """Await a coroutine while holding the semaphore of its stage"""
+        async with self.semaphores[stage]:
+            return await coro
+
+    async def markdown(self, file_content, file_hash):
+        """Load markdown and bounding boxes from disk cache or parse the PDF"""
+        cached_markdown = await asyncio.to_thread(load_from_cache, file_hash, "markdown")
+        cached_bounding_box = await asyncio.to_thread(load_from_cache, file_hash, "bounding_box")
+        if cached_markdown is not None and cached_bounding_box is not None:
+            return cached_markdown, cached_bounding_box, True
+
+        markdown_data, bounding_box_data = await self._limited(
+            "parse", self.llama_parser.apdf_to_markdown(file_content)
+        )
+        await asyncio.to_thread(save_to_cache, file_hash, "markdown", markdown_data)
+        await asyncio.to_thread(save_to_cache, file_hash, "bounding_box", bounding_box_data)
+        return markdown_data, bounding_box_data, False
+
+    async def translate_page(self, markdown_text, source_language, page_slots=None):
+        """Translate one page whose language was already resolved, reusing the page cache"""
+        if page_slots is not None:
+            async with page_slots:
+                return await self.translate_page(markdown_text, source_language)
+        if source_language.lower() == 'en':
+            return {
+                'source_language': source_language,
+                'translated_text': markdown_text,
+                'was_translated': False,
+                'llm_calls': 0
+            }
+
+        # Page cache and translation memory lookups happen inside translate_page
+        return await self._limited(
+            "translate", asyncio.to_thread(translate_page, self.translator, markdown_text, source_language)
+        )
+
+    async def detect_page(self, markdown_text, document_language):
+        """Detect one page on its own when the local screen disagrees with the document language"""
+        # Without a document language the page is always detected; the screen is CPU work, so it
+        # runs off the event loop
+        if document_language is not None and not await asyncio.to_thread(
+            page_language_differs, self.translator, markdown_text, document_language
+        ):
+            return document_language, 0
+        language, detection_source = await self._limited(
+            "detect", self.translator.adetect_language_with_source(markdown_text)
+        )
+        return language, 1 if detection_source == 'llm' else 0
+
+    async def detect(self, markdown_data):
+        """
+        Detect the document language once and screen every page for another
+        language, returning (languages, detection_calls)
+        """
+        if self.per_page_language:
+            detections = await asyncio.gather(*(self.detect_page(doc.text, None) for doc in markdown_data))
+            return [language for language, _ in detections], sum(calls for _, calls in detections)
+
+        sample = get_language_sample(markdown_data)
+        document_language, detection_source = await self._limited(
+            "detect", self.translator.adetect_language_with_source(sample)
+        )
+        # The sample page was already detected with the document
+        detections = await asyncio.gather(*(
+            self.detect_page(doc.text, document_language) for doc in markdown_data if doc.text != sample
+        ))
+        page_languages = iter(language for language, _ in detections)
+        languages = [document_language if doc.text == sample else next(page_languages) for doc in markdown_data]
+        detection_calls = (1 if detection_source == 'llm' else 0) + sum(calls for _, calls in detections)
+        return languages, detection_calls
+
+    async def translation(self, markdown_data, file_hash, detected=None):
+        """Load translation data from disk cache or translate all pages concurrently"""
+        cached_data = await asyncio.to_thread(load_from_cache, file_hash, "translation")
+        if cached_data is not None:
+            return cached_data, True
+
+        # One document-level detection and a local screen per page, then every page is translated concurrently
+        if detected is None:
+            detected = await self.detect(markdown_data)
+        languages, detection_calls = detected
+        page_slots = asyncio.Semaphore(self.page_workers) if self.page_workers else None
+        translation_results = await asyncio.gather(
+            *(self.translate_page(doc.text, language, page_slots) for doc, language in zip(markdown_data, languages))
+        )
+        translation_data = combine_translation_results(list(translation_results), languages[0], detection_calls)
+        await asyncio.to_thread(save_to_cache, file_hash, "translation", translation_data)
+        return translation_data, False
+
+    async def route(self, markdown_data, file_hash):
+        """Choose the extraction route, returning (route, detected) with detected reusable by translation"""
+        cached_translation = await asyncio.to_thread(load_from_cache, file_hash, "translation")
+        if cached_translation is not None:
+            languages = [result['source_language'] for result in cached_translation['results']]
+            return choose_extraction_route(languages, len(markdown_data)), None
+        detected = await self.detect(markdown_data)
+        return choose_extraction_route(detected[0], len(markdown_data)), detected
+
+    async def extraction(self, route, file_content, markdown_data, translation_text, file_hash, bounding_box_data=None):
+        """Extract structured data from the input selected by route and store it, returning (extracted_data, seconds)"""
+        start = time.perf_counter()
+        extracted_data = await self._limited(
+            "extract",
+            asyncio.to_thread(run_extraction, route, self.llama_parser, file_content, markdown_data, translation_text)
+        )
+        seconds = time.perf_counter() - start
+        await asyncio.to_thread(learn_extraction_template, markdown_data, extracted_data, bounding_box_data, file_hash)
+        await asyncio.to_thread(save_to_cache, file_hash, "extraction", extracted_data)
+        return extracted_data, seconds
+
+    async def process(self, path):
+        """Run the full pipeline for one invoice and return its result record"""
+        record = new_result_record(path)
+        extraction_task = None
+        try:
+            # Read and hashed once, off the event loop
+            invoice_file = await asyncio.to_thread(InvoiceFile.from_path, path)
+            file_content = invoice_file.content
+            file_hash = invoice_file.file_hash
+            record["file_hash"] = file_hash
+
+            start = time.perf_counter()
+            markdown_data, bounding_box_data, was_cached = await self.markdown(file_content, file_hash)
+            record["timings"]["markdown"] = time.perf_counter() - start
+            record["cached"]["markdown"] = was_cached
+            if not markdown_data:
+                raise Exception("No markdown data could be generated from the invoice")
+            record["page_count"] = len(markdown_data)
+
+            # A near duplicate is only suspected until the extraction confirms it
+            record["duplicate"] = await asyncio.to_thread(check_duplicate, file_hash, markdown_data, path.name)
+
+            # Extraction that does not need the translation starts now and runs alongside it
+            start = time.perf_counter()
+            cached_extraction = await asyncio.to_thread(load_from_cache, file_hash, "extraction")
+            extraction_seconds = time.perf_counter() - start
+            detected = None
+            if cached_extraction is None:
+                # Known vendor layouts are extracted locally and stored like any other extraction
+                start = time.perf_counter()
+                cached_extraction = await asyncio.to_thread(extract_with_template, markdown_data, bounding_box_data)
+                extraction_seconds = time.perf_counter() - start
+                if cached_extraction is not None:
+                    record["extraction_route"] = "template"
+                    await asyncio.to_thread(save_to_cache, file_hash, "extraction", cached_extraction)
+            if cached_extraction is None:
+                route, detected = await self.route(markdown_data, file_hash)
+                record["extraction_route"] = route
+                if SPECULATIVE_EXTRACTION and not needs_translation(route):
+                    extraction_task = asyncio.create_task(
+                        self.extraction(route, file_content, markdown_data, None, file_hash, bounding_box_data)
+                    )
+
+            start = time.perf_counter()
+            translation_data, was_cached = await self.translation(markdown_data, file_hash, detected)
+            record["timings"]["translation"] = time.perf_counter() - start
+            record["cached"]["translation"] = was_cached
+            record["source_language"] = translation_data['source_language']
+            record["llm_calls"] = translation_data.get('llm_calls')
+            record["page_cache"] = translation_data.get('page_cache')
+            record["translation_memory"] = translation_data.get('translation_memory')
+
+            if cached_extraction is not None:
+                extracted_data = cached_extraction
+            elif extraction_task is not None:
+                start = time.perf_counter()
+                extracted_data, extraction_seconds = await extraction_task
+                record["extraction_wait"] = time.perf_counter() - start
+            else:
+                extracted_data, extraction_seconds = await self.extraction(
+                    route, file_content, markdown_data, translation_data['combined_text'], file_hash, bounding_box_data
+                )
+            # Only the extraction itself; waiting for one that ran alongside translation is reported apart
+            record["timings"]["extraction"] = extraction_seconds
+            record["cached"]["extraction"] = cached_extraction is not None and record["extraction_route"] != "template"
+            record["extracted_data"] = extracted_data
+
+            record["duplicate"] = await asyncio.to_thread(
+                register_processed_invoice, file_hash, markdown_data, extracted_data, path.name, record["duplicate"]
+            )
+
+        except Exception as e:
+            if extraction_task is not None and not extraction_task.done():
+                extraction_task.cancel()
+            record["status"] = "error"
+            record["error"] = str(e)
+
+        return record
+
+    async def run(self, paths, on_record=None):
+        """Process all invoices concurrently, calling on_record as each one finishes"""
+        self.semaphores = {stage: asyncio.Semaphore(limit) for stage, limit in self.limits.items()}
+
+        # Blocking SDK calls run in worker threads, so size the pool to the stage limits
+        loop = asyncio.get_running_loop()
+        loop.set_default_executor(ThreadPoolExecutor(max_workers=sum(self.limits.values()) + 4))
+
+        in_flight = asyncio.Semaphore(self.max_in_flight)
+
+        async def process_limited(path):
+            async with in_flight:
+                return await self.process(path)
+
+        records = []
+        for next_record in asyncio.as_completed([process_limited(path) for path in paths]):
+            record = await next_record
+            records.append(record)
+            if on_record:
+                on_record(record)
+        return records
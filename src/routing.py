@@ -0,0 +1,72 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROUTES = ["markdown", "pdf", "translation"]
+
+# auto picks a route per document; translation, markdown or pdf force one route for every document
+EXTRACTION_ROUTING = os.getenv("EXTRACTION_ROUTING", "auto").lower()
+
+# Non-English documents up to this many pages are extracted straight from the PDF (0 disables).
+# Off by default until direct extraction has been compared with the translated route on real invoices.
+DIRECT_EXTRACTION_MAX_PAGES = int(os.getenv("DIRECT_EXTRACTION_MAX_PAGES", "0"))
+
+# Start extraction while pages are still being translated when the route does not need the translation
+SPECULATIVE_EXTRACTION = os.getenv("SPECULATIVE_EXTRACTION", "true").lower() != "false"
+_extraction_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("SPECULATIVE_EXTRACTION_WORKERS", "4")), thread_name_prefix="extraction"
+)
+
+def choose_extraction_route(source_languages, page_count, routing=None, max_direct_pages=None):
+    """
+    Pick the input for structured extraction: 'markdown' (original parsed
+    markdown), 'pdf' (direct PDF extraction) or 'translation' (translated
+    markdown)
+    """
+    routing = routing or EXTRACTION_ROUTING
+    if routing in ROUTES:
+        return routing
+    if max_direct_pages is None:
+        max_direct_pages = DIRECT_EXTRACTION_MAX_PAGES
+
+    # English documents gain nothing from the translation hop
+    if all(language.lower() == 'en' for language in source_languages):
+        return "markdown"
+    if page_count <= max_direct_pages:
+        return "pdf"
+    return "translation"
+
+def needs_translation(route):
+    """Check whether extraction on this route has to wait for the translation"""
+    return route == "translation"
+
+def combine_markdown_text(markdown_data):
+    """Join parsed pages the same way translated pages are joined"""
+    return "".join(doc.text + '\n\n' for doc in markdown_data)
+
+def run_extraction(route, llama_parser, file_content=None, markdown_data=None, translation_text=None):
+    """Run structured extraction on the input selected by route"""
+    if route == "pdf":
+        return llama_parser.parse_invoice(file_content)
+    if route == "markdown":
+        return llama_parser.extract_from_text(combine_markdown_text(markdown_data))
+    return llama_parser.extract_from_text(translation_text)
+
+def start_extraction(route, llama_parser, file_content, markdown_data, timing=None):
+    """
+    Start extraction in the background when the route does not depend on the
+    translation. Returns a Future, or None when extraction has to wait. The
+    time from submit to finish is stored in timing['seconds'].
+    """
+    if not SPECULATIVE_EXTRACTION or needs_translation(route):
+        return None
+    submitted = time.perf_counter()
+
+    def extract():
+        try:
+            return run_extraction(route, llama_parser, file_content, markdown_data)
+        finally:
+            if timing is not None:
+                timing['seconds'] = time.perf_counter() - submitted
+
+    return _extraction_executor.submit(extract)
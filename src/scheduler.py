@@ -0,0 +1,228 @@
+import email.utils
+import os
+import random
+import threading
+import time
+
+from .metrics import get_metrics
+
+# Per-provider limits: "key=rpm,tpm,concurrency" entries separated by ";", e.g.
+# "llamaparse=60rpm;openai:mistralai/mistral-medium-3=300rpm,400000tpm,8concurrent"
+RATE_LIMITS = os.getenv("RATE_LIMITS", "")
+REQUEST_MAX_RETRIES = int(os.getenv("REQUEST_MAX_RETRIES", "5"))
+REQUEST_BACKOFF_SECONDS = float(os.getenv("REQUEST_BACKOFF_SECONDS", "1"))
+REQUEST_MAX_BACKOFF_SECONDS = float(os.getenv("REQUEST_MAX_BACKOFF_SECONDS", "60"))
+
+RETRYABLE_STATUS_CODES = {408, 409, 425, 429, 500, 502, 503, 504, 529}
+RETRYABLE_MESSAGES = ("rate limit", "too many requests", "timed out", "timeout", "temporarily unavailable",
+                      "connection reset", "connection aborted", "overloaded")
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+def parse_rate_limits(spec):
+    """Parse a RATE_LIMITS string into {key: {'rpm', 'tpm', 'concurrency'}}"""
+    limits = {}
+    for entry in spec.split(";"):
+        if "=" not in entry:
+            continue
+        key, _, values = entry.rpartition("=")
+        limit = {"rpm": None, "tpm": None, "concurrency": None}
+        for value in values.split(","):
+            value = value.strip().lower()
+            for suffix, name in (("rpm", "rpm"), ("tpm", "tpm"), ("concurrent", "concurrency")):
+                if value.endswith(suffix):
+                    limit[name] = float(value[:-len(suffix)])
+        limits[key.strip()] = limit
+    return limits
+
+def error_status_code(error):
+    """HTTP status code of a provider error, if it carries one"""
+    for candidate in (error, getattr(error, "response", None)):
+        status_code = getattr(candidate, "status_code", None) or getattr(candidate, "status", None)
+        if isinstance(status_code, int):
+            return status_code
+    return None
+
+def is_retryable(error):
+    """Check whether a failed request is worth retrying: rate limits, server errors and dropped connections"""
+    status_code = error_status_code(error)
+    if status_code is not None:
+        return status_code in RETRYABLE_STATUS_CODES
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    name = type(error).__name__
+    if name in ("APIConnectionError", "APITimeoutError", "ServiceRequestError", "ServiceResponseError",
+                "ConnectError", "ReadTimeout", "ConnectTimeout", "RemoteProtocolError"):
+        return True
+    message = str(error).lower()
+    return "429" in message or any(text in message for text in RETRYABLE_MESSAGES)
+
+def retry_after_seconds(error):
+    """Delay requested by the provider through a Retry-After header, or None"""
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    if not headers:
+        return None
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        retry_at = email.utils.parsedate_to_datetime(value)
+        return max(0.0, retry_at.timestamp() - time.time()) if retry_at else None
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously at rate_per_minute. Reservations may
+    run the bucket into debt: each caller is told how long to wait, so
+    waiting callers are served in arrival order without polling. The default
+    capacity allows one second's worth of burst, which keeps callers under
+    providers that enforce their limits over short windows.
+    """
+
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else max(1.0, self.rate)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def reserve(self, amount=1):
+        """Take amount tokens and return the seconds to wait before using them"""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.tokens -= amount
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def adjust(self, amount):
+        """Return (positive) or charge (negative) tokens once the actual cost is known"""
+        with self._lock:
+            self.tokens = min(self.capacity, self.tokens + amount)
+
+class RequestScheduler:
+    """
+    Central gate for remote calls. Each provider/model key gets optional
+    requests-per-minute and tokens-per-minute buckets and a concurrency cap;
+    calls wait their turn, and rate limits, server errors and dropped
+    connections are retried with jittered exponential backoff. A 429 pauses
+    the whole key, so concurrent workers back off together.
+    """
+
+    def __init__(self, limits=None, max_retries=REQUEST_MAX_RETRIES, backoff_seconds=REQUEST_BACKOFF_SECONDS,
+                 max_backoff_seconds=REQUEST_MAX_BACKOFF_SECONDS):
+        self.limits = parse_rate_limits(RATE_LIMITS) if limits is None else limits
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self._keys = {}
+        self._lock = threading.Lock()
+
+    def _state(self, key):
+        with self._lock:
+            if key not in self._keys:
+                limit = self.limits.get(key, {})
+                self._keys[key] = {
+                    "requests": TokenBucket(limit["rpm"]) if limit.get("rpm") else None,
+                    "tokens": TokenBucket(limit["tpm"]) if limit.get("tpm") else None,
+                    "slots": threading.BoundedSemaphore(int(limit["concurrency"])) if limit.get("concurrency") else None,
+                    "paused_until": 0.0,
+                    "stats": {"calls": 0, "retries": 0, "failures": 0, "rate_limited": 0, "waited_seconds": 0.0},
+                    "lock": threading.Lock(),
+                }
+            return self._keys[key]
+
+    def _count(self, state, name, amount=1):
+        with state["lock"]:
+            state["stats"][name] += amount
+
+    def _wait_for_capacity(self, state, estimated_tokens):
+        with state["lock"]:
+            wait = max(0.0, state["paused_until"] - time.monotonic())
+        if state["requests"] is not None:
+            wait = max(wait, state["requests"].reserve(1))
+        if state["tokens"] is not None and estimated_tokens:
+            wait = max(wait, state["tokens"].reserve(estimated_tokens))
+        if wait > 0:
+            self._count(state, "waited_seconds", wait)
+            time.sleep(wait)
+
+    def backoff(self, attempt, error=None):
+        """Delay before retry number attempt: the provider's Retry-After, or full-jitter exponential backoff"""
+        retry_after = retry_after_seconds(error) if error is not None else None
+        if retry_after is not None:
+            return min(retry_after, self.max_backoff_seconds)
+        return random.uniform(0, min(self.max_backoff_seconds, self.backoff_seconds * 2 ** attempt))
+
+    def call(self, key, function, *args, estimated_tokens=0, usage=None, **kwargs):
+        """
+        Run function(*args, **kwargs) under the limits of key, retrying
+        transient failures. usage(result) may return the tokens actually
+        used, to correct the estimate.
+        """
+        state = self._state(key)
+        attempt = 0
+        while True:
+            self._wait_for_capacity(state, estimated_tokens)
+            if state["slots"] is not None:
+                state["slots"].acquire()
+            start = time.perf_counter()
+            try:
+                self._count(state, "calls")
+                result = function(*args, **kwargs)
+            except Exception as e:
+                get_metrics().increment("remote_request_errors_total", key=key, retryable=str(is_retryable(e)).lower())
+                if attempt >= self.max_retries or not is_retryable(e):
+                    self._count(state, "failures")
+                    raise
+                delay = self.backoff(attempt, e)
+                if error_status_code(e) == 429 or "rate limit" in str(e).lower():
+                    self._count(state, "rate_limited")
+                    with state["lock"]:
+                        state["paused_until"] = max(state["paused_until"], time.monotonic() + delay)
+                self._count(state, "retries")
+                attempt += 1
+            else:
+                if usage is not None and state["tokens"] is not None:
+                    used = usage(result)
+                    if used is not None:
+                        state["tokens"].adjust(estimated_tokens - used)
+                return result
+            finally:
+                get_metrics().observe("remote_request_seconds", time.perf_counter() - start, key=key)
+                if state["slots"] is not None:
+                    state["slots"].release()
+            time.sleep(delay)
+
+    def stats(self):
+        """Per-key call, retry and wait counters"""
+        with self._lock:
+            states = dict(self._keys)
+        stats = {}
+        for key, state in states.items():
+            with state["lock"]:
+                stats[key] = dict(state["stats"])
+        return stats
+
+def get_scheduler():
+    """Get the process-wide request scheduler"""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = RequestScheduler()
+    return _scheduler
+
+def estimate_tokens(*texts):
+    """Rough token count of prompt texts, about four characters per token"""
+    return sum(len(text) for text in texts) // 4 + 1
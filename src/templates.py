@@ -0,0 +1,636 @@
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+from .models import InvoiceData
+
+# (section, label, parent model field, model field) for every scalar in the extraction output
+SCALAR_FIELDS = [
+    ("Invoice Classification", "Invoice Category", None, "invoice_category"),
+    ("Invoice Classification", "Invoice Type", None, "invoice_type"),
+    ("Invoice Classification", "Purchase Order Number", None, "purchase_order_number"),
+    ("Merchant Details", "Name", "merchant", "name"),
+    ("Merchant Details", "Business Unit", "merchant", "business_unit"),
+    ("Merchant Details", "Tax Reg #", "merchant", "tax_reg_number"),
+    ("Merchant Details", "Tax Payer ID", "merchant", "tax_payer_id"),
+    ("Merchant Details", "Bank Account #", "merchant", "bank_account_number"),
+    ("Merchant Details", "IBAN #", "merchant", "iban_number"),
+    ("Merchant Details", "Address Line 1", "merchant", "address_line_1"),
+    ("Merchant Details", "City", "merchant", "city"),
+    ("Merchant Details", "Country", "merchant", "country"),
+    ("Merchant Details", "Post Code", "merchant", "post_code"),
+    ("Merchant Details", "Email", "merchant", "email"),
+    ("Bill To Details", "Name", "bill_to", "name"),
+    ("Bill To Details", "Business Unit", "bill_to", "business_unit"),
+    ("Bill To Details", "Tax Reg #", "bill_to", "tax_reg_number"),
+    ("Bill To Details", "Tax Payer ID", "bill_to", "tax_payer_id"),
+    ("Bill To Details", "Address Line 1", "bill_to", "address_line_1"),
+    ("Bill To Details", "City", "bill_to", "city"),
+    ("Bill To Details", "Country", "bill_to", "country"),
+    ("Bill To Details", "Post Code", "bill_to", "post_code"),
+    ("Bill To Details", "Email", "bill_to", "email"),
+    ("Invoice Details", "Invoice ID", None, "invoice_id"),
+    ("Invoice Details", "Invoice Date", None, "invoice_date"),
+    ("Invoice Details", "Due Date", None, "due_date"),
+    ("Invoice Details", "Invoice Period Start", None, "invoice_period_start"),
+    ("Invoice Details", "Invoice Period End", None, "invoice_period_end"),
+    ("Invoice Details", "Currency", None, "currency"),
+    ("Invoice Details", "Payment Terms", None, "payment_terms"),
+    ("Invoice Details", "Cost Center Code", None, "cost_center_code"),
+    ("Financial Summary", "Total Amount", None, "total_amount"),
+    ("Financial Summary", "Net Amount", None, "net_amount"),
+    ("Financial Summary", "Tax Amount", None, "tax_amount"),
+    ("Financial Summary", "Roundoff Amount", None, "roundoff_amount"),
+    ("Financial Summary", "Gross Amount", None, "gross_amount"),
+]
+
+ITEM_FIELDS = [
+    ("Description", "description"),
+    ("Business Line", "business_line"),
+    ("Quantity", "quantity"),
+    ("Unit Price", "unit_price"),
+    ("Tax Rate", "tax_rate"),
+    ("Tax Amount", "tax_amount"),
+    ("Gross Amount", "gross_amount"),
+    ("Net Amount", "net_amount"),
+    ("Discount", "discount"),
+    ("Cost Center Code", "cost_center_code"),
+    ("With Holding Rate", "with_holding_rate"),
+    ("Description Country Language", "description_country_language"),
+]
+
+TAX_LINE_FIELDS = [
+    ("Tax Rate", "tax_rate"),
+    ("Tax Amount", "tax_amount"),
+    ("Gross Amount", "gross_amount"),
+    ("Net Amount", "net_amount"),
+]
+
+# Vendor and customer details are usually printed the same way on every invoice
+CONSTANT_FIRST_SECTIONS = {"Merchant Details", "Bill To Details"}
+
+NUMBER_PATTERN = re.compile(r"-?\d{1,3}(?:[.,' ]\d{3})+(?:[.,]\d+)?|-?\d+(?:[.,]\d+)?")
+DATE_FORMATS = ["%Y-%m-%d", "%d.%m.%Y", "%d/%m/%Y", "%m/%d/%Y", "%d-%m-%Y", "%d.%m.%y", "%d/%m/%y", "%Y/%m/%d"]
+DATE_FORMAT_PATTERNS = {"%d": r"\d{1,2}", "%m": r"\d{1,2}", "%Y": r"\d{4}", "%y": r"\d{2}"}
+MAX_ANCHOR_LENGTH = 60
+
+# Returned by read_scalar when a field cannot be found, since None is a valid extracted value
+MISSING = object()
+
+def document_text(markdown_data):
+    """Join parsed markdown pages into one text"""
+    return "\n\n".join(doc.text for doc in markdown_data)
+
+def normalize_text(value):
+    """Collapse whitespace for comparisons"""
+    return " ".join(str(value).split())
+
+def is_number(value):
+    """Check for numeric (non-boolean) values"""
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def is_empty(value):
+    """Check for the empty values used by the extraction output"""
+    return value is None or value == '' or value == []
+
+def detect_decimal_separator(text):
+    """Guess whether a document writes decimals as 1,50 or 1.50"""
+    commas = len(re.findall(r"\d,\d{2}(?!\d)", text))
+    points = len(re.findall(r"\d\.\d{2}(?!\d)", text))
+    return "," if commas > points else "."
+
+def parse_number(token, decimal):
+    """Parse a number token such as 1.234,56 or 1,234.56"""
+    token = token.replace(" ", "").replace("'", "")
+    thousands = "." if decimal == "," else ","
+    if decimal in token and thousands in token:
+        token = token.replace(thousands, "")
+    elif thousands in token:
+        # A single separator followed by exactly three digits is a thousands separator
+        whole, _, fraction = token.rpartition(thousands)
+        token = token.replace(thousands, "") if len(fraction) == 3 or token.count(thousands) > 1 else f"{whole}.{fraction}"
+    return float(token.replace(decimal, "."))
+
+def numbers_equal(left, right):
+    """Compare amounts to the cent"""
+    return abs(float(left) - float(right)) < 0.005
+
+def value_shape(value):
+    """Build a regex matching strings shaped like value, e.g. RE-2024-001 -> [A-Za-z]+-\\d+-\\d+"""
+    parts = []
+    for run in re.finditer(r"\d+|[^\W\d_]+|\s+|.", value):
+        text = run.group()
+        if text.isdigit():
+            parts.append(r"\d+")
+        elif text.isspace():
+            parts.append(r"\s+")
+        elif re.fullmatch(r"[^\W\d_]+", text):
+            parts.append(r"[^\W\d_]+")
+        else:
+            parts.append(re.escape(text))
+    return "".join(parts)
+
+def date_variants(value):
+    """Return (output_format, text_format, rendered) for every way a date value may be printed"""
+    for output_format in DATE_FORMATS:
+        try:
+            parsed = datetime.strptime(value, output_format)
+        except (TypeError, ValueError):
+            continue
+        return [(output_format, text_format, parsed.strftime(text_format)) for text_format in DATE_FORMATS]
+    return []
+
+def date_pattern(text_format):
+    """Regex for dates printed with a strftime format"""
+    pattern = re.escape(text_format)
+    for directive, regex in DATE_FORMAT_PATTERNS.items():
+        pattern = pattern.replace(directive, regex)
+    return pattern
+
+def label_before(line, position):
+    """Return the label text in front of a value on the same line or table row, if any"""
+    prefix = line[:position].rstrip(" \t:|-=#*")
+    # Labels end at their last letter, so amounts printed before the value are not part of them
+    label = re.search(r"^.*[^\W\d_]", prefix.split("|")[-1].strip(" \t:*#"))
+    if not label:
+        return None
+    return label.group()[-MAX_ANCHOR_LENGTH:]
+
+def anchor_lines(lines, anchor):
+    """Indices of lines containing an anchor"""
+    return [index for index, line in enumerate(lines) if anchor in line]
+
+def locate_anchor(lines, line_index, position):
+    """
+    Find a stable anchor for a value at lines[line_index][position]: the label
+    in front of it, otherwise the closest non-empty line above. Returns
+    (anchor, where, occurrence, segment_start) or None.
+    """
+    line = lines[line_index]
+    label = label_before(line, position)
+    if label:
+        occurrence = anchor_lines(lines, label).index(line_index)
+        return label, "same_line", occurrence, line.index(label) + len(label)
+    for above in range(line_index - 1, -1, -1):
+        if lines[above].strip():
+            label = lines[above].strip()[-MAX_ANCHOR_LENGTH:]
+            if not re.search(r"[^\W\d_]", label):
+                return None
+            occurrence = anchor_lines(lines, label).index(above)
+            return label, "next_line", occurrence, 0
+    return None
+
+def value_segment(lines, rule):
+    """Return the text following a rule's anchor, or None when the anchor is missing"""
+    matches = anchor_lines(lines, rule["anchor"])
+    if len(matches) <= rule["occurrence"]:
+        return None
+    line_index = matches[rule["occurrence"]]
+    if rule["where"] == "same_line":
+        line = lines[line_index]
+        return line[line.index(rule["anchor"]) + len(rule["anchor"]):]
+    for below in range(line_index + 1, len(lines)):
+        if lines[below].strip():
+            return lines[below]
+    return None
+
+def learn_scalar(lines, value, decimal):
+    """Learn how to read one scalar value from a document, or return None"""
+    for line_index, line in enumerate(lines):
+        candidates = []
+        if is_number(value):
+            for match in NUMBER_PATTERN.finditer(line):
+                try:
+                    if numbers_equal(parse_number(match.group(), decimal), value):
+                        candidates.append((match.start(), "number", None, None))
+                except ValueError:
+                    continue
+        else:
+            text = normalize_text(value)
+            for output_format, text_format, rendered in date_variants(text):
+                position = line.find(rendered)
+                if position >= 0:
+                    candidates.append((position, "date", output_format, text_format))
+            position = line.find(text)
+            if position >= 0:
+                candidates.append((position, "text", None, None))
+
+        for position, kind, output_format, text_format in candidates:
+            anchor = locate_anchor(lines, line_index, position)
+            if anchor is None:
+                continue
+            label, where, occurrence, segment_start = anchor
+            segment = line[segment_start:]
+            rule = {"kind": kind, "anchor": label, "where": where, "occurrence": occurrence}
+            if kind == "number":
+                rule["pattern"] = NUMBER_PATTERN.pattern
+                rule["type"] = "int" if isinstance(value, int) else "float"
+            elif kind == "date":
+                rule["pattern"] = date_pattern(text_format)
+                rule["text_format"] = text_format
+                rule["output_format"] = output_format
+            else:
+                rule["pattern"] = value_shape(normalize_text(value))
+            # The value is the n-th match of the pattern after the anchor
+            starts = [match.start() for match in re.finditer(rule["pattern"], segment)]
+            offset = position - segment_start
+            if offset not in starts:
+                continue
+            rule["index"] = starts.index(offset)
+            read_back = read_scalar(lines, rule, decimal)
+            if read_back == value or (is_number(value) and is_number(read_back) and numbers_equal(read_back, value)):
+                return rule
+    return None
+
+def read_scalar(lines, rule, decimal):
+    """Read a scalar with a learned rule, returning MISSING when it cannot be found"""
+    if rule["kind"] == "constant":
+        if rule.get("present") and normalize_text(rule["value"]) not in normalize_text("\n".join(lines)):
+            return MISSING
+        return rule["value"]
+    segment = value_segment(lines, rule)
+    if segment is None:
+        return MISSING
+    matches = list(re.finditer(rule["pattern"], segment))
+    if len(matches) <= rule["index"]:
+        return MISSING
+    text = matches[rule["index"]].group()
+    try:
+        if rule["kind"] == "number":
+            number = parse_number(text, decimal)
+            return int(number) if rule["type"] == "int" else number
+        if rule["kind"] == "date":
+            return datetime.strptime(text, rule["text_format"]).strftime(rule["output_format"])
+    except ValueError:
+        return MISSING
+    return text
+
+def parse_tables(lines):
+    """Group markdown table rows by header; returns {header: [rows]} in document order"""
+    tables = {}
+    header = None
+    for line in lines:
+        stripped = line.strip()
+        if not stripped.startswith("|"):
+            header = None
+            continue
+        cells = [cell.strip() for cell in stripped.strip("|").split("|")]
+        if all(re.fullmatch(r":?-{3,}:?", cell) for cell in cells if cell):
+            continue
+        if header is None:
+            header = tuple(normalize_text(cell).lower() for cell in cells)
+            tables.setdefault(header, [])
+        else:
+            tables[header].append(cells)
+    return tables
+
+def cell_matches(cell, value, decimal):
+    """Check whether a table cell holds a value"""
+    if is_number(value):
+        for match in NUMBER_PATTERN.finditer(cell):
+            try:
+                if numbers_equal(parse_number(match.group(), decimal), value):
+                    return True
+            except ValueError:
+                continue
+        return False
+    return normalize_text(cell) == normalize_text(value)
+
+def read_cell(cell, kind, decimal):
+    """Read a typed value from a table cell"""
+    if kind == "text":
+        return normalize_text(cell)
+    match = NUMBER_PATTERN.search(cell)
+    if not match:
+        return None
+    try:
+        number = parse_number(match.group(), decimal)
+    except ValueError:
+        return None
+    return int(number) if kind == "int" else number
+
+def learn_table(lines, records, fields, decimal):
+    """
+    Learn which table and columns hold a list of records (line items or tax
+    lines). Returns a rule, or None when the records cannot be located.
+    """
+    key_label = next((label for label, _ in fields if any(not is_empty(r.get(label)) for r in records)), None)
+    if key_label is None:
+        return None
+    for header, rows in parse_tables(lines).items():
+        row_indices = []
+        start = 0
+        for record in records:
+            row_index = next((index for index in range(start, len(rows))
+                              if any(cell_matches(cell, record[key_label], decimal) for cell in rows[index])), None)
+            if row_index is None:
+                break
+            row_indices.append(row_index)
+            start = row_index + 1
+        if len(row_indices) != len(records) or row_indices != list(range(row_indices[0], row_indices[-1] + 1)):
+            continue
+
+        columns = {}
+        constants = {}
+        for label, _ in fields:
+            values = [record.get(label) for record in records]
+            if all(is_empty(value) for value in values):
+                constants[label] = values[0]
+                continue
+            column = next((index for index in range(len(header)) if all(
+                is_empty(value) or (index < len(rows[row]) and cell_matches(rows[row][index], value, decimal))
+                for value, row in zip(values, row_indices))), None)
+            if column is None:
+                if len({json.dumps(value) for value in values}) != 1:
+                    break
+                constants[label] = values[0]
+                continue
+            sample = next(value for value in values if not is_empty(value))
+            columns[label] = (column, "int" if isinstance(sample, int) and is_number(sample)
+                              else "float" if is_number(sample) else "text")
+        else:
+            return {
+                "header": list(header),
+                "leading_rows": row_indices[0],
+                "trailing_rows": len(rows) - row_indices[-1] - 1,
+                "columns": columns,
+                "constants": constants,
+            }
+    return None
+
+def read_table(lines, rule, fields, decimal):
+    """Read records with a learned table rule, or None when the table is missing"""
+    if rule is None:
+        return []
+    rows = parse_tables(lines).get(tuple(rule["header"]))
+    if rows is None:
+        return None
+    body = rows[rule["leading_rows"]:len(rows) - rule["trailing_rows"]]
+    records = []
+    for row in body:
+        record = {}
+        for label, _ in fields:
+            if label in rule["columns"]:
+                column, kind = rule["columns"][label]
+                value = read_cell(row[column], kind, decimal) if column < len(row) else None
+                record[label] = value if value is not None else ''
+            else:
+                record[label] = rule["constants"].get(label, '')
+        records.append(record)
+    return records
+
+def outputs_agree(left, right):
+    """Compare two extraction outputs field by field, ignoring formatting differences"""
+    def normalize(value):
+        if is_empty(value):
+            return ''
+        if is_number(value):
+            return round(float(value), 2)
+        if isinstance(value, dict):
+            return {key: normalize(item) for key, item in value.items()}
+        if isinstance(value, list):
+            return [normalize(item) for item in value]
+        return normalize_text(value)
+    return normalize(left) == normalize(right)
+
+def to_invoice_data(output):
+    """Validate an extraction output against the InvoiceData model"""
+    data = {}
+    for section, label, parent, field in SCALAR_FIELDS:
+        section_data = output.get(section)
+        if not section_data or is_empty(section_data.get(label)):
+            continue
+        target = data.setdefault(parent, {}) if parent else data
+        target[field] = section_data[label]
+    data["items"] = [
+        {field: item[label] for label, field in ITEM_FIELDS if not is_empty(item.get(label))}
+        for item in output.get("Items") or []
+    ]
+    data["tax_line_summaries"] = [
+        {field: line[label] for label, field in TAX_LINE_FIELDS if not is_empty(line.get(label))}
+        for line in output.get("Tax Line Summaries") or []
+    ]
+    return InvoiceData.model_validate(data)
+
+class InvoiceTemplate:
+    """
+    Learned layout of one vendor's invoices: where each field sits relative to
+    a nearby label, which table columns hold line items and tax lines, and
+    which values never change.
+    """
+
+    def __init__(self, rules, items, tax_lines, has_bill_to):
+        self.rules = rules
+        self.items = items
+        self.tax_lines = tax_lines
+        self.has_bill_to = has_bill_to
+
+    @classmethod
+    def learn(cls, markdown_text, output):
+        """Learn a template from a document and its extraction output, or return None"""
+        lines = markdown_text.split('\n')
+        decimal = detect_decimal_separator(markdown_text)
+        rules = {}
+        for section, label, _, _ in SCALAR_FIELDS:
+            section_data = output.get(section) or {}
+            value = section_data.get(label, '')
+            if is_empty(value):
+                rules[f"{section}/{label}"] = {"kind": "constant", "value": value}
+                continue
+            present = normalize_text(value) in normalize_text(markdown_text)
+            constant = {"kind": "constant", "value": value, "present": present}
+            if section in CONSTANT_FIRST_SECTIONS:
+                rules[f"{section}/{label}"] = constant
+                continue
+            rules[f"{section}/{label}"] = learn_scalar(lines, value, decimal) or constant
+
+        items = output.get("Items") or []
+        item_rule = learn_table(lines, items, ITEM_FIELDS, decimal) if items else None
+        if items and item_rule is None:
+            return None
+        tax_lines = output.get("Tax Line Summaries") or []
+        tax_rule = learn_table(lines, tax_lines, TAX_LINE_FIELDS, decimal) if tax_lines else None
+        if tax_lines and tax_rule is None:
+            return None
+        return cls(rules, item_rule, tax_rule, output.get("Bill To Details") is not None)
+
+    def anchors(self):
+        """Labels the template relies on, used to pick candidate templates"""
+        return sorted({rule["anchor"] for rule in self.rules.values() if "anchor" in rule})
+
+    def table_headers(self):
+        """Normalized headers of the item and tax line tables"""
+        return [table["header"] for table in [self.items, self.tax_lines] if table]
+
+    def matches(self, markdown_text):
+        """Check that the merchant name and every anchor appear in a document"""
+        merchant_name = normalize_text(self.merchant_name())
+        if not merchant_name or merchant_name not in normalize_text(markdown_text):
+            return False
+        return all(anchor in markdown_text for anchor in self.anchors())
+
+    def merchant_name(self):
+        """Merchant name this template was learned for"""
+        return self.rules.get("Merchant Details/Name", {}).get("value") or ''
+
+    def template_id(self):
+        """Identify the template by vendor and layout"""
+        key = json.dumps([self.merchant_name(), self.anchors(), self.table_headers()], ensure_ascii=False)
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+    def apply(self, markdown_text):
+        """Fill the extraction output from a document, or return None when any field cannot be read"""
+        lines = markdown_text.split('\n')
+        decimal = detect_decimal_separator(markdown_text)
+        output = {}
+        for section, label, _, _ in SCALAR_FIELDS:
+            value = read_scalar(lines, self.rules[f"{section}/{label}"], decimal)
+            if value is MISSING:
+                return None
+            output.setdefault(section, {})[label] = value
+        if not self.has_bill_to:
+            output["Bill To Details"] = None
+
+        items = read_table(lines, self.items, ITEM_FIELDS, decimal)
+        tax_lines = read_table(lines, self.tax_lines, TAX_LINE_FIELDS, decimal)
+        if items is None or tax_lines is None or (self.items and not items):
+            return None
+        output["Items"] = items
+        output["Tax Line Summaries"] = tax_lines
+
+        # Same key order as LlamaInvoiceParser.extract
+        order = ["Invoice Classification", "Merchant Details", "Bill To Details", "Invoice Details",
+                 "Financial Summary", "Items", "Tax Line Summaries"]
+        return {key: output[key] for key in order}
+
+    def to_json(self):
+        """Serialize for the template store"""
+        return json.dumps({"rules": self.rules, "items": self.items, "tax_lines": self.tax_lines,
+                           "has_bill_to": self.has_bill_to}, ensure_ascii=False)
+
+    @classmethod
+    def from_json(cls, text):
+        """Rebuild a template written by to_json"""
+        data = json.loads(text)
+        for table in [data["items"], data["tax_lines"]]:
+            if table:
+                table["columns"] = {label: tuple(column) for label, column in table["columns"].items()}
+        return cls(data["rules"], data["items"], data["tax_lines"], data["has_bill_to"])
+
+class TemplateStore:
+    """
+    SQLite-backed set of learned invoice templates. A template is learned from
+    a remote extraction and only used locally after it has reproduced the
+    remote result on min_verifications further invoices.
+    """
+
+    def __init__(self, db_path, min_verifications=2):
+        self.db_path = str(db_path)
+        self.min_verifications = min_verifications
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._connection.execute(
+            """CREATE TABLE IF NOT EXISTS templates (
+                template_id TEXT PRIMARY KEY,
+                merchant_name TEXT NOT NULL,
+                template TEXT NOT NULL,
+                verifications INTEGER NOT NULL DEFAULT 0,
+                uses INTEGER NOT NULL DEFAULT 0,
+                updated_at REAL NOT NULL
+            )"""
+        )
+        self._connection.commit()
+        self._templates = None
+
+    def templates(self):
+        """Return {template_id: (template, verifications)}, loaded once and kept in memory"""
+        with self._lock:
+            if self._templates is None:
+                rows = self._connection.execute("SELECT template_id, template, verifications FROM templates").fetchall()
+                self._templates = {
+                    template_id: (InvoiceTemplate.from_json(template), verifications)
+                    for template_id, template, verifications in rows
+                }
+            return dict(self._templates)
+
+    def candidates(self, markdown_text, template_ids=None):
+        """
+        Templates whose anchors all appear in the document, most verified
+        first. template_ids limits the check to those templates.
+        """
+        templates = self.templates()
+        if template_ids is not None:
+            templates = {template_id: templates[template_id] for template_id in template_ids if template_id in templates}
+        matches = [
+            (template_id, template, verifications)
+            for template_id, (template, verifications) in templates.items()
+            if template.matches(markdown_text)
+        ]
+        return sorted(matches, key=lambda match: match[2], reverse=True)
+
+    def extract(self, markdown_data, template_ids=None):
+        """
+        Extract an invoice locally with a verified template. Returns
+        (output, template_id), or (None, None) when no template matches with
+        full confidence. template_ids limits the lookup to those templates.
+        """
+        markdown_text = document_text(markdown_data)
+        for template_id, template, verifications in self.candidates(markdown_text, template_ids):
+            if verifications < self.min_verifications:
+                continue
+            output = template.apply(markdown_text)
+            if output is None:
+                continue
+            try:
+                to_invoice_data(output)
+            except Exception:
+                continue
+            with self._lock:
+                self._connection.execute("UPDATE templates SET uses = uses + 1 WHERE template_id = ?", (template_id,))
+                self._connection.commit()
+            return output, template_id
+        return None, None
+
+    def learn(self, markdown_data, output):
+        """
+        Record a remote extraction: verify the templates that reproduce it,
+        and learn a new template when none does. Returns the template id or None.
+        """
+        markdown_text = document_text(markdown_data)
+        for template_id, template, verifications in self.candidates(markdown_text):
+            if outputs_agree(template.apply(markdown_text), output):
+                self._save(template_id, template, verifications + 1)
+                return template_id
+
+        template = InvoiceTemplate.learn(markdown_text, output)
+        if template is None or not outputs_agree(template.apply(markdown_text), output):
+            return None
+        template_id = template.template_id()
+        self._save(template_id, template, 0)
+        return template_id
+
+    def _save(self, template_id, template, verifications):
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO templates "
+                "(template_id, merchant_name, template, verifications, uses, updated_at) VALUES "
+                "(?, ?, ?, ?, COALESCE((SELECT uses FROM templates WHERE template_id = ?), 0), ?)",
+                (template_id, normalize_text(template.merchant_name()), template.to_json(), verifications,
+                 template_id, time.time())
+            )
+            self._connection.commit()
+            if self._templates is not None:
+                self._templates[template_id] = (template, verifications)
+
+    def stats(self):
+        """Report template counts and local extractions"""
+        with self._lock:
+            templates, verified, uses = self._connection.execute(
+                "SELECT COUNT(*), COALESCE(SUM(verifications >= ?), 0), COALESCE(SUM(uses), 0) FROM templates",
+                (self.min_verifications,)
+            ).fetchone()
+        return {"templates": templates, "verified": verified, "local_extractions": uses}
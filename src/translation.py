@@ -1,20 +1,142 @@
+import asyncio
 import os
+import re
+from concurrent.futures import ThreadPoolExecutor
 from openai import OpenAI
 from dotenv import load_dotenv
+from .batching import TRANSLATION_BATCHING, TranslationBatcher
+from .chunking import TRANSLATION_CHUNK_CHARS, chunk_prompt_text, group_segments, split_markdown_chunks, stitch_chunks
+from .language_detection import StopwordLanguageDetector
+from .masking import TRANSLATION_MASKING, mask_text, needs_translation, unmask_text
+from .metrics import get_metrics, record_token_usage, timed
+from .scheduler import estimate_tokens, get_scheduler
+from .translation_memory import join_segments, split_segments
+
+DETECTION_MODEL = "openai/gpt-4.1"
+TRANSLATION_MODEL = "mistralai/mistral-medium-3"
+
+SEGMENT_MARKER = re.compile(r"^<<<(\d+)>>>[ \t]*$", re.MULTILINE)
+# Markers of a combined request carry the caller's section: <<<section.n>>>
+SECTION_SEGMENT_MARKER = re.compile(r"^<<<(\d+)\.(\d+)>>>[ \t]*$", re.MULTILINE)
+
+# Chunks of long pages are translated concurrently on this pool
+_chunk_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("TRANSLATION_CHUNK_WORKERS", "4")), thread_name_prefix="translation-chunk"
+)
+
+def parse_segment_response(response_text, expected_count):
+    """
+    Split a response on <<<n>>> markers. Returns the texts in marker order,
+    or None when the markers 1..expected_count did not all survive exactly once.
+    """
+    markers = list(SEGMENT_MARKER.finditer(response_text))
+    if [int(marker.group(1)) for marker in markers] != list(range(1, expected_count + 1)):
+        return None
+    
+    texts = []
+    for index, marker in enumerate(markers):
+        end = markers[index + 1].start() if index + 1 < len(markers) else len(response_text)
+        texts.append(response_text[marker.end():end].strip())
+    return texts
+
+def parse_section_response(response_text, section_counts):
+    """
+    Split a combined response on <<<section.n>>> markers. Returns one list of
+    texts per section, or None for a section whose markers 1..count did not
+    all survive exactly once, so other sections can still be used.
+    """
+    sections = {}
+    markers = list(SECTION_SEGMENT_MARKER.finditer(response_text))
+    for index, marker in enumerate(markers):
+        end = markers[index + 1].start() if index + 1 < len(markers) else len(response_text)
+        sections.setdefault(int(marker.group(1)), []).append(
+            (int(marker.group(2)), response_text[marker.end():end].strip())
+        )
+
+    results = []
+    for section, count in enumerate(section_counts, 1):
+        texts = sections.get(section, [])
+        if [number for number, _ in texts] != list(range(1, count + 1)):
+            results.append(None)
+        else:
+            results.append([text for _, text in texts])
+    return results
 
 class MarkdownTranslator:
-    def __init__(self):
+    def __init__(self, local_detector=None, local_confidence_threshold=None):
         load_dotenv()
-        self.client = OpenAI(base_url=os.getenv('BASE_URL'), api_key=os.getenv("OPENAI_API_KEY"))
+        # Retries and rate limits are handled by the shared request scheduler
+        self.client = OpenAI(base_url=os.getenv('BASE_URL'), api_key=os.getenv("OPENAI_API_KEY"), max_retries=0)
+        self.scheduler = get_scheduler()
+        self.batcher = TranslationBatcher(self.send_segments, self.send_segment_sections) if TRANSLATION_BATCHING else None
+        self.detection_model = DETECTION_MODEL
+        self.translation_model = TRANSLATION_MODEL
+        
+        # Local detector answers confident cases offline; set LOCAL_LANGUAGE_DETECTION=false to always use the LLM
+        if local_detector is None and os.getenv("LOCAL_LANGUAGE_DETECTION", "true").lower() != "false":
+            local_detector = StopwordLanguageDetector()
+        self.local_detector = local_detector
+        if local_confidence_threshold is None:
+            local_confidence_threshold = float(os.getenv("LOCAL_LANGUAGE_CONFIDENCE", "0.6"))
+        self.local_confidence_threshold = local_confidence_threshold
+
+    def warm_up(self):
+        """
+        Open a pooled connection to the translation endpoint ahead of the first invoice
+        """
+        try:
+            self.client.models.list()
+        except Exception:
+            # Some OpenAI-compatible endpoints do not list models; the connection is still opened
+            pass
+
+    def complete(self, model, messages, output_ratio=0.0):
+        """
+        Send a chat completion through the request scheduler. output_ratio is the
+        expected response length relative to the prompt, for the token budget.
+        """
+        prompt_tokens = estimate_tokens(*(message["content"] for message in messages))
+        response = self.scheduler.call(
+            f"openai:{model}",
+            self.client.chat.completions.create,
+            model=model,
+            messages=messages,
+            estimated_tokens=int(prompt_tokens * (1 + output_ratio)),
+            usage=lambda response: response.usage.total_tokens if response.usage else None
+        )
+        record_token_usage(model, response.usage)
+        return response
 
     def detect_language(self, text):
+        """
+        Detect the language of the given text, locally when confident, otherwise using OpenAI API
+        """
+        source_language, _ = self.detect_language_with_source(text)
+        return source_language
+
+    def detect_language_with_source(self, text):
+        """
+        Detect the language of the given text and report which detector answered.
+        Returns (language, source) where source is 'local' or 'llm'.
+        """
+        if self.local_detector is not None:
+            source_language, confidence = self.local_detector.detect(text)
+            if source_language and confidence >= self.local_confidence_threshold:
+                get_metrics().increment("language_detections_total", source="local")
+                return source_language, 'local'
+        
+        get_metrics().increment("language_detections_total", source="llm")
+        return self.detect_language_llm(text), 'llm'
+
+    @timed("detect_language")
+    def detect_language_llm(self, text):
         """
         Detect the language of the given text using OpenAI API
         """
         try:
-            response = self.client.chat.completions.create(
-                model="openai/gpt-4.1",
-                messages=[
+            response = self.complete(
+                self.detection_model,
+                [
                     {"role": "system", "content": "You are a language detection expert. Respond with only the ISO 639-1 language code."},
                     {"role": "user", "content": f"Detect the language of this text and respond with only the ISO 639-1 language code: {text[:1000]}"}
                 ]
@@ -23,18 +145,72 @@ class MarkdownTranslator:
         except Exception as e:
             raise Exception(f"Error detecting language: {str(e)}")
 
-    def translate_to_english(self, markdown_text):
+    def translate_to_english(self, markdown_text, source_language=None):
+        """
+        Translate markdown text to English while preserving the markdown structure.
+        Language detection is skipped when the caller already knows source_language.
         """
-        Translate markdown text to English while preserving the markdown structure
+        translated_text, _ = self.translate_to_english_with_calls(markdown_text, source_language)
+        return translated_text
+
+    @timed("translate_to_english")
+    def translate_to_english_with_calls(self, markdown_text, source_language=None):
+        """
+        Translate markdown text to English and count the chat completions it took.
+        Returns (translated_text, llm_calls).
         """
         try:
-            # First detect the language
-            source_language = self.detect_language(markdown_text)
+            llm_calls = 0
+            # First detect the language, unless it was resolved by the caller
+            if source_language is None:
+                source_language, detection_source = self.detect_language_with_source(markdown_text)
+                if detection_source == 'llm':
+                    llm_calls += 1
             
             # If already English, return as is
             if source_language.lower() == 'en':
-                return markdown_text
+                return markdown_text, llm_calls
+
+            # Send only the natural-language segments; markdown syntax and numbers stay literal
+            if TRANSLATION_MASKING:
+                parts = split_segments(markdown_text)
+                segments = [text for kind, text in parts if kind != "literal"]
+                unique = list(dict.fromkeys(segments))
+                translations, segment_calls = self.translate_segments(unique, source_language) if unique else ([], 0)
+                llm_calls += segment_calls
+                if translations is not None:
+                    translated = dict(zip(unique, translations))
+                    return join_segments(parts, [translated[segment] for segment in segments]), llm_calls
+
+            translated_text, markdown_calls = self.translate_markdown(markdown_text, source_language)
+            return translated_text, llm_calls + markdown_calls
+        except Exception as e:
+            raise Exception(f"Error translating text: {str(e)}")
+
+    def translate_markdown(self, markdown_text, source_language):
+        """
+        Translate markdown text to English as markdown, in chunks for long pages.
+        Returns (translated_text, llm_calls).
+        """
+        try:
+            # Long pages are split at paragraph and table row boundaries and translated in parallel
+            if len(markdown_text) > TRANSLATION_CHUNK_CHARS:
+                chunks = split_markdown_chunks(markdown_text)
+                if len(chunks) > 1:
+                    translations = list(_chunk_executor.map(
+                        lambda chunk: self.translate_chunk(chunk_prompt_text(chunk), source_language), chunks
+                    ))
+                    return stitch_chunks(chunks, translations), len(chunks)
 
+            return self.translate_chunk(markdown_text, source_language), 1
+        except Exception as e:
+            raise Exception(f"Error translating text: {str(e)}")
+
+    def translate_chunk(self, markdown_text, source_language):
+        """
+        Translate markdown text to English in a single request
+        """
+        try:
             # Prepare the translation prompt
             system_prompt = """You are a professional translator and markdown expert. 
             Your task is to translate the given markdown text to English while:
@@ -46,41 +222,175 @@ class MarkdownTranslator:
             6. Preserving all the numbers strictly without changing the commas and decimals
             Respond with only the translated markdown text."""
 
-            response = self.client.chat.completions.create(
-                model="mistralai/mistral-medium-3",
-                messages=[
+            response = self.complete(
+                self.translation_model,
+                [
                     {"role": "system", "content": system_prompt},
                     {"role": "user", "content": f"Translate this markdown text from {source_language} to English:\n\n{markdown_text}."}
                 ],
-                #temperature=0.3
+                output_ratio=1.0
             )
             
             return response.choices[0].message.content.strip()
         except Exception as e:
             raise Exception(f"Error translating text: {str(e)}")
 
-    def process_markdown(self, markdown_text):
+    @timed("translate_segments")
+    def translate_segments(self, segments, source_language):
         """
-        Process markdown text: detect language and translate if needed
+        Translate a list of text segments. Numbers, identifiers and links are
+        replaced with {{n}} placeholders first and restored in the translations.
+        Returns (translations, llm_calls); translations is None when markers or
+        placeholders were not preserved, so callers can fall back.
+        """
+        if not TRANSLATION_MASKING:
+            return self.request_segments(segments, source_language)
+
+        masked = [mask_text(segment) for segment in segments]
+        # Segments left with nothing but placeholders and punctuation are not sent, and line items
+        # that differ only in their numbers are sent once
+        pending = list(dict.fromkeys(text for text, _ in masked if needs_translation(text)))
+        translations, llm_calls = self.request_segments(pending, source_language) if pending else ([], 0)
+        if translations is None:
+            return None, llm_calls
+
+        translated = dict(zip(pending, translations))
+        results = list(segments)
+        for index, (text, values) in enumerate(masked):
+            if text not in translated:
+                continue
+            restored = unmask_text(translated[text], values)
+            if restored is None:
+                return None, llm_calls
+            results[index] = restored
+        return results, llm_calls
+
+    def request_segments(self, segments, source_language):
+        """
+        Translate a list of text segments in a single request. Each segment is sent
+        under a numbered <<<n>>> marker and the response is split on the same markers.
+        Long lists are sent as several concurrent requests. Returns (translations,
+        llm_calls); translations is None when the markers were not preserved.
+        """
+        groups = group_segments(segments)
+        if len(groups) > 1:
+            results = list(_chunk_executor.map(lambda group: self.request_segments(group, source_language), groups))
+            llm_calls = sum(calls for _, calls in results)
+            if any(translations is None for translations, _ in results):
+                return None, llm_calls
+            return [text for translations, _ in results for text in translations], llm_calls
+
+        # Short requests may share one request with other pages and invoices
+        if self.batcher is not None:
+            return self.batcher.translate(segments, source_language)
+        return self.send_segments(segments, source_language), 1
+
+    def send_segments(self, segments, source_language):
+        """
+        Send numbered segments as one request and split the response on the markers
         """
         try:
-            # Detect language
-            source_language = self.detect_language(markdown_text)
+            numbered_segments = "\n".join(f"<<<{i}>>>\n{segment}" for i, segment in enumerate(segments, 1))
+            response_text = self.request_numbered(numbered_segments, source_language, "<<<1>>>")
+            return parse_segment_response(response_text, len(segments))
+        except Exception as e:
+            raise Exception(f"Error translating segments: {str(e)}")
+
+    def send_segment_sections(self, sections, source_language):
+        """
+        Send the segment lists of several callers as one request. Each segment is
+        numbered within its caller's section as <<<section.n>>>, and the response
+        is split and checked per section. Returns one translation list per
+        section, None for a section whose markers were not preserved.
+        """
+        try:
+            numbered_segments = "\n".join(
+                f"<<<{section}.{i}>>>\n{segment}"
+                for section, segments in enumerate(sections, 1)
+                for i, segment in enumerate(segments, 1)
+            )
+            response_text = self.request_numbered(numbered_segments, source_language, "<<<1.1>>>")
+            return parse_section_response(response_text, [len(segments) for segments in sections])
+        except Exception as e:
+            raise Exception(f"Error translating segments: {str(e)}")
+
+    def request_numbered(self, numbered_segments, source_language, example_marker):
+        """Send segments introduced by marker lines and return the raw response text"""
+        system_prompt = f"""You are a professional translator. 
+            You receive numbered text segments taken from an invoice, each introduced by a marker line like {example_marker}.
+            Translate every segment to English while:
+            1. Keeping every marker line exactly as it is, in the same order
+            2. Translating each segment independently and completely
+            3. Preserving all the numbers strictly without changing the commas and decimals
+            4. Keeping special characters and inline formatting intact
+            5. Keeping placeholders like {{{{1}}}} exactly as they are; they stand for numbers and identifiers
+            Respond with only the marker lines and the translated segments."""
+
+        response = self.complete(
+            self.translation_model,
+            [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": f"Translate these segments from {source_language} to English:\n\n{numbered_segments}"}
+            ],
+            output_ratio=1.0
+        )
+        return response.choices[0].message.content
+
+    def process_markdown(self, markdown_text, source_language=None):
+        """
+        Process markdown text: detect language and translate if needed.
+        Pass source_language to reuse a document-level detection result.
+        """
+        try:
+            llm_calls = 0
+            
+            # Detect language, unless it was resolved by the caller
+            if source_language is None:
+                source_language, detection_source = self.detect_language_with_source(markdown_text)
+                if detection_source == 'llm':
+                    llm_calls += 1
             
             # If not English, translate
             if source_language.lower() != 'en':
-                translated_text = self.translate_to_english(markdown_text)
+                translated_text, translation_calls = self.translate_to_english_with_calls(markdown_text, source_language)
+                llm_calls += translation_calls
                 return {
                     'source_language': source_language,
                     'translated_text': translated_text,
-                    'was_translated': True
+                    'was_translated': True,
+                    'llm_calls': llm_calls
                 }
             
             return {
                 'source_language': source_language,
                 'translated_text': markdown_text,
-                'was_translated': False
+                'was_translated': False,
+                'llm_calls': llm_calls
             }
             
         except Exception as e:
             raise Exception(f"Error processing markdown: {str(e)}")
+
+    async def adetect_language(self, text):
+        """
+        Async variant of detect_language, run in a worker thread
+        """
+        return await asyncio.to_thread(self.detect_language, text)
+
+    async def adetect_language_with_source(self, text):
+        """
+        Async variant of detect_language_with_source, run in a worker thread
+        """
+        return await asyncio.to_thread(self.detect_language_with_source, text)
+
+    async def atranslate_to_english(self, markdown_text, source_language=None):
+        """
+        Async variant of translate_to_english, run in a worker thread
+        """
+        return await asyncio.to_thread(self.translate_to_english, markdown_text, source_language)
+
+    async def aprocess_markdown(self, markdown_text, source_language=None):
+        """
+        Async variant of process_markdown, run in a worker thread
+        """
+        return await asyncio.to_thread(self.process_markdown, markdown_text, source_language)
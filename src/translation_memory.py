@@ -0,0 +1,207 @@
+import hashlib
+import re
+import sqlite3
+import threading
+import time
+
+TABLE_ROW = re.compile(r"^\s*\|.*\|\s*$")
+TABLE_SEPARATOR = re.compile(r"^\s*\|?\s*:?-{3,}:?\s*(\|\s*:?-{3,}:?\s*)*\|?\s*$")
+LINE_PREFIX = re.compile(r"^(\s*(?:#{1,6}\s+|[-*+]\s+|\d+[.)]\s+|>\s*)?)(.*)$")
+HAS_LETTERS = re.compile(r"[^\W\d_]", re.UNICODE)
+
+def add_text_part(parts, text, kind):
+    """Append text as a translatable segment, keeping surrounding whitespace literal"""
+    core = text.strip()
+    if not core or not HAS_LETTERS.search(core):
+        # Numbers, punctuation and whitespace pass through untouched
+        parts.append(("literal", text))
+        return
+    start = text.index(core)
+    if start:
+        parts.append(("literal", text[:start]))
+    parts.append((kind, core))
+    if start + len(core) < len(text):
+        parts.append(("literal", text[start + len(core):]))
+
+def is_plain_line(line):
+    """Check whether a line is ordinary paragraph text"""
+    if not line.strip() or TABLE_ROW.match(line) or TABLE_SEPARATOR.match(line):
+        return False
+    return not LINE_PREFIX.match(line).group(1)
+
+def split_segments(markdown_text):
+    """
+    Split markdown into a list of (kind, text) parts. kind is 'literal' for
+    markdown syntax and untranslatable text, 'block' for paragraphs, headings
+    and list items, and 'cell' for table cells. Joining all texts in order
+    gives back the original markdown.
+    """
+    parts = []
+    lines = markdown_text.split('\n')
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        if is_plain_line(line):
+            # Consecutive plain lines form one paragraph segment
+            end = i
+            while end + 1 < len(lines) and is_plain_line(lines[end + 1]):
+                end += 1
+            add_text_part(parts, '\n'.join(lines[i:end + 1]), "block")
+            i = end
+        elif not line.strip() or TABLE_SEPARATOR.match(line):
+            parts.append(("literal", line))
+        elif TABLE_ROW.match(line):
+            for index, cell in enumerate(line.split('|')):
+                if index:
+                    parts.append(("literal", '|'))
+                add_text_part(parts, cell, "cell")
+        else:
+            prefix, body = LINE_PREFIX.match(line).groups()
+            if prefix:
+                parts.append(("literal", prefix))
+            add_text_part(parts, body, "block")
+
+        if i < len(lines) - 1:
+            parts.append(("literal", '\n'))
+        i += 1
+    return parts
+
+def join_segments(parts, translations):
+    """Rebuild markdown from split parts, substituting translated segments in order"""
+    translated = iter(translations)
+    output = []
+    for kind, text in parts:
+        if kind == "literal":
+            output.append(text)
+        elif kind == "cell":
+            # A cell must stay on one line and must not introduce new columns
+            output.append(next(translated).replace('\n', ' ').replace('|', '/'))
+        else:
+            output.append(next(translated))
+    return "".join(output)
+
+class TranslationMemory:
+    """
+    SQLite-backed translation memory for markdown segments (paragraphs,
+    headings, list items and table cells). Known segments are served locally
+    and only the unknown remainder of a page is sent to the translator.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = str(db_path)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._connection.execute(
+            """CREATE TABLE IF NOT EXISTS segments (
+                segment_key TEXT PRIMARY KEY,
+                source_language TEXT NOT NULL,
+                model TEXT NOT NULL,
+                source_text TEXT NOT NULL,
+                translated_text TEXT NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0,
+                last_used REAL NOT NULL
+            )"""
+        )
+        self._connection.commit()
+
+    @staticmethod
+    def segment_key(segment, source_language, model):
+        """Generate the lookup key for one segment"""
+        return hashlib.sha256(f"{model}\n{source_language.lower()}\n{segment}".encode('utf-8')).hexdigest()
+
+    def lookup(self, segments, source_language, model):
+        """Return a dict of segment -> translation for segments already in memory"""
+        keys = {self.segment_key(segment, source_language, model): segment for segment in set(segments)}
+        if not keys:
+            return {}
+        found = {}
+        with self._lock:
+            key_list = list(keys)
+            # Stay well below SQLite's bound-parameter limit
+            for start in range(0, len(key_list), 500):
+                chunk = key_list[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._connection.execute(
+                    f"SELECT segment_key, translated_text FROM segments WHERE segment_key IN ({placeholders})", chunk
+                ).fetchall()
+                for segment_key, translated_text in rows:
+                    found[keys[segment_key]] = translated_text
+            if found:
+                hit_keys = [key for key, segment in keys.items() if segment in found]
+                self._connection.executemany(
+                    "UPDATE segments SET hits = hits + 1, last_used = ? WHERE segment_key = ?",
+                    [(time.time(), key) for key in hit_keys]
+                )
+                self._connection.commit()
+        return found
+
+    def store(self, translations, source_language, model):
+        """Store new segment translations"""
+        now = time.time()
+        rows = [
+            (self.segment_key(segment, source_language, model), source_language.lower(), model, segment, translated, now)
+            for segment, translated in translations.items()
+        ]
+        with self._lock:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO segments "
+                "(segment_key, source_language, model, source_text, translated_text, hits, last_used) "
+                "VALUES (?, ?, ?, ?, ?, 0, ?)",
+                rows
+            )
+            self._connection.commit()
+
+    def evict(self, max_age_seconds):
+        """Remove segments not used within max_age_seconds, returning how many were removed"""
+        with self._lock:
+            cursor = self._connection.execute(
+                "DELETE FROM segments WHERE last_used < ?", (time.time() - max_age_seconds,)
+            )
+            self._connection.commit()
+        return cursor.rowcount
+
+    def stats(self):
+        """Report segment count, stored text size and total hits"""
+        with self._lock:
+            segments, text_bytes, hits = self._connection.execute(
+                "SELECT COUNT(*), COALESCE(SUM(LENGTH(source_text) + LENGTH(translated_text)), 0), "
+                "COALESCE(SUM(hits), 0) FROM segments"
+            ).fetchone()
+        return {"segments": segments, "text_bytes": text_bytes, "hits": hits}
+
+    def process_markdown(self, translator, markdown_text, source_language):
+        """
+        Translate a page through the memory. Returns the same result shape as
+        MarkdownTranslator.process_markdown plus segment hit/miss counts.
+        """
+        model = translator.translation_model
+        parts = split_segments(markdown_text)
+        segments = [text for kind, text in parts if kind != "literal"]
+        known = self.lookup(segments, source_language, model)
+
+        # Deduplicate unknown segments while keeping first-seen order
+        unknown = list(dict.fromkeys(segment for segment in segments if segment not in known))
+        llm_calls = 0
+        if unknown:
+            translated_unknown, llm_calls = translator.translate_segments(unknown, source_language)
+            if translated_unknown is None:
+                # Markers were not preserved: translate the page as markdown instead
+                translated_text, markdown_calls = translator.translate_markdown(markdown_text, source_language)
+                return {
+                    'source_language': source_language,
+                    'translated_text': translated_text,
+                    'was_translated': True,
+                    'llm_calls': llm_calls + markdown_calls,
+                    'segments': {'hits': len(set(segments)) - len(unknown), 'misses': len(unknown)}
+                }
+            new_translations = dict(zip(unknown, translated_unknown))
+            self.store(new_translations, source_language, model)
+            known.update(new_translations)
+
+        return {
+            'source_language': source_language,
+            'translated_text': join_segments(parts, [known[segment] for segment in segments]),
+            'was_translated': True,
+            'llm_calls': llm_calls,
+            'segments': {'hits': len(set(segments)) - len(unknown), 'misses': len(unknown)}
+        }
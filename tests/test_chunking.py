@@ -0,0 +1,28 @@
+from src.chunking import split_markdown_chunks, stitch_chunks, strip_repeated_header
+
+HEADER = ["| Pos. | Beschreibung | Menge |", "|---|---|---|"]
+
+def test_repeated_header_is_removed_from_translation():
+    translated = "| Item | Description | Quantity |\n|---|---|---|\n| 7 | Toner | 2 |\n| 8 | Paper | 5 |"
+    assert strip_repeated_header(translated, HEADER) == "| 7 | Toner | 2 |\n| 8 | Paper | 5 |"
+
+def test_translation_without_header_is_kept():
+    translated = "| 7 | Toner | 2 |\n| 8 | Paper | 5 |\n| 9 | Staples | 1 |"
+    assert strip_repeated_header(translated, HEADER) == translated
+
+def test_separator_of_another_table_is_not_taken_for_the_header():
+    translated = "Subtotal\n|---|---|\n| 7 | Toner | 2 |"
+    assert strip_repeated_header(translated, HEADER) == translated
+
+def test_table_rows_survive_chunking_and_stitching():
+    rows = "\n".join(f"| {index} | Artikel {index} | {index % 4 + 1} |" for index in range(1, 61))
+    markdown_text = "\n".join(HEADER) + "\n" + rows
+    chunks = split_markdown_chunks(markdown_text, max_chars=400)
+    assert len(chunks) > 1 and all(chunk['header'] == HEADER for chunk in chunks[1:])
+
+    # An identity "translation" that drops the repeated header of the last chunk
+    translations = [
+        chunk['text'] if index == len(chunks) - 1 else ('\n'.join(chunk['header']) + '\n' if chunk['header'] else '') + chunk['text']
+        for index, chunk in enumerate(chunks)
+    ]
+    assert stitch_chunks(chunks, translations) == markdown_text
@@ -0,0 +1,48 @@
+from types import SimpleNamespace
+
+from src.dedup import DuplicateIndex
+
+LINES = [
+    (f"Wartung Standort {index}", index % 3 + 1, 49.0 + index) for index in range(1, 25)
+]
+
+def recurring_invoice(invoice_id, invoice_date, service_month):
+    """A monthly invoice of one vendor; only the ID, dates and month differ between months"""
+    rows = "\n".join(
+        f"| {index} | {description} | {quantity} | {price:.2f} | {quantity * price:.2f} |"
+        for index, (description, quantity, price) in enumerate(LINES, start=1)
+    )
+    net = sum(quantity * price for _, quantity, price in LINES)
+    text = (
+        f"# Rechnung {invoice_id}\n\nMüller Gebäudeservice GmbH\nHauptstraße 12, 10115 Berlin\n\n"
+        f"Rechnungsdatum: {invoice_date}\nLeistungszeitraum: {service_month}\n\n"
+        "| Pos. | Beschreibung | Menge | Einzelpreis | Gesamt |\n|---|---|---|---|---|\n"
+        f"{rows}\n\nNettobetrag: {net:.2f} EUR\nMwSt. 19 %: {net * 0.19:.2f} EUR\n"
+        f"Gesamtbetrag: {net * 1.19:.2f} EUR\n\nZahlbar innerhalb von 14 Tagen ohne Abzug."
+    )
+    extraction = {
+        "Merchant Details": {"Name": "Müller Gebäudeservice GmbH"},
+        "Invoice Details": {"Invoice ID": invoice_id},
+        "Financial Summary": {"Total Amount": round(net * 1.19, 2)},
+    }
+    return [SimpleNamespace(text=text)], extraction
+
+def test_recurring_invoice_is_only_suspected_and_cleared_by_extraction(tmp_path):
+    index = DuplicateIndex(tmp_path / "duplicates.sqlite")
+    march, march_extraction = recurring_invoice("RE-2024-0001", "31.03.2024", "März 2024")
+    april, april_extraction = recurring_invoice("RE-2024-0002", "30.04.2024", "April 2024")
+    index.register("sha256-march", march, march_extraction, "march.pdf")
+
+    match = index.find("sha256-april", april, "april.pdf")
+    assert match is not None and match["kind"] == "suspected"
+    assert index.confirm(match, april_extraction) is None
+
+def test_rescan_is_confirmed_by_extraction(tmp_path):
+    index = DuplicateIndex(tmp_path / "duplicates.sqlite")
+    march, march_extraction = recurring_invoice("RE-2024-0001", "31.03.2024", "März 2024")
+    rescan = [SimpleNamespace(text=march[0].text.replace("Hauptstraße", "Hauptstrasse"))]
+    index.register("sha256-march", march, march_extraction, "march.pdf")
+
+    match = index.find("sha256-rescan", rescan, "march-scan.pdf")
+    assert match is not None and match["kind"] == "suspected"
+    assert index.confirm(match, march_extraction)["kind"] == "near"
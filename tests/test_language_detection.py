@@ -0,0 +1,32 @@
+from src.language_detection import StopwordLanguageDetector
+
+def test_french_with_de_is_not_taken_for_spanish():
+    detector = StopwordLanguageDetector()
+    language, confidence = detector.detect("Facture de prestation de services de nettoyage de bureaux")
+    assert language == "fr" and confidence > 0
+
+def test_french_boilerplate_is_french():
+    language, _ = StopwordLanguageDetector().detect("Conditions générales de vente de la société")
+    assert language == "fr"
+
+def test_text_without_stopwords_has_no_language():
+    assert StopwordLanguageDetector().detect("12.03.2024 4.711,00 EUR") == (None, 0.0)
+
+def test_page_screen_ignores_short_numeric_and_boilerplate_pages():
+    detector = StopwordLanguageDetector()
+    pages = [
+        "Total 100 EUR",
+        "| 12.03.2024 | RE-2024-0017 | 4.711,00 |",
+        "Conditions générales de vente de la société",
+        "Facture de prestation de services de nettoyage de bureaux",
+    ]
+    assert not any(detector.differs_from(page, "fr", min_confidence=0.6) for page in pages)
+
+def test_page_screen_flags_a_page_in_another_language():
+    detector = StopwordLanguageDetector()
+    terms = (
+        "Terms and conditions. All invoices are due within 14 days. Please pay the total amount "
+        "to our bank account and quote the invoice number."
+    )
+    assert detector.differs_from(terms, "de", min_confidence=0.6)
+    assert not detector.differs_from(terms, "en", min_confidence=0.6)